@@ -0,0 +1,225 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from jobs import QueueClosed
+
+# Upper bound on commands accepted in one /batch request.
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
+# How often the feeder re-checks running items and saves the batch.
+BATCH_POLL_INTERVAL = 0.5
+
+
+class BatchItem:
+    def __init__(self, index, command, data, result=None):
+        self.index = index
+        self.command = command
+        self.data = data
+        self.job = None
+        # Set up front for items answered without running (result cache hits).
+        self.result = result
+
+    @property
+    def status(self):
+        if self.result is not None:
+            return 'done' if self.result.get('success') else 'failed'
+        return self.job.status if self.job else 'pending'
+
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def percent(self):
+        if self.finished():
+            return 100.0
+        progress = self.job.progress if self.job else None
+        return (progress or {}).get('percent') or 0.0
+
+    def to_dict(self):
+        info = {
+            'index': self.index,
+            'command': self.command,
+            'job_id': self.job.id if self.job else None,
+            'status': self.status,
+            'percent': self.percent(),
+        }
+        result = self.result if self.result is not None else (self.job.result if self.job else None)
+        if self.finished() and result:
+            info['result'] = {k: result.get(k) for k in ('success', 'message', 'output_file', 'cached', 'error')
+                              if k in result}
+        return info
+
+
+class Batch:
+    def __init__(self, items, max_concurrency, store=None):
+        self.id = uuid.uuid4().hex
+        self.items = items
+        self.max_concurrency = max_concurrency
+        self.store = store
+        self.status = 'running'  # running -> done
+        self.created_at = time.time()
+        self.finished_at = None
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def finished(self):
+        return self.status == 'done'
+
+    def touch(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+        if self.store:
+            self.store.save(self)
+
+    def wait_for_update(self, seen_version, timeout=None):
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen_version, timeout=timeout)
+            return self.version
+
+    def to_dict(self):
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        total = len(self.items)
+        return {
+            'batch_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'max_concurrency': self.max_concurrency,
+            'total': total,
+            'counts': counts,
+            'percent': round(sum(item.percent() for item in self.items) / total, 1) if total else 100.0,
+            'items': [item.to_dict() for item in self.items],
+        }
+
+
+class StoredBatch:
+    """Read-only view of a batch fed by another worker process."""
+
+    def __init__(self, store, batch_id, info, version):
+        self.store = store
+        self.id = batch_id
+        self.info = info
+        self.version = version
+
+    def finished(self):
+        return self.info['status'] == 'done'
+
+    def to_dict(self):
+        return self.info
+
+    def wait_for_update(self, seen_version, timeout=None):
+        deadline = time.time() + (timeout or 0)
+        while True:
+            found = self.store.row(self.id)
+            if found:
+                self.info, self.version = found
+            if self.version != seen_version or time.time() >= deadline:
+                return self.version
+            time.sleep(BATCH_POLL_INTERVAL)
+
+
+class BatchStore:
+    """SQLite snapshots of batches, so any worker process can report on them."""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, created_at REAL, version INTEGER, info TEXT)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def save(self, batch):
+        info = json.dumps(batch.to_dict())
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?)",
+                             (batch.id, batch.created_at, batch.version, info))
+            self._db.commit()
+
+    def row(self, batch_id):
+        with self._lock:
+            found = self._db.execute("SELECT info, version FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return (json.loads(found[0]), found[1]) if found else None
+
+    def load(self, batch_id):
+        found = self.row(batch_id)
+        return StoredBatch(self, batch_id, *found) if found else None
+
+    def prune(self, cutoff):
+        with self._lock:
+            self._db.execute("DELETE FROM batches WHERE created_at < ?", (cutoff,))
+            self._db.commit()
+
+
+class BatchRunner:
+    """Feeds batch items into the shared JobQueue, at most ``max_concurrency``
+    of a batch at a time.
+
+    Items run as ordinary jobs (so FFMPEG_WORKERS still bounds the machine
+    and each item has its own /jobs/<id>); one feeder thread per batch tops
+    up the running set as items finish and publishes the aggregate state.
+    """
+
+    def __init__(self, job_queue, store=None, ttl=24 * 3600):
+        self.job_queue = job_queue
+        self.store = store
+        self.ttl = ttl
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, items, handler, max_concurrency):
+        batch = Batch(items, max(1, max_concurrency), store=self.store)
+        with self._lock:
+            cutoff = time.time() - self.ttl
+            for batch_id in [b.id for b in self._batches.values() if b.finished_at and b.finished_at < cutoff]:
+                del self._batches[batch_id]
+            self._batches[batch.id] = batch
+        if self.store:
+            self.store.prune(time.time() - self.ttl)
+            self.store.save(batch)
+        threading.Thread(target=self._feed, args=(batch, handler), name=f'batch-{batch.id[:8]}', daemon=True).start()
+        print(f"[BATCH] {batch.id}: {len(items)} item(s), concurrency {batch.max_concurrency}", file=sys.stderr)
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+        if batch is None and self.store:
+            batch = self.store.load(batch_id)
+        return batch
+
+    def _feed(self, batch, handler):
+        pending = [item for item in batch.items if not item.finished()]
+        running = []
+        last_state = None
+        while pending or running:
+            while pending and len(running) < batch.max_concurrency:
+                item = pending.pop(0)
+                try:
+                    item.job = self.job_queue.submit('batch', handler, item.data)
+                except QueueClosed as e:
+                    for item in [item] + pending:
+                        item.result = {'success': False, 'message': str(e)}
+                    pending = []
+                    break
+                running.append(item)
+            if running:
+                running[0].job.wait_for_update(running[0].job.version, timeout=BATCH_POLL_INTERVAL)
+            running = [item for item in running if not item.finished()]
+            state = [(item.status, item.percent()) for item in batch.items]
+            if state != last_state:
+                last_state = state
+                batch.touch()
+        batch.status = 'done'
+        batch.finished_at = time.time()
+        batch.touch()
+        counts = batch.to_dict()['counts']
+        print(f"[BATCH] {batch.id} finished in {batch.finished_at - batch.created_at:.1f}s: {counts}",
+              file=sys.stderr)
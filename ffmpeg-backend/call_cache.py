@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Cached function calls unused for this long are dropped.
+CALL_CACHE_TTL = int(os.environ.get('CALL_CACHE_TTL', 7 * 24 * 3600))
+# Past this many entries the least recently used are evicted.
+CALL_CACHE_MAX_ENTRIES = int(os.environ.get('CALL_CACHE_MAX_ENTRIES', 5000))
+
+# Slot kinds, in the order they are abstracted out of a prompt.
+_SLOT_PATTERNS = (
+    ('u', re.compile(r'\b\w+://\S+')),
+    # An extension has a letter, so decimals like 2.25 stay numbers.
+    ('f', re.compile(r'[\w\-]+(?:\.[\w\-]+)*\.(?=[0-9]*[A-Za-z])[A-Za-z0-9]{2,4}\b')),
+    ('t', re.compile(r'\b\d+:\d{2}(?::\d{2})?(?:\.\d+)?\b')),
+    ('n', re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?!\w|\.\d)')),
+)
+
+
+def normalize(prompt):
+    """``(template, slots)``: the prompt lowercased with URLs, filenames,
+    timestamps and numbers replaced by ``{f0}``-style slots, and the
+    original values by slot name."""
+    slots = {}
+    text = prompt.strip()
+    for kind, pattern in _SLOT_PATTERNS:
+        count = 0
+
+        def replace(match):
+            nonlocal count
+            name = f'{kind}{count}'
+            count += 1
+            slots[name] = match.group(0)
+            return '{' + name + '}'
+
+        text = pattern.sub(replace, text)
+    # Case and spacing don't change the request; the slot names must survive lowercasing.
+    text = ' '.join(text.lower().split()).rstrip('.!?')
+    return text, slots
+
+
+def _to_template(value, slots):
+    """``value`` with slot values swapped for ``{"$slot": name}`` markers;
+    also returns the slot names used."""
+    if isinstance(value, dict):
+        used, out = set(), {}
+        for k, v in value.items():
+            out[k], sub = _to_template(v, slots)
+            used |= sub
+        return out, used
+    if isinstance(value, list):
+        used, out = set(), []
+        for v in value:
+            item, sub = _to_template(v, slots)
+            out.append(item)
+            used |= sub
+        return out, used
+    for name, raw in slots.items():
+        if isinstance(value, str) and value == raw:
+            return {'$slot': name}, {name}
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and name[0] == 'n' \
+                and float(raw) == value:
+            return {'$slot': name, 'type': type(value).__name__}, {name}
+    return value, set()
+
+
+def _fill(template, slots):
+    """``template`` with its slots filled; ValueError when a value doesn't
+    fit the type the slot was learned with (2.5 where an int was used)."""
+    if isinstance(template, dict):
+        if '$slot' in template:
+            raw = slots[template['$slot']]
+            kind = template.get('type')
+            if kind == 'int':
+                value = float(raw)
+                if not value.is_integer():
+                    raise ValueError(f'{raw} is not an integer')
+                return int(value)
+            return float(raw) if kind == 'float' else raw
+        return {k: _fill(v, slots) for k, v in template.items()}
+    if isinstance(template, list):
+        return [_fill(v, slots) for v in template]
+    return template
+
+
+def tools_version(tool_meta):
+    """Changes whenever any tool's name, route or schema changes."""
+    return hashlib.sha256(json.dumps(tool_meta, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class CallCache:
+    """Normalized prompt -> validated ``function_call`` template, in SQLite.
+
+    A call is only stored when every slot of the prompt maps to an argument
+    verbatim, so a hit for different filenames or numbers is filled in
+    exactly as the model would have. Entries belong to one tools version
+    and are dropped when the tool metadata changes; they expire after
+    ``ttl`` seconds unused, and past ``max_entries`` the least recently
+    used go first.
+    """
+
+    def __init__(self, db_path, version, ttl=CALL_CACHE_TTL, max_entries=CALL_CACHE_MAX_ENTRIES):
+        self.version = version
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS calls (key TEXT PRIMARY KEY, version TEXT, template TEXT,"
+            " created_at REAL, last_used REAL, hits INTEGER DEFAULT 0)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS calls_last_used ON calls (last_used)")
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("DELETE FROM calls WHERE version != ? OR last_used < ?",
+                             (version, time.time() - ttl))
+            self._db.commit()
+        self.hits = self.misses = self.stores = 0
+
+    def get(self, prompt):
+        """The function_call for ``prompt`` filled from the cache, or None."""
+        key, slots = normalize(prompt)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT template FROM calls WHERE key = ? AND version = ? AND last_used >= ?",
+                                   (key, self.version, now - self.ttl)).fetchone()
+            try:
+                function_call = _fill(json.loads(row[0]), slots) if row else None
+            except ValueError:
+                function_call = None
+            if function_call is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE calls SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return function_call
+
+    def put(self, prompt, function_call):
+        """Remember a call that ran successfully; returns whether it was
+        cacheable (every slot used verbatim)."""
+        if not function_call or not function_call.get('name'):
+            return False
+        key, slots = normalize(prompt)
+        template, used = _to_template(function_call, slots)
+        if used != set(slots):
+            return False
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO calls (key, version, template, created_at, last_used) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET version = excluded.version, template = excluded.template,"
+                " last_used = excluded.last_used",
+                (key, self.version, json.dumps(template), now, now))
+            self._db.execute(
+                "DELETE FROM calls WHERE key IN (SELECT key FROM calls ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            self._db.commit()
+            self.stores += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            entries, total_hits = self._db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM calls").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'lifetime_hits': total_hits,
+            'tools_version': self.version,
+        }
@@ -0,0 +1,323 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Set to 0 to let /run and /batch queue commands without the pre-flight check.
+COMMAND_PREFLIGHT = os.environ.get('COMMAND_PREFLIGHT', '1') not in ('0', 'false', 'no')
+# Bump when the parsed inventory format changes, so old caches are rebuilt.
+CAPABILITIES_VERSION = 2
+
+CATALOGS = ('ffmpegFilters.json', 'AudioFilters.json')
+
+_SIMPLE_FILTER_OPTS = {'-vf': 'V', '-af': 'A'}
+_COMPLEX_FILTER_OPTS = ('-filter_complex', '-lavfi')
+_CODEC_OPTS = {'-vcodec': 'V', '-acodec': 'A', '-scodec': 'S'}
+_STREAM_TYPES = {'v': 'V', 'a': 'A', 's': 'S'}
+_TYPE_NAMES = {'V': 'video', 'A': 'audio', 'S': 'subtitle'}
+_FLAGS_RE = re.compile(r'^[A-Z.]+$')
+_NAME_RE = re.compile(r'^([A-Za-z0-9_]+)(@[A-Za-z0-9_]+)?')
+_LABEL_RE = re.compile(r'^\s*\[([^\]]*)\]')
+_TRAILING_LABELS_RE = re.compile(r'(\s*\[[^\]]*\])+\s*$')
+_STREAM_LABEL_RE = re.compile(r'^(\d+)(:.*)?$')
+
+
+def _split(text, sep):
+    """``text`` split on unescaped, unquoted ``sep``; quotes and escapes are kept."""
+    parts, current, quoted, escaped = [], [], False, False
+    for ch in text:
+        if escaped:
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch == "'":
+            quoted = not quoted
+        elif ch == sep and not quoted:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    if quoted:
+        raise ValueError('unbalanced quote')
+    parts.append(''.join(current))
+    return parts
+
+
+def parse_filtergraph(graph):
+    """``[{name, options, inputs, outputs}]`` for every filter in ``graph``.
+
+    Raises ValueError on syntax ffmpeg would reject (unbalanced quotes or
+    labels, empty filters, missing names).
+    """
+    filters = []
+    for chain in _split(graph, ';'):
+        if not chain.strip():
+            continue
+        for segment in _split(chain, ','):
+            rest = segment.strip()
+            if not rest:
+                raise ValueError('empty filter in chain')
+            inputs = []
+            while (match := _LABEL_RE.match(rest)):
+                inputs.append(match.group(1))
+                rest = rest[match.end():].lstrip()
+            match = _NAME_RE.match(rest)
+            if not match:
+                raise ValueError(f'expected a filter name at {rest[:20]!r}')
+            name, rest = match.group(1), rest[match.end():]
+            outputs = []
+            trailing = _TRAILING_LABELS_RE.search(rest)
+            if trailing:
+                outputs = re.findall(r'\[([^\]]*)\]', trailing.group(0))
+                rest = rest[:trailing.start()]
+            if rest and not rest.startswith('='):
+                raise ValueError(f'unexpected {rest[:20]!r} after {name}')
+            if '[' in rest.replace("\\[", '') and "'" not in rest:
+                raise ValueError(f'unbalanced label in {name}')
+            options = [p.split('=', 1)[0].strip() for p in _split(rest[1:], ':') if '=' in p.split("'", 1)[0]] if rest else []
+            filters.append({'name': name, 'options': options, 'inputs': inputs, 'outputs': outputs})
+    if not filters:
+        raise ValueError('empty filtergraph')
+    return filters
+
+
+def load_catalogs(root, names=CATALOGS):
+    """Filter name -> ``{type, params}`` from the JSON catalogs in ``root``."""
+    catalog = {}
+    for name in names:
+        try:
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                categories = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[CAPS] could not load {name}: {e}", file=sys.stderr)
+            continue
+        for category in categories:
+            for entry in category.get('filters', []):
+                known = catalog.setdefault(entry['value'], {'type': entry.get('ffmpeg_type'), 'params': set()})
+                known['params'].update(p['name'] for p in entry.get('parameters', []) if p.get('name'))
+    return catalog
+
+
+def _list_lines(text):
+    # Listings start after a legend; entries are "<flags> <name> ...".
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and _FLAGS_RE.match(parts[0]) and parts[1] != '=':
+            yield parts
+
+
+def parse_filters(text):
+    """Filter name -> ``[input types, output types]`` from ``ffmpeg -filters``."""
+    filters = {}
+    for parts in _list_lines(text):
+        if len(parts) >= 3 and '->' in parts[2]:
+            filters[parts[1]] = parts[2].split('->', 1)
+    return filters
+
+
+def parse_encoders(text):
+    """Encoder name -> type letter (V/A/S) from ``ffmpeg -encoders``."""
+    return {parts[1]: parts[0][0] for parts in _list_lines(text)
+            if len(parts[0]) == 6 and parts[0][0] in 'VAS'}
+
+
+def parse_codecs(text):
+    """Codec name -> ``[type letter, has an encoder]`` from ``ffmpeg -codecs``."""
+    return {parts[1]: [parts[0][2], parts[0][1] == 'E'] for parts in _list_lines(text)
+            if len(parts[0]) == 6 and parts[0][2] in 'VAS'}
+
+
+def parse_muxers(text):
+    """Muxer names from ``ffmpeg -muxers``."""
+    muxers = set()
+    for parts in _list_lines(text):
+        if 'E' in parts[0] and set(parts[0]) <= set('DEd.'):
+            muxers.update(parts[1].split(','))
+    return sorted(muxers)
+
+
+class Capabilities:
+    """What the installed ffmpeg can do, plus the shipped filter catalogs.
+
+    The binary's filter/encoder/codec/muxer listings are gathered once (four
+    concurrent runs) and cached on disk, keyed by the binary's path, size
+    and mtime, so restarts don't spawn ffmpeg at all. Until the inventory
+    is loaded, commands are only checked for syntax.
+    """
+
+    def __init__(self, cache_path, catalog_root, binary='ffmpeg'):
+        self.cache_path = cache_path
+        self.binary = binary
+        self.catalog = load_catalogs(catalog_root)
+        self.filters = self.encoders = self.codecs = self.muxers = None
+        self.built_at = None
+        self.ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._started = False
+
+    def _identity(self):
+        path = shutil.which(self.binary)
+        if not path:
+            return None
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return [CAPABILITIES_VERSION, path, st.st_size, st.st_mtime]
+
+    def start(self):
+        """Load (or build) the inventory on a background thread."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._load, name='capabilities', daemon=True).start()
+
+    def _load(self):
+        try:
+            identity = self._identity()
+            if identity is None:
+                print(f"[CAPS] {self.binary} not found; checking syntax only", file=sys.stderr)
+                return
+            try:
+                with open(self.cache_path) as f:
+                    cached = json.load(f)
+                if cached.get('identity') == identity:
+                    self._apply(cached)
+                    return
+            except (OSError, ValueError):
+                pass
+            self._apply(self._build(identity))
+        except Exception as e:
+            print(f"[CAPS] inventory failed: {e}", file=sys.stderr)
+
+    def _build(self, identity):
+        started = time.time()
+
+        def listing(flag):
+            return subprocess.run([self.binary, '-hide_banner', flag], capture_output=True,
+                                  text=True, timeout=30).stdout
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            filters, encoders, codecs, muxers = pool.map(listing, ('-filters', '-encoders', '-codecs', '-muxers'))
+        inventory = {
+            'identity': identity,
+            'built_at': time.time(),
+            'filters': parse_filters(filters),
+            'encoders': parse_encoders(encoders),
+            'codecs': parse_codecs(codecs),
+            'muxers': parse_muxers(muxers),
+        }
+        if not (inventory['filters'] and inventory['encoders'] and inventory['muxers']):
+            # An empty listing would make every command look invalid.
+            raise RuntimeError(f'could not parse the listings of {self.binary}')
+        tmp_path = f"{self.cache_path}.{threading.get_ident()}.part"
+        with open(tmp_path, 'w') as f:
+            json.dump(inventory, f)
+        os.replace(tmp_path, self.cache_path)
+        print(f"[CAPS] indexed {len(inventory['filters'])} filters, {len(inventory['encoders'])} encoders, "
+              f"{len(inventory['codecs'])} codecs, {len(inventory['muxers'])} muxers in {time.time() - started:.2f}s", file=sys.stderr)
+        return inventory
+
+    def _apply(self, inventory):
+        self.filters = inventory['filters']
+        self.encoders = inventory['encoders']
+        self.codecs = inventory.get('codecs') or {}
+        self.muxers = set(inventory['muxers'])
+        self.built_at = inventory['built_at']
+        self.ready.set()
+
+    def check(self, args):
+        """``(errors, warnings)`` for an ffmpeg argv, without running it."""
+        errors, warnings = [], []
+        input_count = args.count('-i')
+        last_input = max((i for i, arg in enumerate(args) if arg == '-i'), default=-1)
+        for i, opt in enumerate(args[:-1]):
+            value = args[i + 1]
+            # Options before the last -i belong to inputs (demuxers, decoders).
+            is_output = i > last_input
+            if opt in _SIMPLE_FILTER_OPTS or opt in _COMPLEX_FILTER_OPTS or opt.startswith('-filter:'):
+                kind = _SIMPLE_FILTER_OPTS.get(opt)
+                if opt.startswith('-filter:'):
+                    kind = _STREAM_TYPES.get(opt.split(':')[1][:1])
+                self._check_graph(opt, value, kind, opt in _COMPLEX_FILTER_OPTS, input_count, errors, warnings)
+            elif is_output and (opt in _CODEC_OPTS or opt.split(':')[0] in ('-c', '-codec')):
+                kind = _CODEC_OPTS.get(opt) or _STREAM_TYPES.get(opt.split(':')[1][:1] if ':' in opt else '')
+                self._check_codec(opt, value, kind, errors, warnings)
+            elif is_output and opt == '-f' and self.muxers is not None:
+                if value not in self.muxers:
+                    errors.append(f"Unknown output format '{value}' for -f.")
+        return errors, warnings
+
+    def _check_codec(self, opt, value, kind, errors, warnings):
+        if self.encoders is None or value == 'copy':
+            return
+        found = self.encoders.get(value)
+        if found is None:
+            # A codec name ("h264", "mp3") selects that codec's default encoder.
+            codec = self.codecs.get(value)
+            if codec is None:
+                if self.codecs:
+                    errors.append(f"Encoder '{value}' ({opt}) is not available in this ffmpeg build.")
+                else:
+                    warnings.append(f"Encoder '{value}' ({opt}) is not listed by this ffmpeg build.")
+                return
+            found, encodable = codec
+            if not encodable:
+                errors.append(f"Codec '{value}' ({opt}) has no encoder in this ffmpeg build.")
+                return
+        if kind and found != kind:
+            errors.append(f"Encoder '{value}' encodes {_TYPE_NAMES[found]} but was given to {opt}.")
+
+    def _check_graph(self, opt, graph, kind, complex_graph, input_count, errors, warnings):
+        try:
+            filters = parse_filtergraph(graph)
+        except ValueError as e:
+            errors.append(f"Invalid filtergraph for {opt}: {e}.")
+            return
+        produced, consumed = {}, set()
+        for f in filters:
+            name = f['name']
+            if self.filters is not None and name not in self.filters:
+                errors.append(f"Unknown filter '{name}' in {opt}.")
+                continue
+            io = self.filters.get(name) if self.filters else None
+            if kind and io and set(io[0] + io[1]) <= {'A', 'V'} and kind not in io[0] + io[1]:
+                errors.append(f"'{name}' only processes {_TYPE_NAMES[io[0][0]]} and cannot be used in {opt}.")
+            known = self.catalog.get(name)
+            if known and known['params']:
+                for option in f['options']:
+                    if option not in known['params']:
+                        warnings.append(f"Option '{option}' of '{name}' is not in the filter catalog.")
+            for label in f['outputs']:
+                if label in produced:
+                    errors.append(f"Label [{label}] is produced twice in {opt}.")
+                produced[label] = name
+            for label in f['inputs']:
+                stream = _STREAM_LABEL_RE.match(label)
+                if stream:
+                    if complex_graph and int(stream.group(1)) >= input_count:
+                        errors.append(f"[{label}] refers to input {stream.group(1)}, but there are only "
+                                      f"{input_count} input(s).")
+                    continue
+                if label in consumed:
+                    errors.append(f"Label [{label}] is consumed twice in {opt}.")
+                consumed.add(label)
+        if complex_graph:
+            for label in consumed - set(produced):
+                errors.append(f"Label [{label}] in {opt} is never produced.")
+
+    def stats(self):
+        return {
+            'ready': self.ready.is_set(),
+            'built_at': self.built_at,
+            'filters': len(self.filters or ()),
+            'encoders': len(self.encoders or ()),
+            'codecs': len(self.codecs or ()),
+            'muxers': len(self.muxers or ()),
+            'catalog_filters': len(self.catalog),
+        }
+
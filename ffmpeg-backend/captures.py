@@ -0,0 +1,292 @@
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+from ffmpeg_progress import ProgressParser, with_progress, OUTPUT_TAIL_LINES
+
+# Minimum interval between stats writes to the shared capture store.
+STATS_SAVE_INTERVAL = 1.0
+# How long a capture has to prove it started before /start reports success.
+STARTUP_CHECK_SECONDS = 0.5
+
+
+class CaptureError(Exception):
+    def __init__(self, message, status=400, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+class Capture:
+    def __init__(self, command, output_file):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.output_file = output_file
+        self.status = 'recording'  # recording -> stopping -> stopped | failed
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.returncode = None
+        self.stats = None
+        self.pid = None
+        self.proc = None
+        self.tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'session_id': self.id,
+            'command': self.command,
+            'filename': self.output_file,
+            'status': self.status,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'returncode': self.returncode,
+            'pid': self.pid,
+            'stats': self.stats,
+        }
+
+
+class CaptureRegistry:
+    """Concurrent ffmpeg captures keyed by session id.
+
+    Each capture runs in its own process group with stdin kept open, so it
+    can be asked to finish cleanly with ``q`` (ffmpeg then writes the MP4
+    moov atom). stdout carries -progress stats and stderr is drained into a
+    bounded tail, so neither pipe can fill up and stall the recording.
+
+    Session rows live in SQLite: any server process can list captures, read
+    their stats, or stop one it doesn't own (by sending SIGINT to the
+    capture's process group, which ffmpeg also treats as a clean stop).
+    A row's PID is only signalled while it still belongs to that capture's
+    ffmpeg; rows whose process is gone are marked failed.
+    """
+
+    def __init__(self, cwd, db_path):
+        self.cwd = cwd
+        self._captures = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS captures ("
+            " id TEXT PRIMARY KEY, command TEXT, filename TEXT, status TEXT,"
+            " started_at REAL, stopped_at REAL, returncode INTEGER, pid INTEGER, stats TEXT)"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._reconcile()
+
+    def _reconcile(self):
+        # Rows left 'recording' by a restart or a worker that exited.
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, pid FROM captures WHERE status IN ('recording', 'stopping')").fetchall()
+        stale = [session_id for session_id, pid in rows if not _is_capture_process(pid)]
+        for session_id in stale:
+            self._mark_failed(session_id)
+        if stale:
+            print(f"[CAPTURE] marked {len(stale)} orphaned session(s) failed", file=sys.stderr)
+
+    def _mark_failed(self, session_id):
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE captures SET status = 'failed', stopped_at = ? WHERE id = ?"
+                " AND status IN ('recording', 'stopping')", (time.time(), session_id))
+            self._db.commit()
+
+    def _save(self, capture):
+        info = capture.to_dict()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO captures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (info['session_id'], info['command'], info['filename'], info['status'],
+                 info['started_at'], info['stopped_at'], info['returncode'], info['pid'],
+                 json.dumps(info['stats']) if info['stats'] is not None else None))
+            self._db.commit()
+
+    def _load(self, session_id):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT id, command, filename, status, started_at, stopped_at, returncode, pid, stats"
+                " FROM captures WHERE id = ?", (session_id,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def start(self, command, output_file):
+        capture = Capture(command, output_file)
+        capture.proc = subprocess.Popen(
+            with_progress(command),
+            shell=True,
+            cwd=self.cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors='replace',
+            start_new_session=True,
+        )
+        capture.pid = capture.proc.pid
+        with self._lock:
+            self._captures[capture.id] = capture
+        self._save(capture)
+        threading.Thread(target=lambda: capture.tail.extend(capture.proc.stderr), daemon=True).start()
+        threading.Thread(target=self._monitor, args=(capture,), daemon=True).start()
+        print(f"[CAPTURE] {capture.id} started (pid {capture.pid}) -> {output_file}", file=sys.stderr)
+
+        # Device errors make ffmpeg exit immediately; report them as a failed start.
+        if capture.done.wait(STARTUP_CHECK_SECONDS) and capture.returncode != 0:
+            raise CaptureError('Capture exited during startup.', status=500, output=''.join(capture.tail))
+        return capture.to_dict()
+
+    def _monitor(self, capture):
+        parser = ProgressParser()
+        saved_at = 0.0
+        for line in capture.proc.stdout:
+            info = parser.feed(line)
+            if info is None:
+                continue
+            info['elapsed'] = round(time.time() - capture.started_at, 1)
+            capture.stats = info
+            if time.time() - saved_at >= STATS_SAVE_INTERVAL:
+                saved_at = time.time()
+                self._save(capture)
+        capture.returncode = capture.proc.wait()
+        capture.stopped_at = time.time()
+        # ffmpeg exits 255 when a signal stopped it; the file is still finalized.
+        capture.status = 'stopped' if capture.returncode in (0, 255) else 'failed'
+        self._save(capture)
+        capture.done.set()
+        print(f"[CAPTURE] {capture.id} {capture.status} (exit {capture.returncode})", file=sys.stderr)
+
+    def get(self, session_id):
+        with self._lock:
+            capture = self._captures.get(session_id)
+        if capture:
+            return capture.to_dict()
+        return self._load(session_id)
+
+    def list(self, active_only=False):
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, command, filename, status, started_at, stopped_at, returncode, pid, stats"
+                " FROM captures ORDER BY started_at DESC").fetchall()
+        sessions = [_row_to_dict(row) for row in rows]
+        with self._lock:
+            for i, info in enumerate(sessions):
+                capture = self._captures.get(info['session_id'])
+                if capture:
+                    sessions[i] = capture.to_dict()
+        if active_only:
+            sessions = [s for s in sessions if s['status'] in ('recording', 'stopping')]
+        return sessions
+
+    def stop(self, session_id, timeout=15):
+        """Stop a capture gracefully and wait for ffmpeg to finalize the file."""
+        with self._lock:
+            capture = self._captures.get(session_id)
+        if capture is None:
+            return self._stop_remote(session_id, timeout)
+        if capture.done.is_set():
+            raise CaptureError('Capture is not recording.', output=''.join(capture.tail))
+
+        capture.status = 'stopping'
+        self._save(capture)
+        try:
+            capture.proc.stdin.write('q')
+            capture.proc.stdin.flush()
+            capture.proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        if not capture.done.wait(timeout):
+            _signal_group(capture.pid, signal.SIGINT)
+            if not capture.done.wait(timeout):
+                _signal_group(capture.pid, signal.SIGKILL)
+                capture.done.wait(5)
+        with self._lock:
+            self._captures.pop(session_id, None)
+        info = capture.to_dict()
+        info['output'] = ''.join(capture.tail)
+        return info
+
+    def _stop_remote(self, session_id, timeout):
+        info = self._load(session_id)
+        if not info:
+            raise CaptureError(f'Unknown capture session {session_id}.', status=404)
+        if info['status'] not in ('recording', 'stopping'):
+            raise CaptureError('Capture is not recording.')
+        if not _is_capture_process(info['pid']):
+            # The recording process is gone; its PID may belong to something else now.
+            self._mark_failed(session_id)
+            return self._load(session_id)
+        _signal_group(info['pid'], signal.SIGINT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            info = self._load(session_id)
+            if info['status'] not in ('recording', 'stopping'):
+                return info
+            time.sleep(0.2)
+        if _is_capture_process(info['pid']):
+            _signal_group(info['pid'], signal.SIGKILL)
+        else:
+            self._mark_failed(session_id)
+        return self._load(session_id)
+
+    def stop_all(self, timeout=15):
+        """Stop every capture this process started, in parallel, so their
+        files are finalized before shutdown. Returns how many were running."""
+        with self._lock:
+            ids = [i for i, capture in self._captures.items() if not capture.done.is_set()]
+
+        def stop(session_id):
+            try:
+                self.stop(session_id, timeout)
+            except CaptureError:
+                pass
+
+        threads = [threading.Thread(target=stop, args=(session_id,)) for session_id in ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(ids)
+
+
+def _is_capture_process(pid):
+    """Whether ``pid`` still leads a process group running ffmpeg (the
+    capture's shell or ffmpeg itself), rather than a reused PID."""
+    if not pid:
+        return False
+    try:
+        if os.getpgid(pid) != pid:
+            return False
+    except (ProcessLookupError, PermissionError):
+        return False
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return b'ffmpeg' in f.read()
+    except FileNotFoundError:
+        # No procfs (macOS): the process group check is all there is.
+        return not os.path.isdir('/proc')
+    except OSError:
+        return False
+
+
+def _signal_group(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _row_to_dict(row):
+    keys = ('session_id', 'command', 'filename', 'status', 'started_at', 'stopped_at', 'returncode', 'pid', 'stats')
+    info = dict(zip(keys, row))
+    info['stats'] = json.loads(info['stats']) if info['stats'] else None
+    return info
@@ -0,0 +1,230 @@
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_progress import run_ffmpeg
+
+# Segment encodes running at once. Each one is a separate ffmpeg process.
+CHUNKED_ENCODE_WORKERS = int(os.environ.get('CHUNKED_ENCODE_WORKERS', max(2, (os.cpu_count() or 1) // 4)))
+# Shorter inputs are encoded in a single pass; splitting wouldn't pay off.
+CHUNKED_ENCODE_MIN_SECONDS = float(os.environ.get('CHUNKED_ENCODE_MIN_SECONDS', 120))
+# Lower bound on segment length, so short GOPs don't produce hundreds of pieces.
+MIN_SEGMENT_SECONDS = 10.0
+
+# Options that don't take a value.
+_FLAGS = {'-y', '-n', '-an', '-vn', '-sn', '-dn', '-shortest', '-hide_banner',
+          '-nostats', '-stats', '-nostdin', '-copyts'}
+# Global options allowed before -i.
+_GLOBAL_FLAGS = {'-y', '-n', '-hide_banner', '-nostats', '-stats', '-nostdin'}
+_GLOBAL_WITH_VALUE = {'-loglevel', '-v'}
+# Output options that belong to the video encode; everything else is applied
+# when the encoded segments are muxed with the audio.
+_VIDEO_OPTS = {
+    '-c:v', '-codec:v', '-vcodec', '-vf', '-filter:v', '-b:v', '-crf', '-qp', '-q:v',
+    '-preset', '-tune', '-profile:v', '-level', '-level:v', '-pix_fmt', '-r', '-s',
+    '-g', '-keyint_min', '-sc_threshold', '-bf', '-refs', '-x264-params', '-x264opts',
+    '-x265-params', '-maxrate', '-maxrate:v', '-bufsize', '-bufsize:v', '-minrate',
+    '-aspect', '-vsync', '-fps_mode', '-threads', '-row-mt', '-tile-columns', '-deadline',
+    '-cpu-used',
+}
+# Options whose meaning depends on seeing the whole input in one run.
+_UNSPLITTABLE_OPTS = {
+    '-filter_complex', '-lavfi', '-map', '-ss', '-t', '-to', '-sseof', '-itsoffset',
+    '-pass', '-passlogfile', '-c', '-codec', '-vn', '-stream_loop', '-frames:v', '-vframes',
+    '-shortest',
+}
+_UNSPLITTABLE_FORMATS = {'hls', 'dash', 'segment', 'stream_segment', 'tee', 'null', 'image2', 'gif'}
+# Filters that depend on absolute timestamps or frame numbers.
+_TEMPORAL_FILTERS = re.compile(
+    r'(^|[,;\[\]\s])(trim|fade|select|setpts|loop|reverse|tpad|framestep|drawtext|'
+    r'minterpolate|vidstabdetect|vidstabtransform|deshake|zoompan)\b')
+
+
+class ChunkPlan:
+    def __init__(self, input_file, video_opts, mux_opts, output):
+        self.input_file = input_file
+        self.video_opts = video_opts
+        self.mux_opts = mux_opts
+        self.output = output
+
+    def ext(self):
+        return os.path.splitext(self.output)[1].lower() or '.mkv'
+
+
+def plan_chunked(args):
+    """Split an ``ffmpeg [globals] -i input [options] output`` argv for a
+    segment-parallel encode; returns a ChunkPlan, or None if the command
+    can't be split without changing its result.
+    """
+    if not args or os.path.basename(args[0]) != 'ffmpeg' or args.count('-i') != 1:
+        return None
+    i = 1
+    while args[i] != '-i':
+        if args[i] in _GLOBAL_WITH_VALUE:
+            i += 2
+        elif args[i] in _GLOBAL_FLAGS:
+            i += 1
+        else:
+            return None  # input options (seeking, formats, hwaccel) aren't carried over
+    input_file, output = args[i + 1], args[-1]
+    if '://' in output or output.startswith(('pipe:', '-')) or '%' in output:
+        return None
+
+    video_opts, mux_opts = [], []
+    opts = args[i + 2:-1]
+    j = 0
+    while j < len(opts):
+        opt = opts[j]
+        if not opt.startswith('-') or opt in _UNSPLITTABLE_OPTS:
+            return None
+        if opt in _FLAGS:
+            if opt not in _GLOBAL_FLAGS:
+                mux_opts.append(opt)
+            j += 1
+            continue
+        if j + 1 >= len(opts):
+            return None
+        value = opts[j + 1]
+        if opt == '-f' and value in _UNSPLITTABLE_FORMATS:
+            return None
+        if opt in ('-vf', '-filter:v') and _TEMPORAL_FILTERS.search(value):
+            return None
+        if opt in _VIDEO_OPTS:
+            video_opts += [opt, value]
+        elif opt not in _GLOBAL_WITH_VALUE:
+            mux_opts += [opt, value]
+        j += 2
+
+    codec = _option(video_opts, ('-c:v', '-codec:v', '-vcodec'))
+    if not codec or codec == 'copy':
+        return None  # nothing to parallelize in a remux
+    return ChunkPlan(input_file, video_opts, mux_opts, output)
+
+
+def _option(opts, names):
+    for k in range(0, len(opts) - 1, 2):
+        if opts[k] in names:
+            return opts[k + 1]
+    return None
+
+
+class _SegmentProgress:
+    def __init__(self, progress, index):
+        self.progress = progress
+        self.index = index
+
+    def update_progress(self, info):
+        self.progress.update(self.index, info)
+
+
+class _ChunkProgress:
+    """Sums per-segment progress into one snapshot for the owning job.
+
+    Each segment's run_ffmpeg() reports through a _SegmentProgress.
+    """
+
+    def __init__(self, job, duration, segments):
+        self.job = job
+        self.duration = duration
+        self.segments = segments
+        self.done = 0
+        self._out_times = {}
+        self._lock = threading.Lock()
+
+    def segment_done(self):
+        with self._lock:
+            self.done += 1
+
+    def update(self, index, info):
+        with self._lock:
+            if info.get('out_time') is not None:
+                self._out_times[index] = info['out_time']
+            encoded = sum(self._out_times.values())
+            done = self.done
+        if self.job is None:
+            return
+        percent = round(min(encoded / self.duration, 1.0) * 100, 1) if self.duration else None
+        self.job.update_progress({
+            'step': 'encode',
+            'out_time': encoded,
+            'duration': self.duration,
+            'percent': percent,
+            'fps': info.get('fps'),
+            'speed': info.get('speed'),
+            'segments': self.segments,
+            'segments_done': done,
+            'state': 'running',
+            'eta': None,
+        })
+
+
+def run_chunked(plan, cwd, scratch_root, duration, job=None, workers=CHUNKED_ENCODE_WORKERS, timeout=600):
+    """Encode ``plan`` as keyframe-aligned segments in parallel, then join them.
+
+    1. The video stream is cut at keyframes with the segment muxer (stream copy).
+    2. Each piece is encoded with the command's video options, ``workers`` at a time.
+    3. The encoded pieces are joined with the concat demuxer (stream copy) and
+       muxed with the original audio, which is encoded once by this final step
+       so there are no gaps at segment boundaries.
+
+    Returns ``(returncode, output)`` like run_ffmpeg().
+    """
+    os.makedirs(scratch_root, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='chunks-', dir=scratch_root)
+    try:
+        segment_time = max(duration / (workers * 2), MIN_SEGMENT_SECONDS)
+        split_cmd = [
+            'ffmpeg', '-y', '-i', os.path.join(cwd, plan.input_file),
+            '-map', '0:v:0', '-c', 'copy', '-an', '-sn', '-dn',
+            '-f', 'segment', '-segment_time', f'{segment_time:.3f}', '-reset_timestamps', '1',
+            'src_%05d.mkv',
+        ]
+        returncode, output = run_ffmpeg(split_cmd, cwd=work_dir, timeout=timeout,
+                                        job=job, duration=duration, step='split')
+        if returncode != 0:
+            return returncode, output
+        sources = sorted(name for name in os.listdir(work_dir) if name.startswith('src_'))
+        print(f"[CHUNKED] {plan.output}: {len(sources)} segments of ~{segment_time:.0f}s, "
+              f"{workers} workers", file=sys.stderr)
+
+        video_opts = list(plan.video_opts)
+        if '-threads' not in video_opts:
+            video_opts += ['-threads', str(max(1, (os.cpu_count() or 1) // workers))]
+        progress = _ChunkProgress(job, duration, len(sources))
+
+        def encode(index, source):
+            encoded = f'enc_{index:05d}{plan.ext()}'
+            cmd = ['ffmpeg', '-y', '-i', source, '-an', '-sn', '-dn'] + video_opts + [encoded]
+            result = run_ffmpeg(cmd, cwd=work_dir, timeout=timeout, job=_SegmentProgress(progress, index))
+            progress.segment_done()
+            return encoded, result
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chunk') as pool:
+            futures = [pool.submit(encode, i, source) for i, source in enumerate(sources)]
+            encoded = []
+            for future in futures:
+                name, (returncode, output) = future.result()
+                if returncode != 0:
+                    for pending in futures:
+                        pending.cancel()
+                    return returncode, f"Segment {name} failed:\n{output}"
+                encoded.append(name)
+
+        list_path = os.path.join(work_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for name in encoded:
+                f.write(f"file '{name}'\n")
+        mux_cmd = [
+            'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', plan.input_file, '-map', '0:v:0', '-map', '1:a?', '-c:v', 'copy',
+        ] + plan.mux_opts + [plan.output]
+        returncode, output = run_ffmpeg(mux_cmd, cwd=cwd, timeout=timeout,
+                                        job=job, duration=duration, step='mux')
+        summary = f"Chunked encode: {len(encoded)} segments on {workers} workers.\n"
+        return returncode, summary + output
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
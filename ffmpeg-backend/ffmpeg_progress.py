@@ -0,0 +1,309 @@
+import os
+import shlex
+import sys
+import subprocess
+import threading
+import time
+from collections import deque
+
+# How many lines of ffmpeg's stderr to keep for the job result.
+OUTPUT_TAIL_LINES = int(os.environ.get('FFMPEG_OUTPUT_TAIL_LINES', 200))
+
+PROGRESS_ARGS = ['-progress', 'pipe:1', '-nostats']
+
+_active = set()
+_active_lock = threading.Lock()
+
+
+def probe_duration(path, cwd=None):
+    """Container duration in seconds according to ffprobe, or None."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path,
+    ]
+    try:
+        proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=30)
+        return float(proc.stdout.strip())
+    except Exception:
+        return None
+
+
+def parse_time(value):
+    """Parse an ffmpeg time spec ("90", "1:30", "00:01:30.5") into seconds."""
+    if value is None:
+        return None
+    try:
+        seconds = 0.0
+        for part in str(value).strip().split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def guess_duration(args, cwd=None, probe=probe_duration):
+    """Expected output duration for an ffmpeg argv: first input, clamped by -t/-to."""
+    duration = None
+    if '-i' in args:
+        idx = args.index('-i')
+        if idx + 1 < len(args):
+            duration = probe(args[idx + 1], cwd=cwd)
+    for flag in ('-t', '-to'):
+        if flag in args[:-1]:
+            limit = parse_time(args[args.index(flag) + 1])
+            if limit is not None:
+                duration = min(duration, limit) if duration else limit
+    return duration
+
+
+_STDOUT_TARGETS = {'-', 'pipe:', 'pipe:1', '/dev/stdout'}
+
+
+def writes_stdout(args):
+    """Whether an ffmpeg argv sends an output to stdout (``-``, ``pipe:1``)."""
+    return any(arg in _STDOUT_TARGETS and args[i - 1] != '-i' for i, arg in enumerate(args[1:], 1))
+
+
+def with_progress(cmd):
+    """Insert -progress pipe:1 right after the ffmpeg program name.
+
+    Commands whose output goes to stdout are left alone; progress lines
+    would be interleaved with the media bytes.
+    """
+    if isinstance(cmd, str):
+        stripped = cmd.lstrip()
+        if stripped.startswith('ffmpeg '):
+            try:
+                if writes_stdout(shlex.split(stripped)):
+                    return cmd
+            except ValueError:
+                return cmd
+            return 'ffmpeg ' + ' '.join(PROGRESS_ARGS) + stripped[len('ffmpeg'):]
+        return cmd
+    if cmd and os.path.basename(cmd[0]) == 'ffmpeg' and not writes_stdout(cmd):
+        return [cmd[0]] + PROGRESS_ARGS + list(cmd[1:])
+    return cmd
+
+
+class ProgressParser:
+    """Turns the key=value stream from -progress into periodic snapshots."""
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self.started = time.time()
+        self._block = {}
+
+    def feed(self, line):
+        """Feed one line; returns a snapshot dict when a block completes."""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self._block[key] = value.strip()
+        if key != 'progress':
+            return None
+        block, self._block = self._block, {}
+        return self.snapshot(block)
+
+    def snapshot(self, block):
+        out_time = None
+        for key in ('out_time_us', 'out_time_ms'):
+            # ffmpeg reports out_time_ms in microseconds as well.
+            if block.get(key, 'N/A') not in ('N/A', ''):
+                try:
+                    out_time = int(block[key]) / 1_000_000
+                    break
+                except ValueError:
+                    pass
+        if out_time is None:
+            out_time = parse_time(block.get('out_time'))
+
+        speed = None
+        raw_speed = block.get('speed', 'N/A').rstrip('x')
+        if raw_speed not in ('N/A', ''):
+            try:
+                speed = float(raw_speed)
+            except ValueError:
+                pass
+
+        info = {
+            'frame': _to_int(block.get('frame')),
+            'fps': _to_float(block.get('fps')),
+            'bitrate': block.get('bitrate'),
+            'total_size': _to_int(block.get('total_size')),
+            'drop_frames': _to_int(block.get('drop_frames')),
+            'out_time': out_time,
+            'speed': speed,
+            'duration': self.duration,
+            'percent': None,
+            'eta': None,
+            'state': 'end' if block.get('progress') == 'end' else 'running',
+        }
+        if self.duration and out_time is not None:
+            done = max(0.0, min(out_time / self.duration, 1.0))
+            info['percent'] = round(done * 100, 1)
+            remaining = max(self.duration - out_time, 0.0)
+            if speed:
+                info['eta'] = round(remaining / speed, 1)
+            elif done > 0:
+                elapsed = time.time() - self.started
+                info['eta'] = round(elapsed * (1 - done) / done, 1)
+        if info['state'] == 'end':
+            info['percent'] = 100.0
+            info['eta'] = 0.0
+        return info
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def run_ffmpeg(cmd, cwd=None, timeout=600, job=None, duration=None, step=None, on_stderr=None):
+    """Run ffmpeg with -progress pipe:1, reporting snapshots to ``job``.
+
+    ``cmd`` is an argv list or, for the shell-based handlers, a command string.
+    stderr is drained on a separate thread and only its last
+    OUTPUT_TAIL_LINES lines are kept, so the returned output stays small;
+    ``on_stderr(line)`` sees every line as it arrives (e.g. filter logs).
+    Commands that are not ffmpeg (ffprobe via /run) run without -progress.
+    Returns ``(returncode, output)``; raises subprocess.TimeoutExpired.
+    """
+    tracked = with_progress(cmd)
+    track = tracked is not cmd
+    cmd = tracked
+    proc = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        shell=isinstance(cmd, str),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+    )
+    with _active_lock:
+        _active.add(proc)
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+
+    def drain_stderr():
+        for line in proc.stderr:
+            tail.append(line)
+            if on_stderr:
+                on_stderr(line)
+
+    drain = threading.Thread(target=drain_stderr, daemon=True)
+    drain.start()
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+
+    parser = ProgressParser(duration)
+    # Without -progress (e.g. ffprobe) stdout is the actual result; keep it all.
+    stdout_lines = deque(maxlen=OUTPUT_TAIL_LINES) if track else []
+    try:
+        for line in proc.stdout:
+            if not track:
+                stdout_lines.append(line)
+                continue
+            info = parser.feed(line)
+            if info is None:
+                if '=' not in line:
+                    stdout_lines.append(line)
+                continue
+            if step:
+                info['step'] = step
+            if job is not None:
+                job.update_progress(info)
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        drain.join(timeout=5)
+        with _active_lock:
+            _active.discard(proc)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    output = ''.join(stdout_lines) + ''.join(tail)
+    print(f"ffmpeg exited {proc.returncode}, kept {len(output)} bytes of output", file=sys.stderr)
+    return proc.returncode, output
+
+
+def stream_ffmpeg(cmd, cwd=None, timeout=60, chunk_size=64 * 1024, on_exit=None):
+    """Yield ffmpeg's stdout as it is produced, for piping into a response.
+
+    Each chunk is whatever is available on the pipe (up to ``chunk_size``),
+    so the first bytes go out as soon as ffmpeg writes them. Closing the
+    generator early (the client went away) kills ffmpeg. ``on_exit`` is
+    called with ``(returncode, output)`` when ffmpeg finished on its own.
+    """
+    proc = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    with _active_lock:
+        _active.add(proc)
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    drain = threading.Thread(
+        target=lambda: tail.extend(line.decode('utf-8', 'replace') for line in proc.stderr), daemon=True)
+    drain.start()
+    timer = threading.Timer(timeout, proc.kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        while True:
+            chunk = proc.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        proc.wait()
+        drain.join(timeout=5)
+        if on_exit:
+            on_exit(proc.returncode, ''.join(tail))
+    finally:
+        if timer:
+            timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+            print("ffmpeg stream closed early, process killed", file=sys.stderr)
+        with _active_lock:
+            _active.discard(proc)
+
+
+def terminate_all(grace=5):
+    """Stop every ffmpeg started by run_ffmpeg()/stream_ffmpeg() that is still running.
+
+    Used at shutdown so encodes don't outlive the server process.
+    """
+    with _active_lock:
+        procs = list(_active)
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return len(procs)
@@ -0,0 +1,36 @@
+import hashlib
+import os
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+_digests = {}
+_lock = threading.Lock()
+
+
+def file_digest(path):
+    """sha256 of a file's contents, memoized on (path, size, mtime).
+
+    Re-hashing only happens when the file is replaced or modified, so repeated
+    lookups of the same upload are a stat() call.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    with _lock:
+        cached = _digests.get(path)
+    if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    remember_digest(path, st, digest)
+    return digest
+
+
+def remember_digest(path, st, digest):
+    """Record a digest computed elsewhere (e.g. while streaming an upload)."""
+    with _lock:
+        _digests[os.path.abspath(path)] = (st.st_size, st.st_mtime_ns, digest)
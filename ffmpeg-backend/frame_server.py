@@ -0,0 +1,273 @@
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from fractions import Fraction
+
+# Budgets for encoded JPEGs kept in memory and under <root>/frames.
+FRAME_CACHE_MEMORY_BYTES = int(os.environ.get('FRAME_CACHE_MEMORY_BYTES', 64 * 1024 ** 2))
+FRAME_CACHE_DISK_BYTES = int(os.environ.get('FRAME_CACHE_DISK_BYTES', 512 * 1024 ** 2))
+MAX_FRAME_WIDTH = 3840
+JPEG_QUALITY = '3'  # mjpeg -q:v, 2 (best) .. 31
+
+
+class FrameError(Exception):
+    def __init__(self, message, status=500, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+class FrameServer:
+    """Still frames at arbitrary timestamps or frame numbers, as JPEG.
+
+    Each file gets a keyframe index, read once from ffprobe packet flags
+    (no decoding) and kept in SQLite next to the cache. ``snap`` requests
+    seek straight to the keyframe at or before the target, so every position
+    inside one GOP shares a single cached image. Exact requests use an input
+    seek too, which lands on the same keyframe and decodes forward only to
+    the target frame, never from the start of the file. Encoded JPEGs live
+    in a memory LRU backed by a disk LRU, and scaled variants are made from a
+    cached full-size frame when there is one.
+    """
+
+    def __init__(self, root, probe, memory_bytes=FRAME_CACHE_MEMORY_BYTES, disk_bytes=FRAME_CACHE_DISK_BYTES):
+        self.root = root
+        self.probe = probe
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, 'frames.db'), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS keyframes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, times TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS frames (key TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._keyframes = {}
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def keyframes(self, path):
+        """Sorted keyframe times in seconds from the start of ``path``."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._keyframes.get(path)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            row = self._db.execute("SELECT size, mtime_ns, times FROM keyframes WHERE path = ?", (path,)).fetchone()
+        if row and (row[0], row[1]) == stamp:
+            times = json.loads(row[2])
+        else:
+            times = self._read_keyframes(path)
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO keyframes VALUES (?, ?, ?, ?)",
+                                 (path, st.st_size, st.st_mtime_ns, json.dumps(times)))
+                self._db.commit()
+        with self._lock:
+            self._keyframes[path] = (stamp, times)
+        return times
+
+    def _read_keyframes(self, path):
+        started = time.time()
+        cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        if proc.returncode != 0:
+            raise FrameError('Could not index keyframes.', output=proc.stderr)
+        start = self._video_info(path)[1]
+        times = set()
+        for line in proc.stdout.splitlines():
+            pts, _, flags = line.partition(',')
+            if 'K' in flags and pts not in ('', 'N/A'):
+                times.add(round(max(float(pts) - start, 0.0), 6))
+        times = sorted(times) or [0.0]
+        print(f"[FRAMES] indexed {len(times)} keyframes in {os.path.basename(path)} "
+              f"({time.time() - started:.2f}s)", file=sys.stderr)
+        return times
+
+    def _video_info(self, path):
+        """(frame rate, start time) of the first video stream."""
+        probe = self.probe(path)
+        stream = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'video'), None)
+        if stream is None:
+            raise FrameError('File has no video stream.', status=422)
+        rate = None
+        for key in ('avg_frame_rate', 'r_frame_rate'):
+            try:
+                rate = Fraction(stream.get(key, '0/0'))
+            except (ValueError, ZeroDivisionError):
+                continue
+            if rate > 0:
+                break
+        try:
+            start = float(probe.get('format', {}).get('start_time', 0))
+        except (TypeError, ValueError):
+            start = 0.0
+        return float(rate) if rate else 25.0, start
+
+    def frame(self, path, t=None, frame=None, width=None, snap=False):
+        """Returns ``(key, jpeg_bytes)`` for the requested position."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        fps = self._video_info(path)[0]
+        if frame is None:
+            frame = round((t or 0.0) * fps)
+        frame = max(int(frame), 0)
+        target = frame / fps
+        if snap:
+            keyframes = self.keyframes(path)
+            target = keyframes[max(bisect.bisect_right(keyframes, target + 1e-6) - 1, 0)]
+            position = f"k{target:.6f}"
+        else:
+            position = f"f{frame}"
+        if width:
+            width = max(16, min(int(width), MAX_FRAME_WIDTH))
+        key = _frame_key(path, st, position, width)
+
+        data = self._cached(key)
+        if data is not None:
+            return key, data
+
+        # Concurrent requests for the same frame (scrubbing) share one ffmpeg.
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait(30)
+            data = self._cached(key)
+            if data is not None:
+                return key, data
+        try:
+            full = self._cached(_frame_key(path, st, position, None)) if width else None
+            if full is not None:
+                data = _scale_jpeg(full, width)
+            else:
+                # Half a frame early, so rounding can't skip past the target.
+                seek = target + 1e-4 if snap else max(target - 0.5 / fps, 0.0)
+                data = _extract(path, seek, width, snap)
+            self._remember(key, data)
+            return key, data
+        finally:
+            if owner:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def _cached(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+        try:
+            with open(self._blob_path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._db.execute("UPDATE frames SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._remember_memory(key, data)
+        return data
+
+    def _remember(self, key, data):
+        blob_path = self._blob_path(key)
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, blob_path)
+        with self._lock:
+            self._remember_memory(key, data)
+            self._db.execute("INSERT OR REPLACE INTO frames VALUES (?, ?, ?)", (key, len(data), time.time()))
+            self._db.commit()
+            self._evict_disk()
+
+    def _remember_memory(self, key, data):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def _evict_disk(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM frames").fetchone()[0]
+        if total <= self.disk_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM frames ORDER BY last_used ASC").fetchall():
+            if total <= self.disk_bytes:
+                break
+            self._db.execute("DELETE FROM frames WHERE key = ?", (key,))
+            try:
+                os.remove(self._blob_path(key))
+            except OSError:
+                pass
+            total -= size
+        self._db.commit()
+
+    def _blob_path(self, key):
+        return os.path.join(self.root, key + '.jpg')
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM frames").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_entries': entries,
+                'disk_bytes': size,
+                'indexed_files': len(self._keyframes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def _frame_key(path, st, position, width):
+    raw = f"{path}:{st.st_size}:{st.st_mtime_ns}:{position}:{width or 'full'}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _extract(path, seek, width, snap):
+    cmd = ["ffmpeg", "-v", "error", "-ss", f"{seek:.6f}"]
+    if snap:
+        # Land on the keyframe itself instead of decoding forward from it.
+        cmd.append("-noaccurate_seek")
+    cmd += ["-i", path, "-frames:v", "1"]
+    if width:
+        cmd += ["-vf", f"scale={width}:-2"]
+    cmd += ["-f", "image2pipe", "-c:v", "mjpeg", "-q:v", JPEG_QUALITY, "pipe:1"]
+    proc = subprocess.run(cmd, capture_output=True, timeout=30)
+    if proc.returncode != 0 or not proc.stdout:
+        raise FrameError('Failed to extract frame.', output=proc.stderr.decode('utf-8', 'replace'))
+    return proc.stdout
+
+
+def _scale_jpeg(data, width):
+    cmd = ["ffmpeg", "-v", "error", "-f", "image2pipe", "-c:v", "mjpeg", "-i", "pipe:0",
+           "-vf", f"scale={width}:-2", "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", JPEG_QUALITY, "pipe:1"]
+    proc = subprocess.run(cmd, input=data, capture_output=True, timeout=30)
+    if proc.returncode != 0 or not proc.stdout:
+        raise FrameError('Failed to scale frame.', output=proc.stderr.decode('utf-8', 'replace'))
+    return proc.stdout
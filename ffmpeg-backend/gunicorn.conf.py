@@ -0,0 +1,65 @@
+# Production server settings: gunicorn -c gunicorn.conf.py main:app
+import os
+import signal
+import time
+
+bind = os.environ.get('BIND', '0.0.0.0:8200')
+
+# Worker processes and the per-process concurrency model. Encodes run in
+# ffmpeg child processes driven by the job pool, so request threads only
+# ever wait on short I/O. Use gthread: the job pool, SQLite stores and pipe
+# readers rely on real threads, so gevent/eventlet monkey-patching is unsupported.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Request timeout (worker heartbeat) is independent of encode duration:
+# /run returns as soon as a job is queued and progress streams over SSE.
+timeout = int(os.environ.get('REQUEST_TIMEOUT', 120))
+keepalive = 5
+
+# On SIGTERM each worker stops taking requests and gets this long to let
+# in-flight ffmpeg jobs finish before it is killed.
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 600))
+
+# Split the cores between processes so the total number of concurrent
+# encodes stays at one per core unless FFMPEG_WORKERS says otherwise.
+os.environ.setdefault('FFMPEG_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+accesslog = '-'
+errorlog = '-'
+
+
+# Seconds kept back from graceful_timeout for killing leftover ffmpeg processes.
+SHUTDOWN_MARGIN = 10
+
+
+def post_worker_init(worker):
+    # The arbiter SIGKILLs a worker graceful_timeout after its SIGTERM, so
+    # remember when that arrived; worker_exit budgets against it.
+    handle_exit = worker.handle_exit
+
+    def on_term(sig, frame):
+        worker.term_at = time.time()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    # Runs in the worker process once it has stopped serving requests, which
+    # may be well after SIGTERM (long SSE streams finish first).
+    from main import job_queue, capture_registry
+    from ffmpeg_progress import terminate_all
+
+    deadline = (getattr(worker, 'term_at', None) or time.time()) + graceful_timeout - SHUTDOWN_MARGIN
+
+    # Captures never finish on their own; stop them so their files are finalized.
+    captures = capture_registry.stop_all(timeout=max(1.0, min(15.0, (deadline - time.time()) / 4)))
+    if captures:
+        server.log.warning("Worker %s stopped %d capture(s) on exit", worker.pid, captures)
+    unfinished = job_queue.drain(max(deadline - time.time(), 0))
+    if unfinished:
+        stopped = terminate_all()
+        server.log.warning("Worker %s exiting with %d unfinished job(s); stopped %d ffmpeg process(es)",
+                           worker.pid, len(unfinished), stopped)
@@ -0,0 +1,102 @@
+import os
+from fractions import Fraction
+
+# Renditions used when a request doesn't send its own ladder: (height, video kbit/s).
+DEFAULT_LADDER = ((1080, 5000), (720, 2800), (480, 1400), (360, 800))
+HLS_MAX_RENDITIONS = int(os.environ.get('HLS_MAX_RENDITIONS', 6))
+# Typical H.264 bitrates by height, for ladder entries that only give a height.
+_BITRATES = {2160: 14000, 1440: 8000, 1080: 5000, 720: 2800, 540: 1800, 480: 1400, 360: 800, 240: 400}
+
+
+class LadderError(Exception):
+    def __init__(self, message, status=400, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+def parse_ladder(spec, source_height=None):
+    """Validated renditions, tallest first, as ``[(height, kbps), ...]``.
+
+    ``spec`` is a list of ``{height, video_bitrate?}`` (kbit/s) or None for
+    DEFAULT_LADDER. Renditions taller than the source are dropped; if none
+    are left the source height is used on its own.
+    """
+    if spec is None:
+        ladder = list(DEFAULT_LADDER)
+    else:
+        if not isinstance(spec, list) or not spec:
+            raise LadderError('ladder must be a non-empty list of {height, video_bitrate?}.')
+        ladder = []
+        for entry in spec:
+            try:
+                height = int(entry['height'] if isinstance(entry, dict) else entry)
+                kbps = entry.get('video_bitrate') if isinstance(entry, dict) else None
+                kbps = int(str(kbps).rstrip('kK')) if kbps else _default_bitrate(height)
+            except (KeyError, TypeError, ValueError):
+                raise LadderError(f'Invalid ladder entry: {entry!r}')
+            if not 64 <= height <= 4320 or kbps <= 0:
+                raise LadderError(f'Invalid ladder entry: {entry!r}')
+            ladder.append((height - height % 2, kbps))
+    ladder = sorted(set(ladder), reverse=True)
+    if source_height:
+        fitting = [r for r in ladder if r[0] <= source_height]
+        ladder = fitting or [(source_height - source_height % 2, _default_bitrate(source_height))]
+    if len(ladder) > HLS_MAX_RENDITIONS:
+        raise LadderError(f'At most {HLS_MAX_RENDITIONS} renditions per ladder.')
+    return ladder
+
+
+def _default_bitrate(height):
+    return _BITRATES[min(_BITRATES, key=lambda h: abs(h - height))]
+
+
+def frame_rate(stream):
+    """Frame rate of an ffprobe video stream as a float, or None."""
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        try:
+            rate = Fraction(stream.get(key) or '0/1')
+        except (ValueError, ZeroDivisionError):
+            continue
+        if rate > 0:
+            return float(rate)
+    return None
+
+
+def ladder_args(input_path, ladder, segment_duration, fps=None, has_audio=True, audio_bitrate='128k'):
+    """ffmpeg argv that encodes every rendition from a single decode.
+
+    The decoded video is ``split`` once per rendition and scaled; keyframes
+    are forced on the segment grid (no scene-cut keyframes), so all
+    renditions switch cleanly at the same boundaries. Output is fMP4 HLS,
+    one ``<name>/`` directory per rendition plus ``master.m3u8``, written
+    relative to the working directory.
+    """
+    count = len(ladder)
+    names = [f"{height}p" for height, _ in ladder]
+    graph = f"[0:v]split={count}" + ''.join(f"[s{i}]" for i in range(count)) + ';' + ';'.join(
+        f"[s{i}]scale=-2:{height}:flags=bicubic[v{i}]" for i, (height, _) in enumerate(ladder))
+    cmd = ["ffmpeg", "-y", "-i", input_path, "-filter_complex", graph]
+    for i in range(count):
+        cmd += ["-map", f"[v{i}]"]
+        if has_audio:
+            cmd += ["-map", "0:a:0"]
+    cmd += ["-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main", "-pix_fmt", "yuv420p",
+            "-sc_threshold", "0", "-force_key_frames", f"expr:gte(t,n_forced*{segment_duration})"]
+    if fps:
+        gop = max(1, round(fps * segment_duration))
+        cmd += ["-g", str(gop), "-keyint_min", str(gop)]
+    for i, (_, kbps) in enumerate(ladder):
+        cmd += [f"-b:v:{i}", f"{kbps}k", f"-maxrate:v:{i}", f"{round(kbps * 1.07)}k",
+                f"-bufsize:v:{i}", f"{kbps * 2}k"]
+    if has_audio:
+        cmd += ["-c:a", "aac", "-b:a", audio_bitrate, "-ac", "2"]
+    stream_map = ' '.join(f"v:{i},a:{i},name:{name}" if has_audio else f"v:{i},name:{name}"
+                          for i, name in enumerate(names))
+    cmd += ["-f", "hls", "-hls_time", str(segment_duration), "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4", "-hls_flags", "independent_segments",
+            "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", "%v/segment_%05d.m4s",
+            "-master_pl_name", "master.m3u8", "-var_stream_map", stream_map,
+            "%v/playlist.m3u8"]
+    return cmd, names
@@ -0,0 +1,306 @@
+import json
+import os
+import sqlite3
+import sys
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+# Number of concurrent ffmpeg workers. Defaults to one per core.
+FFMPEG_WORKERS = int(os.environ.get('FFMPEG_WORKERS', os.cpu_count() or 1))
+# How long finished jobs stay queryable via /jobs/<id> (seconds).
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+# Minimum interval between progress writes to the shared job store.
+PROGRESS_SAVE_INTERVAL = 0.5
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, operation, fn, data, store=None):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.fn = fn
+        self.data = data
+        self.store = store
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.status_code = None
+        self.progress = None
+        self.version = 0
+        self._changed = threading.Condition()
+        self._saved_at = 0.0
+
+    def update_progress(self, info):
+        with self._changed:
+            self.progress = info
+            self.version += 1
+            self._changed.notify_all()
+        if self.store and time.time() - self._saved_at >= PROGRESS_SAVE_INTERVAL:
+            self._save()
+
+    def set_status(self, status):
+        with self._changed:
+            self.status = status
+            self.version += 1
+            self._changed.notify_all()
+        if self.store:
+            self._save()
+
+    def _save(self):
+        self._saved_at = time.time()
+        self.store.save(self)
+
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def wait_for_update(self, seen_version, timeout=None):
+        """Block until the job changes past ``seen_version``; returns the new version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen_version, timeout=timeout)
+            return self.version
+
+    def to_dict(self):
+        info = {
+            'job_id': self.id,
+            'operation': self.operation,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'progress': self.progress,
+        }
+        if self.finished():
+            info['result'] = self.result
+            info['status_code'] = self.status_code
+        return info
+
+
+class StoredJob(Job):
+    """Read-only view of a job owned by another worker process."""
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, store, row):
+        self.store = store
+        self._load(row)
+
+    def _load(self, row):
+        (self.id, self.operation, self.status, self.created_at, self.started_at,
+         self.finished_at, progress, result, self.status_code, self.version) = row
+        self.progress = json.loads(progress) if progress else None
+        self.result = json.loads(result) if result else None
+
+    def update_progress(self, info):
+        raise TypeError('StoredJob is read-only')
+
+    def set_status(self, status):
+        raise TypeError('StoredJob is read-only')
+
+    def wait_for_update(self, seen_version, timeout=None):
+        deadline = time.time() + (timeout or 0)
+        while True:
+            row = self.store.row(self.id)
+            if row:
+                self._load(row)
+            if self.version != seen_version or time.time() >= deadline:
+                return self.version
+            time.sleep(self.POLL_INTERVAL)
+
+
+class JobStore:
+    """SQLite mirror of job state, so any worker process can answer /jobs/<id>."""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, operation TEXT, status TEXT, created_at REAL,"
+            " started_at REAL, finished_at REAL, progress TEXT, result TEXT,"
+            " status_code INTEGER, version INTEGER)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.operation, job.status, job.created_at, job.started_at, job.finished_at,
+                 json.dumps(job.progress) if job.progress is not None else None,
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.status_code, job.version))
+            self._db.commit()
+
+    def row(self, job_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, operation, status, created_at, started_at, finished_at,"
+                " progress, result, status_code, version FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def load(self, job_id):
+        row = self.row(job_id)
+        return StoredJob(self, row) if row else None
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def prune(self, cutoff):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            self._db.commit()
+
+
+class JobQueue:
+    """Bounded pool of worker threads draining a FIFO of ffmpeg jobs.
+
+    Handlers are the same functions used by /run; they run inside an app
+    context so they can keep returning ``jsonify(...)`` responses, which are
+    unpacked into ``job.result`` / ``job.status_code`` when they finish.
+    With a ``store``, job state is also written to SQLite so that jobs
+    started by one server process can be looked up from another.
+    ``on_submit(job)`` runs as a job is queued and ``on_finish(job)`` once it
+    has a result, just before it is marked done or failed.
+    """
+
+    def __init__(self, app, workers=FFMPEG_WORKERS, store=None, on_submit=None, on_finish=None):
+        self.app = app
+        self.workers = max(1, workers)
+        self.store = store
+        self.on_submit = on_submit
+        self.on_finish = on_finish
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._local = threading.local()
+        self._accepting = True
+
+    def _ensure_started(self):
+        # Threads are started lazily so forking servers don't inherit them.
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f'ffmpeg-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, operation, fn, data):
+        job = Job(operation, fn, data, store=self.store)
+        with self._lock:
+            if not self._accepting:
+                raise QueueClosed('Server is shutting down; not accepting new jobs.')
+            self._ensure_started()
+            self._prune()
+            self._jobs[job.id] = job
+        if self.on_submit:
+            self.on_submit(job)
+        if self.store:
+            self.store.save(job)
+        self._queue.put(job)
+        print(f"[JOBS] queued {job.id} ({operation}), depth={self._queue.qsize()}", file=sys.stderr)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            job = self.store.load(job_id)
+        return job
+
+    def current_job(self):
+        """The job being executed by the calling worker thread, if any."""
+        return getattr(self._local, 'job', None)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        info = {'workers': self.workers, 'queued': self._queue.qsize(), 'jobs': counts}
+        if self.store:
+            info['all_processes'] = self.store.counts()
+        return info
+
+    def drain(self, timeout):
+        """Stop accepting jobs and wait up to ``timeout`` seconds for queued
+        and running ones to finish. Returns the jobs that did not finish."""
+        with self._lock:
+            self._accepting = False
+            pending = [j for j in self._jobs.values() if not j.finished()]
+        print(f"[JOBS] draining {len(pending)} job(s), up to {timeout}s", file=sys.stderr)
+        deadline = time.time() + timeout
+        for job in pending:
+            while not job.finished() and time.time() < deadline:
+                job.wait_for_update(job.version, timeout=max(0.0, deadline - time.time()))
+        unfinished = [j for j in pending if not j.finished()]
+        for job in unfinished:
+            job.result = {'success': False, 'message': 'Server shut down before the job finished.'}
+            job.status_code = 503
+            job.finished_at = time.time()
+            job.set_status('failed')
+        return unfinished
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+        if self.store:
+            self.store.prune(cutoff)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job.finished():
+                # Failed by drain() before a worker got to it.
+                self._queue.task_done()
+                continue
+            self._local.job = job
+            job.started_at = time.time()
+            job.set_status('running')
+            status, result, status_code = 'failed', None, None
+            try:
+                with self.app.app_context():
+                    result, status_code = _unpack_response(job.fn(job.data))
+                status = 'done' if result.get('success', status_code < 400) else 'failed'
+            except Exception as e:
+                print(f"[JOBS] {job.id} raised: {e}", file=sys.stderr)
+                print(traceback.format_exc(), file=sys.stderr)
+                result = {'success': False, 'message': 'Exception occurred.', 'error': str(e)}
+                status_code = 500
+            finally:
+                # drain() may already have failed the job; its verdict stands.
+                abandoned = job.finished()
+                if not abandoned:
+                    job.result, job.status_code = result, status_code
+                    job.finished_at = time.time()
+                if self.on_finish:
+                    try:
+                        self.on_finish(job)
+                    except Exception as e:
+                        print(f"[JOBS] {job.id} on_finish failed: {e}", file=sys.stderr)
+                if not abandoned:
+                    job.set_status(status)
+                self._local.job = None
+                self._queue.task_done()
+            print(f"[JOBS] {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s", file=sys.stderr)
+
+
+def _unpack_response(rv):
+    # Handlers return either a Response or a (Response, status) tuple.
+    status = None
+    if isinstance(rv, tuple):
+        rv, status = rv[0], rv[1]
+    if status is None:
+        status = rv.status_code
+    return (rv.get_json(silent=True) or {}), status
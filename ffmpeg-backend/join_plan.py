@@ -0,0 +1,96 @@
+from collections import Counter
+
+# Codecs the joined output may keep without re-encoding (browser playable in MP4).
+COPYABLE_VIDEO = {'h264'}
+COPYABLE_AUDIO = {'aac'}
+
+_X264_PROFILES = {'constrained baseline': 'baseline', 'baseline': 'baseline', 'main': 'main', 'high': 'high'}
+
+
+def stream_signature(probe):
+    """The stream parameters that have to agree for ``-c copy`` concatenation.
+
+    The concat demuxer keeps the first file's codec extradata (SPS/PPS,
+    AudioSpecificConfig), so that has to match too, not just the headline
+    parameters.
+    """
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None) or {}
+    if video is None:
+        return None
+    return (
+        video.get('codec_name'), video.get('profile'), video.get('level'),
+        video.get('width'), video.get('height'),
+        video.get('pix_fmt'), video.get('sample_aspect_ratio', '1:1'), video.get('r_frame_rate'),
+        video.get('time_base'), video.get('extradata_hash'),
+        audio.get('codec_name'), audio.get('profile'), audio.get('sample_rate'),
+        audio.get('channels'), audio.get('channel_layout'), audio.get('extradata_hash'),
+    )
+
+
+def _copyable(signature):
+    # Without extradata hashes (an old probe) a match can't be trusted.
+    return (signature is not None
+            and signature[0] in COPYABLE_VIDEO
+            and (signature[1] or '').lower() in _X264_PROFILES
+            and signature[9] is not None
+            and signature[10] in COPYABLE_AUDIO | {None})
+
+
+def plan_join(probes):
+    """Decide how to concatenate inputs with the given ffprobe results.
+
+    Returns ``(mode, reference, mismatched)``:
+    ``'copy'`` when every input shares a browser-playable signature,
+    ``'normalize'`` when some differ, and ``'reencode'`` when no input can
+    serve as the reference. In ``'normalize'`` mode ``mismatched`` lists
+    every input: re-encoding only the odd ones out would leave pieces whose
+    extradata differs from the copied originals, which the concat demuxer
+    can't join, so all are encoded alike to ``reference`` first.
+    """
+    signatures = [stream_signature(p) if p else None for p in probes]
+    candidates = Counter(s for s in signatures if _copyable(s))
+    if not candidates:
+        return 'reencode', None, list(range(len(probes)))
+    # Most common copyable signature; ties go to the earliest input.
+    best = max(candidates.values())
+    reference = next(s for s in signatures if candidates.get(s) == best)
+    if all(s == reference for s in signatures):
+        return 'copy', reference, []
+    return 'normalize', reference, list(range(len(probes)))
+
+
+def normalize_args(input_path, has_audio, reference, output_path):
+    """ffmpeg argv that re-encodes one input to the reference signature."""
+    (_, profile, _, width, height, pix_fmt, sar, frame_rate, time_base, _,
+     audio_codec, _, sample_rate, channels, _, _) = reference
+    sar = sar if sar and sar != '0:1' else '1:1'
+    vf = (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+          f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar={sar.replace(':', '/')},"
+          f"fps={frame_rate},format={pix_fmt}")
+    cmd = ["ffmpeg", "-y", "-i", input_path]
+    if audio_codec and not has_audio:
+        # Give silent clips an audio track so every piece has the same streams.
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={sample_rate}:cl={_layout(channels)}"]
+    cmd += ["-map", "0:v:0"]
+    if audio_codec:
+        cmd += ["-map", "0:a:0" if has_audio else "1:a:0"]
+    cmd += ["-vf", vf, "-c:v", "libx264", "-profile:v", _X264_PROFILES[profile.lower()]]
+    if time_base and '/' in time_base:
+        cmd += ["-video_track_timescale", time_base.split('/')[1]]
+    if audio_codec:
+        cmd += ["-c:a", "aac", "-ar", str(sample_rate), "-ac", str(channels)]
+        if not has_audio:
+            cmd += ["-shortest"]
+    cmd.append(output_path)
+    return cmd
+
+
+def has_audio(probe):
+    return any(s.get('codec_type') == 'audio' for s in probe.get('streams', []))
+
+
+def _layout(channels):
+    return {1: 'mono', 2: 'stereo'}.get(int(channels or 2), f'{channels}c')
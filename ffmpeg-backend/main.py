@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import subprocess
 import os
@@ -7,51 +7,120 @@ import sys
 import re
 import unicodedata
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 import threading
 import traceback
 import glob
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from urllib.parse import quote
+from jobs import JobQueue, JobStore, QueueClosed
+from ffmpeg_progress import run_ffmpeg, guess_duration, parse_time
+from result_cache import ResultCache, cache_key, detach
+from media_index import MediaIndex, ProbeError
+from uploads import ChunkedUploads, UploadError, save_stream
+from media_files import send_media
+from captures import CaptureRegistry, CaptureError
+from join_plan import plan_join, normalize_args, has_audio
+from frame_server import FrameServer, FrameError
+from previews import PreviewCache
+from batches import BatchRunner, BatchStore, BatchItem, BATCH_MAX_ITEMS
+from chunked_encode import plan_chunked, run_chunked, CHUNKED_ENCODE_MIN_SECONDS
+from palettes import PaletteCache, GifOptionsError, gif_options, gif_args
+from storage import Storage
+from scenes import SceneIndex, SceneError, detect_scenes
+from waveforms import WaveformIndex, WaveformError, WAVEFORM_MAX_WIDTH
+from capabilities import Capabilities, COMMAND_PREFLIGHT
+from hls_ladder import LadderError, parse_ladder, ladder_args, frame_rate
+from stabilize import TrfCache, StabilizeError, analysis_key, detect_command, link_or_copy, STABILIZE_DETECT_HEIGHT
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)  # Allow all origins, all headers, all methods
 
 UPLOAD_FOLDER = os.path.abspath(os.path.dirname(__file__))
+CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, '.cache')
+# Per-job temporary files (intermediate encodes, concat lists).
+SCRATCH_FOLDER = os.path.join(CACHE_FOLDER, 'scratch')
+os.makedirs(SCRATCH_FOLDER, exist_ok=True)
+
+result_cache = ResultCache(os.path.join(CACHE_FOLDER, 'results'))
+media_index = MediaIndex(os.path.join(CACHE_FOLDER, 'media_index.db'))
+chunked_uploads = ChunkedUploads(os.path.join(CACHE_FOLDER, 'uploads'))
+frame_server = FrameServer(os.path.join(CACHE_FOLDER, 'frames'), probe=media_index.probe)
+preview_cache = PreviewCache(CACHE_FOLDER, digest=media_index.digest, duration=media_index.duration)
+palette_cache = PaletteCache(os.path.join(CACHE_FOLDER, 'palettes'), digest=media_index.digest)
+trf_cache = TrfCache(os.path.join(CACHE_FOLDER, 'trf'))
+scene_index = SceneIndex(os.path.join(CACHE_FOLDER, 'scenes'), digest=media_index.digest,
+                         cached_digest=media_index.cached_digest)
+waveform_index = WaveformIndex(os.path.join(CACHE_FOLDER, 'waveforms'), digest=media_index.digest,
+                               cached_digest=media_index.cached_digest)
+capabilities = Capabilities(os.path.join(CACHE_FOLDER, 'capabilities.json'),
+                            catalog_root=os.path.dirname(os.path.abspath(__file__)))
+capabilities.start()
+capture_registry = CaptureRegistry(UPLOAD_FOLDER, os.path.join(CACHE_FOLDER, 'captures.db'))
+storage = Storage(UPLOAD_FOLDER, os.path.join(CACHE_FOLDER, 'storage.db'), scratch_roots=[SCRATCH_FOLDER],
+                  cache_roots=[preview_cache.proxy_dir, palette_cache.root, trf_cache.root, scene_index.root,
+                               waveform_index.root])
+# Artifacts of older versions, written straight into the upload folder and never removed.
+storage.adopt(re.compile(r'^(stabilize\d{6}(_\w+)?|palette\.png|file_list\.txt)$'), 'output')
+
+def legacy_preview(name, names):
+    # Old /preview wrote <stem>_preview.mp4/.jpg next to the <stem>.<ext> it previewed.
+    stem = name.rsplit('_preview.', 1)[0]
+    return any(other != name and other.startswith(stem + '.') for other in names)
+
+storage.adopt(re.compile(r'^.+_preview\.(mp4|jpg)$'), 'output', accept=legacy_preview)
 
 
-capture_proc = None
-capture_output_file = None
-
 @app.route('/api/capture/start', methods=['POST'])
 def start_capture():
-    global capture_proc, capture_output_file
     data = request.json
     cmd = data.get('command')
     output_file = data.get('output_file')  # Front-end should send the output filename
     if not cmd or not output_file:
         return jsonify({'error': 'No command or output_file provided'}), 400
 
-    capture_output_file = output_file
-
-    def run_capture():
-        global capture_proc
-        capture_proc = subprocess.Popen(cmd, shell=True)
-
-    threading.Thread(target=run_capture, daemon=True).start()
-    return jsonify({'status': 'recording_started'})
+    try:
+        session = capture_registry.start(cmd, output_file)
+    except CaptureError as e:
+        return jsonify({'error': str(e), 'stderr': e.output}), e.status
+    return jsonify({**session, 'capture_status': session['status'], 'status': 'recording_started'})
 
 @app.route('/api/capture/stop', methods=['POST'])
 def stop_capture():
-    global capture_proc, capture_output_file
-    if capture_proc:
-        capture_proc.terminate()
-        capture_proc.wait()
-        filename = capture_output_file
-        capture_proc = None
-        capture_output_file = None
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    if not session_id:
+        # Older clients don't send a session id: stop the most recent recording.
+        active = capture_registry.list(active_only=True)
+        if not active:
+            return jsonify({'error': 'No active recording'}), 400
+        session_id = active[0]['session_id']
 
-        # Option 1: Return just a JSON status and filename to download separately
-        return jsonify({'status': 'recording_stopped', 'filename': filename})
+    try:
+        session = capture_registry.stop(session_id)
+    except CaptureError as e:
+        return jsonify({'error': str(e), 'stderr': e.output}), e.status
+
+    # Option 1: Return just a JSON status and filename to download separately
+    stderr = session.pop('output', '')
+    if session.get('filename'):
+        storage.register(os.path.basename(session['filename']), 'output')
+    return jsonify({**session, 'capture_status': session['status'], 'status': 'recording_stopped', 'stderr': stderr})
 
-    return jsonify({'error': 'No active recording'}), 400
+@app.route('/api/capture/sessions', methods=['GET'])
+def list_captures():
+    active_only = request.args.get('active') in ('1', 'true')
+    return jsonify({'sessions': capture_registry.list(active_only=active_only)})
+
+@app.route('/api/capture/sessions/<session_id>', methods=['GET'])
+def get_capture(session_id):
+    session = capture_registry.get(session_id)
+    if not session:
+        return jsonify({'error': f'Unknown capture session {session_id}'}), 404
+    return jsonify(session)
 
 
 @app.route('/api/capture/probe', methods=['POST'])
@@ -74,7 +143,13 @@ def probe_capture_device():
                         
 @app.route('/files/<path:filename>')
 def serve_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
+    file_path = safe_join(UPLOAD_FOLDER, filename)
+    # Dot-directories (.cache) hold internal state, not servable media.
+    hidden = any(part.startswith('.') for part in filename.split('/'))
+    if file_path is None or hidden or not os.path.isfile(file_path):
+        return jsonify({'success': False, 'message': f'File {filename} not found.'}), 404
+    storage.touch(filename.split('/')[0])
+    return send_media(file_path, etag=media_index.cached_digest(file_path))
 
 def sanitize_filename(filename):
     filename = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
@@ -85,11 +160,12 @@ def sanitize_filename(filename):
     return filename
 
 @app.route('/upload', methods=['POST', 'OPTIONS'])
+@app.route('/upload-multiple', methods=['POST', 'OPTIONS'])
 def upload_files():
     if request.method == 'OPTIONS':
         return '', 204
     # Accept both single and multiple files
-    files = request.files.getlist('file')
+    files = request.files.getlist('file') + request.files.getlist('files')
     if not files or files == [None]:
         return jsonify({'success': False, 'message': 'No file part(s) found.'}), 400
 
@@ -99,7 +175,11 @@ def upload_files():
             continue  # skip empty
         sanitized_name = sanitize_filename(file.filename)
         save_path = os.path.join(UPLOAD_FOLDER, sanitized_name)
-        file.save(save_path)
+        # Stream to disk in chunks, hashing as we go, instead of file.save()
+        digest = save_stream(file.stream, save_path)
+        storage.register(sanitized_name, 'input')
+        media_index.index_async(save_path, sha256=digest)
+        preview_cache.build_async(save_path, sha256=digest)
         saved_files.append(sanitized_name)
 
     if not saved_files:
@@ -107,123 +187,213 @@ def upload_files():
 
     return jsonify({'success': True, 'filenames': saved_files})
 
+# --- Resumable chunked uploads ---
+# POST /uploads {filename, size, sha256?} opens a session, then the body is sent
+# with PUT /uploads/<id> in any number of pieces, each addressed by its byte
+# offset (Upload-Offset header, Content-Range or ?offset=). A PUT with the
+# wrong offset gets 409 and the offset to resume from.
+
+def upload_error_response(e):
+    body = {'success': False, 'message': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+def request_offset():
+    if 'Upload-Offset' in request.headers:
+        return int(request.headers['Upload-Offset'])
+    content_range = request.headers.get('Content-Range', '')
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', content_range)
+    if match:
+        return int(match.group(1))
+    return int(request.args.get('offset', 0))
+
+@app.route('/uploads', methods=['POST', 'OPTIONS'])
+def create_upload():
+    if request.method == 'OPTIONS':
+        return '', 204
+    data = request.get_json() or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    if not filename or not isinstance(size, int) or size < 0:
+        return jsonify({'success': False, 'message': 'filename and a non-negative integer size are required.'}), 400
+
+    status = chunked_uploads.create(sanitize_filename(filename), size, data.get('sha256'))
+    return jsonify({'success': True, **status}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'HEAD', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+def chunked_upload(upload_id):
+    if request.method == 'OPTIONS':
+        return '', 204
+    try:
+        if request.method == 'DELETE':
+            chunked_uploads.discard(upload_id)
+            return jsonify({'success': True, 'message': 'Upload discarded.'})
+
+        if request.method in ('GET', 'HEAD'):
+            status = chunked_uploads.status(upload_id)
+            resp = jsonify({'success': True, **status})
+            resp.headers['Upload-Offset'] = str(status['offset'])
+            return resp
+
+        status = chunked_uploads.write(upload_id, request_offset(), request.stream, request.content_length)
+        if status['offset'] < status['size']:
+            resp = jsonify({'success': True, 'complete': False, **status})
+            resp.headers['Upload-Offset'] = str(status['offset'])
+            return resp
+
+        save_path = os.path.join(UPLOAD_FOLDER, status['filename'])
+        digest = chunked_uploads.finish(upload_id, save_path)
+        storage.register(status['filename'], 'input')
+        media_index.index_async(save_path, sha256=digest)
+        preview_cache.build_async(save_path, sha256=digest)
+        print(f"[UPLOAD] {status['filename']} complete ({status['size']} bytes, sha256 {digest})", file=sys.stderr)
+        return jsonify({
+            'success': True,
+            'complete': True,
+            'filenames': [status['filename']],
+            'size': status['size'],
+            'offset': status['size'],
+            'sha256': digest
+        })
+    except UploadError as e:
+        return upload_error_response(e)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid upload offset.'}), 400
+
 def handle_join_operation(data):
     filenames = data.get('filenames')
     output = sanitize_filename(data.get('output', 'joined_output.mp4'))
     if not filenames or len(filenames) < 2:
         return jsonify({'success': False, 'message': 'Need at least two files to join.'}), 400
 
-    file_list_path = os.path.join(UPLOAD_FOLDER, "file_list.txt")
-    with open(file_list_path, "w") as f:
-        for name in filenames:
-            safe_name = sanitize_filename(name)
-            f.write(f"file '{safe_name}'\n")
-
-    # Use browser-friendly codecs for output!
-    cmd = [
-        "ffmpeg", "-y", "-f", "concat", "-safe", "0",
-        "-i", "file_list.txt",
-        "-c:v", "libx264", "-c:a", "aac", "-movflags", "+faststart",
-        output
-    ]
-    print("Join args:", cmd, file=sys.stderr)
+    safe_names = [sanitize_filename(name) for name in filenames]
+    probes = []
+    for name in safe_names:
+        try:
+            probes.append(media_index.probe(os.path.join(UPLOAD_FOLDER, name)))
+        except (OSError, ProbeError, ValueError):
+            probes.append(None)
+    mode, reference, mismatched = plan_join(probes)
+    if os.path.splitext(output)[1].lower() not in ('.mp4', '.mov', '.m4v', '.mkv'):
+        mode = 'reencode'
+    print(f"Join mode: {mode}, normalizing {len(mismatched) if mode == 'normalize' else 0} input(s)", file=sys.stderr)
+
+    job = job_queue.current_job()
+    work_dir = tempfile.mkdtemp(prefix='join-', dir=SCRATCH_FOLDER)
     try:
-        proc = subprocess.run(cmd, cwd=UPLOAD_FOLDER, capture_output=True, text=True, timeout=600)
-        output_text = proc.stdout + proc.stderr
-        if proc.returncode == 0:
+        pieces = [os.path.join(UPLOAD_FOLDER, name) for name in safe_names]
+        outputs = []
+        if mode == 'normalize':
+            # Every piece goes through the same encoder settings, so their extradata match.
+            for i in mismatched:
+                piece = os.path.join(work_dir, f"normalized_{i}.mp4")
+                cmd = normalize_args(pieces[i], has_audio(probes[i]), reference, piece)
+                returncode, output_text = run_ffmpeg(cmd, cwd=UPLOAD_FOLDER, timeout=600, job=job,
+                                                     duration=media_index.duration(pieces[i]), step='normalize')
+                outputs.append(output_text)
+                if returncode != 0:
+                    return jsonify({
+                        'success': False,
+                        'message': f'Normalizing {safe_names[i]} for join failed.',
+                        'output': ''.join(outputs),
+                        'output_file': output
+                    })
+                pieces[i] = piece
+
+        file_list_path = os.path.join(work_dir, "file_list.txt")
+        with open(file_list_path, "w") as f:
+            for piece in pieces:
+                f.write("file '{}'\n".format(piece.replace("'", "'\\''")))
+
+        cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", file_list_path]
+        if mode == 'reencode':
+            # Use browser-friendly codecs for output!
+            cmd += ["-c:v", "libx264", "-c:a", "aac"]
+        else:
+            # Matching inputs: no re-encode, just remux.
+            cmd += ["-map", "0:v:0", "-map", "0:a:0?", "-c", "copy"]
+        cmd += ["-movflags", "+faststart", output]
+        print("Join args:", cmd, file=sys.stderr)
+
+        duration = sum(media_index.duration(name, cwd=UPLOAD_FOLDER) or 0 for name in safe_names)
+        returncode, output_text = run_ffmpeg(cmd, cwd=UPLOAD_FOLDER, timeout=600,
+                                             job=job, duration=duration or None, step='join')
+        outputs.append(output_text)
+        if returncode == 0:
             return jsonify({
                 'success': True,
                 'message': 'Join command executed successfully.',
-                'output': output_text,
-                'output_file': output
+                'output': ''.join(outputs),
+                'output_file': output,
+                'mode': mode
             })
         else:
             return jsonify({
                 'success': False,
                 'message': 'Join command failed.',
-                'output': output_text,
-                'output_file': output
+                'output': ''.join(outputs),
+                'output_file': output,
+                'mode': mode
             })
     except Exception as e:
         return jsonify({'success': False, 'message': 'Exception occurred (join).', 'error': str(e)}), 500
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 def handle_gif_palette_operation(data):
     input_file = sanitize_filename(data.get('inputFile'))
     output_file = sanitize_filename(data.get('output', 'output.gif'))
-    scale_height = str(data.get('scale_height', 320))
-    fps = str(data.get('fps', 10))
-    start_time = data.get('start_time', None)  # Optional: "00:00:05"
-    duration = data.get('duration', None)      # Optional: "10"
-    palette_file = "palette.png"
+    try:
+        options = gif_options(data)
+    except GifOptionsError as e:
+        return jsonify({'success': False, 'message': str(e)}), e.status
 
     input_path = os.path.join(UPLOAD_FOLDER, input_file)
-    palette_path = os.path.join(UPLOAD_FOLDER, palette_file)
-    output_path = os.path.join(UPLOAD_FOLDER, output_file)
-
-    # Build filter string
-    filter_str = f"fps={fps},scale=-1:{scale_height}:flags=lanczos"
-
-    # Palettegen command
-    palettegen_cmd = [
-        "ffmpeg", "-y"
-    ]
-    if start_time:
-        palettegen_cmd += ["-ss", str(start_time)]
-    if duration:
-        palettegen_cmd += ["-t", str(duration)]
-    palettegen_cmd += ["-i", input_file, "-vf", f"{filter_str},palettegen", palette_file]
-
-    # Paletteuse command
-    paletteuse_cmd = [
-        "ffmpeg", "-y"
-    ]
-    if start_time:
-        paletteuse_cmd += ["-ss", str(start_time)]
-    if duration:
-        paletteuse_cmd += ["-t", str(duration)]
-    paletteuse_cmd += [
-        "-i", input_file,
-        "-i", palette_file,
-        "-filter_complex", f"[0:v]{filter_str}[x];[x][1:v]paletteuse",
-        output_file
-    ]
-
-    print("Palettegen command:", " ".join(palettegen_cmd), file=sys.stderr)
-    print("Paletteuse command:", " ".join(paletteuse_cmd), file=sys.stderr)
-
-    # Step 1: Palettegen
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': f'Input file {input_file} not found.'}), 404
+
+    # Everything is written inside a per-job directory, so concurrent exports
+    # never share a palette and a failed run leaves no partial output behind.
+    work_dir = tempfile.mkdtemp(prefix='gif-', dir=SCRATCH_FOLDER)
     try:
-        proc1 = subprocess.run(palettegen_cmd, cwd=UPLOAD_FOLDER, capture_output=True, text=True, timeout=600)
-        output1 = proc1.stdout + proc1.stderr
-        if proc1.returncode != 0:
-            return jsonify({'success': False, 'message': 'Palettegen failed.', 'output': output1})
-
-        # Step 2: Paletteuse
-        proc2 = subprocess.run(paletteuse_cmd, cwd=UPLOAD_FOLDER, capture_output=True, text=True, timeout=600)
-        output2 = proc2.stdout + proc2.stderr
-        if proc2.returncode == 0:
-            return jsonify({
-                'success': True,
-                'message': 'GIF created successfully with palette.',
-                'output': output1 + "\n" + output2,
-                'output_file': output_file
-            })
-        else:
+        key = palette_cache.key(input_path, options)
+        cached_palette = palette_cache.get(key)
+        work_output = os.path.join(work_dir, 'output' + os.path.splitext(output_file)[1])
+        palette_out = os.path.join(work_dir, 'palette.png') if key and not cached_palette else None
+        cmd = gif_args(input_path, options, work_output, palette_out=palette_out, palette_in=cached_palette)
+        print("GIF command:", " ".join(cmd), file=sys.stderr)
+
+        duration = options['duration']
+        expected = parse_time(duration) if duration else media_index.duration(input_file, cwd=UPLOAD_FOLDER)
+        returncode, output = run_ffmpeg(cmd, cwd=UPLOAD_FOLDER, timeout=600,
+                                        job=job_queue.current_job(), duration=expected, step='gif')
+        if returncode != 0 or not os.path.exists(work_output):
             return jsonify({
                 'success': False,
-                'message': 'Paletteuse failed.',
-                'output': output1 + "\n" + output2,
+                'message': 'GIF creation failed.',
+                'output': output,
                 'output_file': output_file
             })
-
+        if palette_out:
+            palette_cache.put(key, palette_out)
+        os.replace(work_output, os.path.join(UPLOAD_FOLDER, output_file))
+        return jsonify({
+            'success': True,
+            'message': 'GIF created successfully with palette.',
+            'output': output,
+            'output_file': output_file,
+            'palette_cached': bool(cached_palette)
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': 'Exception occurred (gif_palette).', 'error': str(e)}), 500
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 def handle_segment_hls_operation(data):
     input_file = sanitize_filename(data.get("inputFile"))
-    segment_duration = data.get("segmentDuration", 10)
+    mode = data.get("mode", "copy")
     base_name = os.path.splitext(input_file)[0]
-    output_file = f"{base_name}.m3u8"
 
     input_path = os.path.join(UPLOAD_FOLDER, input_file)
     if not os.path.exists(input_path):
@@ -231,34 +401,69 @@ def handle_segment_hls_operation(data):
             "success": False,
             "message": f"Input file {input_file} not found."
         }), 404
-
-    cmd = [
-        "ffmpeg",
-        "-i", input_file,
-        "-c", "copy",
-        "-hls_time", str(segment_duration),
-        "-hls_list_size", "0",
-        "-f", "hls",
-        output_file,
-    ]
+    try:
+        segment_duration = float(data.get("segmentDuration", 10))
+        if segment_duration <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "segmentDuration must be a positive number."}), 400
+    segment_duration = f"{segment_duration:g}"
+    if mode not in ("copy", "abr"):
+        return jsonify({"success": False, "message": "mode must be 'copy' or 'abr'."}), 400
+
+    renditions = None
+    if mode == "abr":
+        try:
+            probe = media_index.probe(input_path)
+            video = next((s for s in probe.get("streams", []) if s.get("codec_type") == "video"), None)
+            if video is None:
+                return jsonify({"success": False, "message": f"{input_file} has no video stream."}), 422
+            ladder = parse_ladder(data.get("ladder"), source_height=video.get("height"))
+            cmd, renditions = ladder_args(input_path, ladder, float(segment_duration), fps=frame_rate(video),
+                                          has_audio=has_audio(probe))
+        except LadderError as e:
+            return jsonify({"success": False, "message": str(e)}), e.status
+        except ProbeError as e:
+            return jsonify({"success": False, "message": str(e), "output": e.output}), 500
+    else:
+        cmd = [
+            "ffmpeg",
+            "-i", input_path,
+            "-c", "copy",
+            "-hls_time", segment_duration,
+            "-hls_list_size", "0",
+            "-f", "hls",
+            f"{base_name}.m3u8",
+        ]
+
+    # Each run packages into its own folder, so earlier runs of the same
+    # input are left alone; ffmpeg works in that folder.
+    out_dir = tempfile.mkdtemp(prefix=f"{base_name}_hls_", dir=UPLOAD_FOLDER)
+    folder_name = os.path.basename(out_dir)
+    for name in renditions or []:
+        os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+    output_file = f"{folder_name}/master.m3u8" if mode == "abr" else f"{folder_name}/{base_name}.m3u8"
 
     try:
-        proc = subprocess.run(
+        returncode, output = run_ffmpeg(
             cmd,
-            cwd=UPLOAD_FOLDER,
-            capture_output=True,
-            text=True,
-            timeout=600,
+            cwd=out_dir,
+            timeout=3600 if mode == "abr" else 600,
+            job=job_queue.current_job(),
+            duration=media_index.duration(input_path),
         )
-        output = proc.stdout + proc.stderr
-        if proc.returncode == 0:
+        if returncode == 0:
             return jsonify({
                 "success": True,
                 "message": "Segmentation succeeded.",
                 "output": output,
                 "output_file": output_file,
+                "output_folder": folder_name,
+                "mode": mode,
+                "renditions": renditions,
             })
         else:
+            shutil.rmtree(out_dir, ignore_errors=True)
             return jsonify({
                 "success": False,
                 "message": "Segmentation failed.",
@@ -266,6 +471,7 @@ def handle_segment_hls_operation(data):
                 "output_file": output_file,
             }), 500
     except Exception as e:
+        shutil.rmtree(out_dir, ignore_errors=True)
         return jsonify({
             "success": False,
             "message": "Exception during segmentation.",
@@ -283,38 +489,20 @@ def handle_analysis_operation(data):
             "message": f"Input file {input_file} not found on server."
         }), 404
 
-    # build the ffprobe command
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-show_format",
-        "-show_streams",
-        input_file
-    ]
-
-    # run it
+    # structured ffprobe output, served from the media index when fresh
     try:
-        proc = subprocess.run(
-            cmd,
-            cwd=UPLOAD_FOLDER,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        output = proc.stdout + proc.stderr
-
-        if proc.returncode == 0:
-            return jsonify({
-                "success": True,
-                "output": output
-            })
-        else:
-            return jsonify({
-                "success": False,
-                "message": "ffprobe reported errors",
-                "output": output
-            }), 500
-
+        probe = media_index.probe(input_path)
+        return jsonify({
+            "success": True,
+            "probe": probe,
+            "output": json.dumps(probe, indent=2)
+        })
+    except ProbeError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e),
+            "output": e.output
+        }), 500
     except Exception as e:
         return jsonify({
             "success": False,
@@ -322,97 +510,159 @@ def handle_analysis_operation(data):
             "error": str(e)
         }), 500
 
-def handle_stabilize_operation(data):
-    import traceback
-    import sys
-    import os
-    import glob
-    import re
-    import subprocess
-    import shutil
-    from datetime import datetime
-    from flask import jsonify
+def scene_response(input_file, curve, data):
+    """Threshold a cached score curve into the scene_detect result."""
+    try:
+        threshold = float(data.get('threshold', 0.4))
+        min_gap = float(data.get('min_gap', 0) or 0)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'threshold and min_gap must be numbers.'}), 400
+    if not 0 <= threshold <= 1 or min_gap < 0:
+        return jsonify({'success': False, 'message': 'threshold must be in [0, 1] and min_gap >= 0.'}), 400
+
+    scenes = detect_scenes(curve, threshold, min_gap)
+    for scene in scenes:
+        # A frame just inside the scene; /api/frame caches the JPEG.
+        scene['thumbnail'] = f"/api/frame?file={quote(input_file)}&t={scene['start'] + 0.05:.3f}&width=320"
+    result = {
+        'success': True,
+        'inputFile': input_file,
+        'threshold': threshold,
+        'min_gap': min_gap,
+        'analysis': {'fps': curve['fps'], 'height': curve['height'], 'frames': len(curve['times'])},
+        'scenes': scenes,
+    }
+    if data.get('include_scores'):
+        result['times'], result['scores'] = curve['times'], curve['scores']
+    return jsonify(result)
+
+def handle_scene_detect_operation(data):
+    input_file = sanitize_filename(data.get('inputFile'))
+    input_path = os.path.join(UPLOAD_FOLDER, input_file)
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': f'Input file {input_file} not found.'}), 404
+    try:
+        probe = media_index.probe(input_path)
+        start = float(probe.get('format', {}).get('start_time') or 0)
+        curve = scene_index.analyze(input_path, duration=media_index.duration(input_path), start=start,
+                                    job=job_queue.current_job())
+    except ProbeError as e:
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), 500
+    except SceneError as e:
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), e.status
+    return scene_response(input_file, curve, data)
+
+def handle_waveform_operation(data):
+    """Build the peak pyramid /api/waveform serves windows from."""
+    input_file = sanitize_filename(data.get('inputFile'))
+    input_path = os.path.join(UPLOAD_FOLDER, input_file)
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': f'Input file {input_file} not found.'}), 404
+    try:
+        if not has_audio(media_index.probe(input_path)):
+            return jsonify({'success': False, 'message': f'{input_file} has no audio stream.'}), 400
+        pyramid = waveform_index.get(input_path)
+    except ProbeError as e:
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), 500
+    except WaveformError as e:
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), e.status
+    return jsonify({'success': True, 'file': input_file, 'duration': round(pyramid.duration, 6),
+                    'levels': len(pyramid.levels)})
+
+def run_stabilize_detect(analyze_cmd, input_file, input_path, detect_height, reuse, job):
+    """The cached .trf for this analysis, running vidstabdetect if needed.
+
+    Returns ``(trf_path, cached, output)``. Scaled detection asks for an
+    ASCII .trf; if that fails or can't be rescaled, it is redone at full
+    resolution.
+    """
+    digest = media_index.digest(input_path)
+    expected = media_index.duration(input_path)
+    for height in ([detect_height, 0] if detect_height else [0]):
+        key = analysis_key(digest, analyze_cmd, input_file, height)
+        cached = trf_cache.get(key) if reuse else None
+        if cached:
+            print(f"[STABILIZE] reusing analysis {key[:12]}", file=sys.stderr)
+            return cached, True, ''
+
+        work_dir = tempfile.mkdtemp(prefix='stabilize-', dir=SCRATCH_FOLDER)
+        try:
+            cmd, scaled = detect_command(analyze_cmd, input_file, input_path, 'analysis.trf', height)
+            print(f"[STABILIZE] PATCHED analyze_cmd: {cmd}", file=sys.stderr)
+            returncode, output = run_ffmpeg(cmd, cwd=work_dir, timeout=300,
+                                            job=job, duration=expected, step='analyze')
+            trf_path = os.path.join(work_dir, 'analysis.trf')
+            if returncode != 0 and scaled:
+                # e.g. a build whose vidstabdetect has no fileformat option.
+                print("[STABILIZE] Scaled analysis failed. Retrying at full resolution.", file=sys.stderr)
+                continue
+            if returncode != 0:
+                raise StabilizeError('Analyze (vidstabdetect) failed.', output=output)
+            if not os.path.exists(trf_path):
+                raise StabilizeError(f'vidstabdetect did not produce a .trf file for {input_file}', output=output)
+            scale = None
+            if scaled:
+                video = next(s for s in media_index.probe(input_path)['streams'] if s.get('codec_type') == 'video')
+                width, height_in = video['width'], video['height']
+                detect_width = max(2, round(width * height / height_in / 2) * 2)
+                scale = (width / detect_width, height_in / height)
+            try:
+                return trf_cache.put(key, trf_path, scale=scale), False, output
+            except StabilizeError as e:
+                print(f"[STABILIZE] {e} Retrying at full resolution.", file=sys.stderr)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    raise StabilizeError('Could not produce a usable .trf file.')
 
+def handle_stabilize_operation(data):
     print("---- [STABILIZE] Handler called ----", file=sys.stderr)
     sys.stderr.flush()
 
+    out_dir = None
     try:
         input_file = sanitize_filename(data.get('inputFile'))
         input_path = os.path.join(UPLOAD_FOLDER, input_file)
         print(f"[STABILIZE] input_file: {input_file}", file=sys.stderr)
-        print(f"[STABILIZE] input_path: {input_path}", file=sys.stderr)
-        sys.stderr.flush()
 
         if not os.path.exists(input_path):
             print("[STABILIZE] ERROR: input file does not exist", file=sys.stderr)
             return jsonify({'success': False, 'message': f'Input file {input_file} not found.'}), 404
 
-        # --- Make unique output folder ---
-        now = datetime.now()
-        folder_name = f"stabilize{now.strftime('%H%M%S')}"
-        out_dir = os.path.join(UPLOAD_FOLDER, folder_name)
-        os.makedirs(out_dir, exist_ok=True)
-
-        # Copy input file into the output folder
-        input_copy_path = os.path.join(out_dir, input_file)
-        shutil.copy2(input_path, input_copy_path)
-
         command_block = data.get('command')
         print(f"[STABILIZE] command_block: {command_block}", file=sys.stderr)
-        sys.stderr.flush()
-
         if not command_block or "ffmpeg" not in command_block:
             print("[STABILIZE] ERROR: No valid command block", file=sys.stderr)
             return jsonify({'success': False, 'message': 'No valid ffmpeg command block provided.'}), 400
 
-        base_name = os.path.splitext(input_file)[0]
-        trf_file = f"{base_name}.trf"
-        trf_path = os.path.join(out_dir, trf_file)
-
         # Extract exactly two ffmpeg commands (analyze, stabilize)
         lines = [line.strip() for line in command_block.splitlines() if line.strip().startswith("ffmpeg")]
         if len(lines) != 2:
             print("[STABILIZE] ERROR: Not exactly 2 ffmpeg commands", file=sys.stderr)
             return jsonify({'success': False, 'message': 'Expected two ffmpeg commands (analyze + stabilize).'}), 400
-
         analyze_cmd, stabilize_cmd = lines
 
-        # PATCH analyze: ensure result points to folder
-        if "vidstabdetect" in analyze_cmd:
-            analyze_cmd = re.sub(
-                r'(vidstabdetect=[^":]*)',
-                lambda m: (
-                    re.sub(r':?result=[^:"]*', '', m.group(1)).rstrip(':') + f':result={trf_file}'
-                ),
-                analyze_cmd
-            )
-            # Update the input file path to point to our new location
-            analyze_cmd = analyze_cmd.replace(input_file, input_copy_path)
-
-        print(f"[STABILIZE] PATCHED analyze_cmd: {analyze_cmd}", file=sys.stderr)
-
-        # ---- Run Step 1: Analyze ----
-        proc1 = subprocess.run(analyze_cmd, shell=True, cwd=out_dir, capture_output=True, text=True, timeout=300)
-        output1 = proc1.stdout + proc1.stderr
-        if proc1.returncode != 0:
-            print("[STABILIZE] ERROR: Analyze step failed", file=sys.stderr)
-            return jsonify({
-                'success': False,
-                'step': 'analyze',
-                'message': 'Analyze (vidstabdetect) failed.',
-                'output': output1
-            }), 500
-
-        # STEP 2: Find the .trf file (should be right in out_dir)
-        clean_trf_path = os.path.join(out_dir, trf_file)
-        if not os.path.exists(clean_trf_path):
-            print(f"[STABILIZE] ERROR: No clean .trf file found for {base_name}", file=sys.stderr)
-            return jsonify({
-                'success': False,
-                'step': 'analyze',
-                'message': f'vidstabdetect did not produce a .trf file for {base_name}',
-                'output': output1
-            }), 500
+        try:
+            detect_height = int(data.get('detect_height', STABILIZE_DETECT_HEIGHT) or 0)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'detect_height must be an integer.'}), 400
+        if detect_height:
+            video = next((s for s in media_index.probe(input_path).get('streams', [])
+                          if s.get('codec_type') == 'video'), {})
+            if not video.get('height') or detect_height >= video['height']:
+                detect_height = 0
+
+        job = job_queue.current_job()
+        trf_cached, analysis_cached, output1 = run_stabilize_detect(
+            analyze_cmd, input_file, input_path, detect_height, data.get('reuse_analysis', True), job)
+
+        # --- Unique output folder; input and analysis are linked, not copied ---
+        now = datetime.now()
+        out_dir = tempfile.mkdtemp(prefix=f"stabilize{now.strftime('%H%M%S')}_", dir=UPLOAD_FOLDER)
+        folder_name = os.path.basename(out_dir)
+        input_copy_path = os.path.join(out_dir, input_file)
+        link_or_copy(input_path, input_copy_path)
+        clean_trf_path = os.path.join(out_dir, f"{os.path.splitext(input_file)[0]}.trf")
+        link_or_copy(trf_cached, clean_trf_path)
 
         # PATCH: Always set input=<abs trf> as the ONLY input param in vidstabtransform
         abs_trf_path = os.path.abspath(clean_trf_path)
@@ -432,24 +682,20 @@ def handle_stabilize_operation(data):
         # Patch input/output file in stabilize_cmd
         stabilize_cmd = stabilize_cmd.replace(input_file, input_copy_path)
         # Patch output file to also be in out_dir
-        # Try to extract the output filename
         out_match = re.findall(r'\"([^\"]+\.(mp4|mov|mkv|webm|avi|m4v|mpg|mpeg|gif|ts))\"', stabilize_cmd)
         if out_match:
             orig_output_name = out_match[-1][0]
-            # Ensure output in out_dir
             output_file_path = os.path.join(out_dir, os.path.basename(orig_output_name))
-            # Replace in command
             stabilize_cmd = stabilize_cmd.replace(orig_output_name, output_file_path)
         else:
             output_file_path = None
 
         print(f"[STABILIZE] PATCHED stabilize_cmd: {stabilize_cmd}", file=sys.stderr)
 
-        # ---- STEP 3: Run stabilize ----
-        proc2 = subprocess.run(stabilize_cmd, shell=True, cwd=out_dir, capture_output=True, text=True, timeout=600)
-        output2 = proc2.stdout + proc2.stderr
+        returncode2, output2 = run_ffmpeg(stabilize_cmd, cwd=out_dir, timeout=600,
+                                          job=job, duration=media_index.duration(input_path), step='stabilize')
 
-        if proc2.returncode == 0:
+        if returncode2 == 0:
             print("[STABILIZE] Success!", file=sys.stderr)
             return jsonify({
                 'success': True,
@@ -457,97 +703,94 @@ def handle_stabilize_operation(data):
                 'output_analyze': output1,
                 'output_stabilize': output2,
                 'output_folder': folder_name,
+                'analysis_cached': analysis_cached,
+                'detect_height': detect_height or None,
                 'trf_file': os.path.relpath(clean_trf_path, UPLOAD_FOLDER),
                 'output_file': os.path.relpath(output_file_path, UPLOAD_FOLDER) if output_file_path else None,
             })
         else:
             print("[STABILIZE] ERROR: Stabilize step failed", file=sys.stderr)
+            shutil.rmtree(out_dir, ignore_errors=True)
             return jsonify({
                 'success': False,
                 'step': 'stabilize',
                 'message': 'Stabilization (vidstabtransform) failed.',
                 'output_analyze': output1,
                 'output_stabilize': output2,
-                'output_folder': folder_name,
-                'trf_file': os.path.relpath(clean_trf_path, UPLOAD_FOLDER),
-                'output_file': os.path.relpath(output_file_path, UPLOAD_FOLDER) if output_file_path else None,
+                'analysis_cached': analysis_cached,
             }), 500
 
+    except StabilizeError as e:
+        print(f"[STABILIZE] ERROR: {e}", file=sys.stderr)
+        return jsonify({'success': False, 'step': 'analyze', 'message': str(e), 'output': e.output}), e.status
     except Exception as e:
         print(f"[STABILIZE] EXCEPTION: {e}", file=sys.stderr)
         print(traceback.format_exc(), file=sys.stderr)
         sys.stderr.flush()
+        if out_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
         return jsonify({'success': False, 'message': 'Exception during stabilization.', 'error': str(e)}), 500
 
-@app.route('/preview', methods=['POST', 'OPTIONS'])
-def preview():
-    if request.method == 'OPTIONS':
-        return '', 204
+def parse_preview_request(data):
+    """Input path, filter and window for /preview and /preview/stream.
 
-    data = request.get_json()
+    Returns ``(params, None)``, or ``(None, error_response)``.
+    """
     command = data.get("command")
     input_file = data.get("inputFile")
-    preview = data.get("preview", False)
     preview_type = data.get("previewType", "video")  # Optional: "video" (default) or "image"
 
     if not command or not isinstance(command, str) or not command.strip().startswith("ffmpeg"):
-        return jsonify({'success': False, 'message': 'Only ffmpeg commands are allowed.'}), 400
+        return None, (jsonify({'success': False, 'message': 'Only ffmpeg commands are allowed.'}), 400)
     if not input_file:
-        return jsonify({'success': False, 'message': 'No input file provided.'}), 400
+        return None, (jsonify({'success': False, 'message': 'No input file provided.'}), 400)
 
     # Sanitize input file
     input_file = sanitize_filename(input_file)
     input_path = os.path.join(UPLOAD_FOLDER, input_file)
     if not os.path.exists(input_path):
-        return jsonify({'success': False, 'message': f'Input file {input_file} not found.'}), 404
+        return None, (jsonify({'success': False, 'message': f'Input file {input_file} not found.'}), 404)
+    # Previewing counts as use, so the upload isn't swept while being edited.
+    storage.touch(input_file)
 
-    # Determine output preview filename/type
-    base_name = os.path.splitext(input_file)[0]
-    if preview_type == "image":
-        preview_file = f"{base_name}_preview.jpg"
-        preview_cmd = f'ffmpeg -y -i "{input_file}" -vf "select=eq(n\\,10)" -vframes 1 "{preview_file}"'
-    else:  # default: short video
-        preview_file = f"{base_name}_preview.mp4"
-        preview_cmd = f'ffmpeg -y -i "{input_file}" -ss 00:00:03 -t 2 -c:v libx264 -c:a aac "{preview_file}"'
-
-    # Allow a filter pipeline to be injected if present in 'command'
-    # If the command string contains '-vf' or '-filter_complex', add them to preview_cmd
-    # For a true "live" preview, parse and insert filter section from main command (optional, see below)
-
-    # Try to extract filters from original command and inject into preview command
-    filter_vf = None
-    filter_complex = None
+    # Extract the filter pipeline from the original command and preview just that
+    filter_flag, filtergraph = "-vf", None
     args = shlex.split(command)
-    if "-vf" in args:
-        idx = args.index("-vf")
-        filter_vf = args[idx + 1]
     if "-filter_complex" in args:
-        idx = args.index("-filter_complex")
-        filter_complex = args[idx + 1]
-    if filter_complex:
-        preview_cmd = f'ffmpeg -y -i "{input_file}" -ss 00:00:03 -t 2 -filter_complex \'{filter_complex}\' -c:v libx264 -c:a aac "{preview_file}"'
-    elif filter_vf:
-        preview_cmd = f'ffmpeg -y -i "{input_file}" -ss 00:00:03 -t 2 -vf \'{filter_vf}\' -c:v libx264 -c:a aac "{preview_file}"'
-
-    print("Preview command:", preview_cmd)
+        filter_flag, filtergraph = "-filter_complex", args[args.index("-filter_complex") + 1]
+    elif "-vf" in args:
+        filtergraph = args[args.index("-vf") + 1]
 
-    # Run the preview command
+    # Preview window: 2s starting at 3s by default, pulled back for short clips
     try:
-        proc = subprocess.run(
-            preview_cmd,
-            cwd=UPLOAD_FOLDER,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        output = proc.stdout + proc.stderr
+        length = float(data.get("previewDuration", 2))
+        start = float(data.get("previewStart", 3))
+    except (TypeError, ValueError):
+        return None, (jsonify({'success': False, 'message': 'Invalid preview window.'}), 400)
+    total = media_index.duration(input_path)
+    if total:
+        start = max(0.0, min(start, total - (length if preview_type != "image" else 0.1)))
 
-        if proc.returncode == 0 and os.path.exists(os.path.join(UPLOAD_FOLDER, preview_file)):
+    use_proxy = data.get("proxy", True) not in (False, 'false', '0')
+    return (input_path, filter_flag, filtergraph, start, length, preview_type, use_proxy), None
+
+@app.route('/preview', methods=['POST', 'OPTIONS'])
+def preview():
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    params, error = parse_preview_request(request.get_json())
+    if error:
+        return error
+
+    try:
+        name, output, cached = preview_cache.render(*params)
+        if name:
             return jsonify({
                 "success": True,
-                "message": "Preview generated.",
-                "preview_url": preview_file,
+                "message": "Preview served from cache." if cached else "Preview generated.",
+                "preview_url": f"/previews/{name}",
+                "cached": cached,
                 "output": output
             })
         else:
@@ -564,17 +807,167 @@ def preview():
             "message": "Exception during preview.",
             "error": str(e),
         }), 500
-    
+
+@app.route('/preview/stream', methods=['GET', 'POST', 'OPTIONS'])
+def preview_stream():
+    """Like /preview, but the encode is streamed back while ffmpeg runs.
+
+    Takes the same fields as JSON (POST) or query parameters (GET, so it can
+    be a <video>/<img> src). previewType "mjpeg" streams multipart JPEGs.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    params, error = parse_preview_request(request.get_json(silent=True) or request.args)
+    if error:
+        return error
+    if params[5] not in ('video', 'image', 'mjpeg'):
+        return jsonify({'success': False, 'message': 'previewType must be video, image or mjpeg.'}), 400
+
+    name, chunks, mimetype = preview_cache.stream(*params)
+    if name:
+        return send_media(preview_cache.path(name))
+    resp = Response(chunks, mimetype=mimetype, direct_passthrough=True)
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return resp
+
+@app.route('/previews/<name>')
+def serve_preview(name):
+    if secure_filename(name) != name:
+        return jsonify({'success': False, 'message': 'Not found.'}), 404
+    path = preview_cache.path(name)
+    if not os.path.isfile(path):
+        return jsonify({'success': False, 'message': 'Not found.'}), 404
+    return send_media(path)
+
+def handle_command_operation(data):
+    command = data.get('command')
+    # Always overwrite output files without asking
+    if command.startswith("ffmpeg "):
+        command = command.replace("ffmpeg ", "ffmpeg -y ", 1)
+
+    try:
+        print("About to call subprocess", file=sys.stderr)
+        args = shlex.split(command.strip())
+        print("After -y Args for FFmpeg:", args, file=sys.stderr)
+        sys.stderr.flush()
+        key = cache_key(args, UPLOAD_FOLDER, digest=media_index.digest) if data.get('cache', True) else None
+        if key:
+            detach(os.path.join(UPLOAD_FOLDER, args[-1]))
+        duration = guess_duration(args, cwd=UPLOAD_FOLDER, probe=media_index.duration) if args[0] == 'ffmpeg' else None
+        plan = plan_chunked(args) if data.get('chunked') else None
+        if plan and duration and duration >= CHUNKED_ENCODE_MIN_SECONDS:
+            returncode, output = run_chunked(plan, UPLOAD_FOLDER, SCRATCH_FOLDER, duration,
+                                             job=job_queue.current_job())
+        else:
+            returncode, output = run_ffmpeg(args, cwd=UPLOAD_FOLDER, timeout=600,
+                                            job=job_queue.current_job(), duration=duration)
+        print("Subprocess complete", file=sys.stderr)
+        sys.stderr.flush()
+
+        # Naive guess: last arg is output file
+        output_file = args[-1] if len(args) > 2 else None
+
+        if returncode == 0:
+            if key:
+                result_cache.store(key, os.path.join(UPLOAD_FOLDER, output_file))
+            return jsonify({
+                'success': True,
+                'message': 'Command executed successfully.',
+                'output': output,
+                'output_file': output_file
+            })
+        else:
+            return jsonify({
+                'success': False,
+                'message': 'Command failed.',
+                'output': output,
+                'output_file': output_file
+            })
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': 'Exception occurred.', 'error': str(e)}), 500
+
 operation_handlers = {
     'join': handle_join_operation,
     'gif_palette': handle_gif_palette_operation,
     'analyze': handle_analysis_operation,
     'segment_hls' : handle_segment_hls_operation,
     'stabilize': handle_stabilize_operation,   
+    'scene_detect': handle_scene_detect_operation,
+    'waveform': handle_waveform_operation,
 
     # Add more as needed...
 }
-    
+
+def job_files(data):
+    """Names in the upload folder that a queued job reads or writes."""
+    names = [data.get('inputFile'), data.get('output')] + list(data.get('filenames') or [])
+    names = [sanitize_filename(name) for name in names if isinstance(name, str) and name]
+    try:
+        args = shlex.split(data['command']) if isinstance(data.get('command'), str) else []
+    except ValueError:
+        args = []
+    names += [arg for i, arg in enumerate(args[1:], 1) if args[i - 1] == '-i' or i == len(args) - 1]
+    local = []
+    for name in names:
+        name = os.path.normpath(name)
+        if not (os.path.isabs(name) or name.startswith('..') or '://' in name):
+            local.append(name.split(os.sep)[0])
+    return local
+
+def output_files(result):
+    """Top-level names a finished job left in the upload folder."""
+    output = result.get('output_file')
+    if not isinstance(output, str) or not output:
+        return []
+    name = os.path.normpath(output).split(os.sep)[0]
+    names = [name]
+    stem, ext = os.path.splitext(name)
+    if ext == '.m3u8':
+        # Single-variant HLS writes its segments next to the playlist.
+        names += [os.path.basename(p) for p in glob.glob(os.path.join(UPLOAD_FOLDER, glob.escape(stem) + '*.ts'))]
+    return names
+
+def lease_job_files(job):
+    storage.sweep_if_low()
+    storage.acquire(job_files(job.data), owner=job.id)
+
+def release_job_files(job):
+    storage.release(job.id)
+    if not (job.result and job.result.get('success')):
+        return
+    command = job.data.get('command') if job.operation == 'command' else None
+    try:
+        args = shlex.split(command) if isinstance(command, str) else []
+    except ValueError:
+        args = []
+    if args and os.path.basename(args[0]) != 'ffmpeg':
+        # ffprobe's "output_file" is its input.
+        return
+    inputs = {os.path.normpath(arg).split(os.sep)[0] for i, arg in enumerate(args[1:], 1) if args[i - 1] == '-i'}
+    for name in output_files(job.result):
+        if name not in inputs:
+            storage.register(name, 'output')
+
+job_queue = JobQueue(app, store=JobStore(os.path.join(CACHE_FOLDER, 'jobs.db')),
+                     on_submit=lease_job_files, on_finish=release_job_files)
+batch_runner = BatchRunner(job_queue, store=BatchStore(os.path.join(CACHE_FOLDER, 'batches.db')))
+
+def enqueue_job(operation, handler, data):
+    try:
+        job = job_queue.submit(operation, handler, data)
+    except QueueClosed as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    return jsonify({
+        'success': True,
+        'message': 'Job queued.',
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/jobs/{job.id}'
+    }), 202
+
 @app.route('/run', methods=['POST', 'OPTIONS'])
 def run():
     print(f"Received {request.method} on /run", file=sys.stderr)
@@ -584,17 +977,23 @@ def run():
     data = request.get_json()
     operation = data.get('operation')
 
+    if operation == 'analyze' and data.get('inputFile'):
+        # Fresh index entries are answered inline; only real probes are queued.
+        probe = media_index.cached_probe(os.path.join(UPLOAD_FOLDER, sanitize_filename(data.get('inputFile'))))
+        if probe is not None:
+            return jsonify({'success': True, 'probe': probe, 'output': json.dumps(probe, indent=2)})
+
+    if operation == 'scene_detect' and data.get('inputFile'):
+        # A new threshold on an analysed file needs no decode; answer inline.
+        # An input not hashed yet goes to the queue rather than being hashed here.
+        input_file = sanitize_filename(data.get('inputFile'))
+        input_path = os.path.join(UPLOAD_FOLDER, input_file)
+        curve = scene_index.cached(input_path, cached_only=True) if os.path.exists(input_path) else None
+        if curve is not None:
+            return scene_response(input_file, curve, data)
+
     if operation in operation_handlers:
-        return operation_handlers[operation](data)
-    
-    # --- Dispatch by operation ---
-    # if operation == 'join':
-    #     return handle_join_operation(data)
-    # elif operation == 'gif_palette':
-    #     return handle_gif_palette_operation(data)
-    # elif operation == 'analyze':
-    #     return handle_analysis_operation(data)
-    # Future: elif operation == 'trim': return handle_trim_operation(data)
+        return enqueue_job(operation, operation_handlers[operation], data)
 
     # --- Standard FFmpeg Command ---
     command = data.get('command')
@@ -603,55 +1002,233 @@ def run():
     if not command or not isinstance(command, str) or not command.strip().startswith(allowed_cmds):
         return jsonify({'success': False, 'message': 'Only ffmpeg commands are allowed.'}), 400
 
-    # Always overwrite output files without asking
-    if command.startswith("ffmpeg "):
-        command = command.replace("ffmpeg ", "ffmpeg -y ", 1)
-
     if input_file:
         file_path = os.path.join(UPLOAD_FOLDER, input_file)
         if not os.path.exists(file_path):
             return jsonify({'success': False, 'message': f'Input file {input_file} not found on server.'}), 404
 
+    if COMMAND_PREFLIGHT and data.get('validate', True) and command.strip().startswith('ffmpeg'):
+        errors, warnings = preflight(command)
+        if errors:
+            return jsonify({'success': False, 'message': f'Command rejected: {errors[0]}',
+                            'errors': errors, 'warnings': warnings}), 400
+
+    if data.get('cache', True):
+        cached = lookup_cached_result(command)
+        if cached:
+            return cached
+
+    return enqueue_job('command', handle_command_operation, data)
+
+def preflight(command):
+    """``(errors, warnings)`` from checking ``command`` against the ffmpeg
+    capabilities and filter catalogs, without spawning anything."""
     try:
-        print("About to call subprocess", file=sys.stderr)
         args = shlex.split(command.strip())
-        print("After -y Args for FFmpeg:", args, file=sys.stderr)
-        sys.stderr.flush()
-        proc = subprocess.run(args, capture_output=True, text=True, timeout=600, cwd=UPLOAD_FOLDER)
-        print("Subprocess complete", file=sys.stderr)
-        sys.stderr.flush()
+    except ValueError as e:
+        return [f'Could not parse command: {e}'], []
+    return capabilities.check(args)
 
-        output = proc.stdout + proc.stderr
-        print(f"Output is {len(output)} bytes", file=sys.stderr)
+def lookup_cached_result(command):
+    # Runs in the request thread: inputs not hashed yet are a miss, not a read.
+    try:
+        args = shlex.split(command.strip())
+        key = cache_key(args, UPLOAD_FOLDER, digest=media_index.cached_digest)
+    except (ValueError, OSError) as e:
+        print(f"[CACHE] skipping lookup: {e}", file=sys.stderr)
+        return None
+    if not key:
+        return None
+    output_file = args[-1]
+    if not result_cache.lookup(key, os.path.join(UPLOAD_FOLDER, output_file)):
+        return None
+    print(f"[CACHE] hit for {output_file}", file=sys.stderr)
+    storage.register(output_file, 'output')
+    return jsonify({
+        'success': True,
+        'message': 'Command result served from cache.',
+        'output': '',
+        'output_file': output_file,
+        'cached': True
+    })
+
+@app.route('/api/probe', methods=['GET'])
+def get_probe():
+    filename = request.args.get('file')
+    if not filename:
+        return jsonify({'success': False, 'message': 'No file specified.'}), 400
 
-        # Naive guess: last arg is output file
-        output_file = args[-1] if len(args) > 2 else None
-        print(f"Final test to determine quality {request.method} on /run", file=sys.stderr)
+    sanitized = sanitize_filename(filename)
+    input_path = os.path.join(UPLOAD_FOLDER, sanitized)
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': f'File {sanitized} not found.'}), 404
 
-        if proc.returncode == 0:
-            return jsonify({
-                'success': True,
-                'message': 'Command executed successfully.',
-                'output': output,
-                'output_file': output_file
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Command failed.',
-                'output': output,
-                'output_file': output_file
-            })
+    try:
+        return jsonify({'success': True, 'probe': media_index.probe(input_path)})
+    except ProbeError as e:
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), 500
 
-    except Exception as e:
-        return jsonify({'success': False, 'message': 'Exception occurred.', 'error': str(e)}), 500
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'success': True, 'results': result_cache.stats()})
+
+@app.route('/capabilities', methods=['GET'])
+def capabilities_stats():
+    return jsonify({'success': True, **capabilities.stats()})
+
+@app.route('/validate', methods=['POST', 'OPTIONS'])
+def validate_command():
+    """Pre-flight check of a command, as /run does before queueing it."""
+    if request.method == 'OPTIONS':
+        return '', 204
+    command = (request.get_json() or {}).get('command')
+    if not command or not isinstance(command, str) or not command.strip().startswith('ffmpeg'):
+        return jsonify({'success': False, 'message': 'Only ffmpeg commands are allowed.'}), 400
+    errors, warnings = preflight(command)
+    return jsonify({'success': True, 'valid': not errors, 'errors': errors, 'warnings': warnings,
+                    'capabilities_ready': capabilities.ready.is_set()})
+
+@app.route('/storage/stats', methods=['GET'])
+def storage_stats():
+    return jsonify({'success': True, **storage.stats()})
+
+@app.route('/storage/sweep', methods=['POST', 'OPTIONS'])
+def storage_sweep():
+    if request.method == 'OPTIONS':
+        return '', 204
+    result = storage.sweep()
+    if result is None:
+        return jsonify({'success': False, 'message': 'A sweep is already running.'}), 409
+    return jsonify({'success': True, **result})
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'success': True, **job_queue.stats()})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': f'Job {job_id} not found.'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': f'Job {job_id} not found.'}), 404
+    return event_stream(job)
+
+def event_stream(task):
+    """SSE of a job or batch: ``progress`` on every change, then ``done``."""
+    def stream():
+        seen = None
+        while True:
+            version = task.version
+            if version != seen:
+                seen = version
+                event = 'done' if task.finished() else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(task.to_dict())}\n\n"
+                if task.finished():
+                    return
+            if task.wait_for_update(seen, timeout=15) == seen:
+                # Keep proxies from closing an idle connection.
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def validate_batch_command(command):
+    """Error message for a /batch command, or None if it can be queued."""
+    if not command or not isinstance(command, str) or not command.strip().startswith('ffmpeg'):
+        return 'Only ffmpeg commands are allowed.'
+    try:
+        args = shlex.split(command.strip())
+    except ValueError as e:
+        return f'Could not parse command: {e}'
+    fmt = None
+    for i, arg in enumerate(args[:-1]):
+        if arg == '-f':
+            fmt = args[i + 1]
+        elif arg == '-i':
+            source = args[i + 1]
+            local = fmt != 'lavfi' and '://' not in source and not source.startswith('pipe:') and source != '-'
+            if local and not os.path.exists(os.path.join(UPLOAD_FOLDER, source)):
+                return f'Input file {source} not found on server.'
+            fmt = None
+    if COMMAND_PREFLIGHT:
+        errors, _ = capabilities.check(args)
+        if errors:
+            return errors[0]
+    return None
+
+def with_threads(command, threads):
+    """Add ``-threads N`` before the output unless the command sets it."""
+    args = shlex.split(command.strip())
+    if '-threads' in args:
+        return command
+    return shlex.join(args[:-1] + ['-threads', str(threads), args[-1]])
+
+@app.route('/batch', methods=['POST', 'OPTIONS'])
+def run_batch():
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    data = request.get_json() or {}
+    commands = data.get('commands')
+    if not isinstance(commands, list) or not commands:
+        return jsonify({'success': False, 'message': 'Provide a non-empty list of commands.'}), 400
+    if len(commands) > BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'At most {BATCH_MAX_ITEMS} commands per batch.'}), 413
+    try:
+        max_concurrency = int(data.get('max_concurrency') or job_queue.workers)
+        threads = int(data['threads']) if data.get('threads') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'max_concurrency and threads must be integers.'}), 400
+
+    # Validate everything before anything runs.
+    errors = [{'index': i, 'command': c, 'message': msg}
+              for i, c in enumerate(commands) for msg in [validate_batch_command(c)] if msg]
+    if errors:
+        return jsonify({'success': False, 'message': f'{len(errors)} invalid command(s); nothing was run.',
+                        'errors': errors}), 400
+
+    use_cache = data.get('cache', True)
+    items = []
+    for i, command in enumerate(commands):
+        if threads:
+            command = with_threads(command, threads)
+        cached = lookup_cached_result(command) if use_cache else None
+        items.append(BatchItem(i, command, {'command': command, 'cache': use_cache, 'chunked': data.get('chunked')},
+                               result=cached.get_json() if cached else None))
+
+    batch = batch_runner.submit(items, handle_command_operation, max_concurrency)
+    return jsonify({
+        'success': True,
+        'message': 'Batch queued.',
+        'batch_id': batch.id,
+        'total': len(items),
+        'status_url': f'/batch/{batch.id}',
+        'events_url': f'/batch/{batch.id}/events'
+    }), 202
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    batch = batch_runner.get(batch_id)
+    if not batch:
+        return jsonify({'success': False, 'message': f'Batch {batch_id} not found.'}), 404
+    return jsonify({'success': True, **batch.to_dict()})
+
+@app.route('/batch/<batch_id>/events', methods=['GET'])
+def batch_events(batch_id):
+    batch = batch_runner.get(batch_id)
+    if not batch:
+        return jsonify({'success': False, 'message': f'Batch {batch_id} not found.'}), 404
+    return event_stream(batch)
 
 
 @app.route('/api/frame', methods=['GET'])
 def get_video_frame():
-    import tempfile
-    import shutil
-
     filename = request.args.get('file')
     if not filename:
         return jsonify({'success': False, 'message': 'No file specified.'}), 400
@@ -661,32 +1238,103 @@ def get_video_frame():
 
     if not os.path.exists(input_path):
         return jsonify({'success': False, 'message': f'File {sanitized} not found.'}), 404
+    storage.touch(sanitized)
 
-    # Use a temporary file for the extracted frame
-    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmpfile:
-        frame_path = tmpfile.name
-
-    # Use ffmpeg to extract frame 10 (can adjust as needed)
-    ffmpeg_cmd = [
-        'ffmpeg', '-y', '-i', input_path,
-        '-vf', 'select=eq(n\\,10)',
-        '-vframes', '1',
-        frame_path
-    ]
-    print("FFmpeg frame extract:", " ".join(ffmpeg_cmd))
+    try:
+        t = request.args.get('t')
+        frame = request.args.get('frame')
+        width = request.args.get('width')
+        if t is not None:
+            t = parse_time(t)
+            if t is None:
+                raise ValueError(t)
+        frame = int(frame) if frame is not None else (10 if t is None else None)  # frame 10 by default, as before
+        width = int(width) if width else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid t, frame or width.'}), 400
 
     try:
-        proc = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, timeout=30)
-        if proc.returncode != 0 or not os.path.exists(frame_path):
-            print(proc.stderr)
-            return jsonify({'success': False, 'message': 'Failed to extract frame.', 'output': proc.stderr}), 500
+        key, data = frame_server.frame(input_path, t=t, frame=frame, width=width,
+                                       snap=request.args.get('snap') in ('1', 'true'))
+    except FrameError as e:
+        print(e.output, file=sys.stderr)
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), e.status
+    except (ProbeError, subprocess.TimeoutExpired) as e:
+        return jsonify({'success': False, 'message': 'Failed to extract frame.', 'output': getattr(e, 'output', '')}), 500
+
+    resp = Response(data, mimetype='image/jpeg')
+    resp.set_etag(key)
+    resp.cache_control.max_age = 3600
+    return resp.make_conditional(request)
+
+@app.route('/api/frame/stats', methods=['GET'])
+def frame_stats():
+    return jsonify(frame_server.stats())
+
+
+_waveform_jobs = {}
+_waveform_jobs_lock = threading.Lock()
+
+def queue_waveform(input_file):
+    """202 with the job building ``input_file``'s peaks, queued once per file;
+    a failed build is reported (and forgotten, so a later request retries)."""
+    with _waveform_jobs_lock:
+        job_id = _waveform_jobs.get(input_file)
+        job = job_queue.get(job_id) if job_id else None
+        if job is not None and job.status == 'failed':
+            del _waveform_jobs[input_file]
+            return jsonify(job.result), job.status_code or 500
+        if job is None or job.finished():
+            resp, status = enqueue_job('waveform', handle_waveform_operation, {'inputFile': input_file})
+            if status != 202:
+                return resp, status
+            _waveform_jobs[input_file] = resp.get_json()['job_id']
+        else:
+            resp = jsonify({'success': True, 'message': 'Waveform is being built.', 'job_id': job.id,
+                            'status': job.status, 'status_url': f'/jobs/{job.id}'})
+    resp.headers['Retry-After'] = '2'
+    return resp, 202
+
+@app.route('/api/waveform', methods=['GET'])
+def get_waveform():
+    """Min/max/RMS peaks of ``file`` between ``start`` and ``end`` seconds,
+    from the cached peak pyramid level that fits ``width`` pixels."""
+    filename = request.args.get('file')
+    if not filename:
+        return jsonify({'success': False, 'message': 'No file specified.'}), 400
+
+    sanitized = sanitize_filename(filename)
+    input_path = os.path.join(UPLOAD_FOLDER, sanitized)
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': f'File {sanitized} not found.'}), 404
+    storage.touch(sanitized)
 
-        # Send the image file directly
-        return send_file(frame_path, mimetype='image/jpeg')
+    try:
+        start = parse_time(request.args.get('start', '0'))
+        end = parse_time(request.args['end']) if request.args.get('end') else None
+        width = int(request.args.get('width', 1000))
+        level = int(request.args['level']) if request.args.get('level') else None
+        if start is None or start < 0 or (end is not None and end <= start) or not 0 < width <= WAVEFORM_MAX_WIDTH:
+            raise ValueError()
+    except ValueError:
+        return jsonify({'success': False, 'message': f'Invalid start, end, width (1-{WAVEFORM_MAX_WIDTH}) or level.'}), 400
 
-    finally:
-        # Clean up the temp file on next server restart (or leave for debugging)
-        pass
+    try:
+        pyramid = waveform_index.cached(input_path, cached_only=True)
+    except WaveformError as e:
+        return jsonify({'success': False, 'message': str(e), 'output': e.output}), e.status
+    if pyramid is None:
+        return queue_waveform(sanitized)
+
+    end = min(end, pyramid.duration) if end is not None else pyramid.duration
+    if level is None:
+        level = pyramid.pick_level(start, end, width)
+    elif not 0 <= level < len(pyramid.levels):
+        return jsonify({'success': False, 'message': f'level must be 0-{len(pyramid.levels) - 1}.'}), 400
+
+    resp = jsonify({'success': True, 'file': sanitized, **pyramid.window(start, end, level)})
+    resp.cache_control.max_age = 3600
+    return resp
 
 
 @app.route("/upload-timeline", methods=["POST"])
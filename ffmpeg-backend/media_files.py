@@ -0,0 +1,88 @@
+import mimetypes
+import os
+
+from flask import Response, request, send_file
+
+# Streaming formats the stdlib table doesn't know (or gets wrong).
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/mp2t', '.ts')
+mimetypes.add_type('video/iso.segment', '.m4s')
+mimetypes.add_type('video/mp4', '.mp4')
+mimetypes.add_type('video/quicktime', '.mov')
+mimetypes.add_type('video/webm', '.webm')
+mimetypes.add_type('video/x-matroska', '.mkv')
+mimetypes.add_type('image/webp', '.webp')
+
+# Playlists change while a stream is being cut; segments and other media
+# are revalidated against their ETag.
+_MAX_AGE = {
+    '.m3u8': 0,
+    '.mpd': 0,
+    '.ts': 3600,
+    '.m4s': 3600,
+}
+
+
+def _sendfile_capable(environ):
+    # gunicorn sends a wsgi.file_wrapper with sendfile(), starting at the
+    # file's current position and stopping at Content-Length.
+    return 'wsgi.file_wrapper' in environ and environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')
+
+
+def send_media(path, etag=None):
+    """Serve ``path`` with Range/206, ETag/Last-Modified and media MIME types.
+
+    Full responses go through send_file(), which hands the file to the
+    server's wsgi.file_wrapper (sendfile under gunicorn). Plain byte-range
+    requests under gunicorn are also answered with a seeked file_wrapper, so
+    seeking in a player never copies bytes through Python.
+    """
+    st = os.stat(path)
+    ext = os.path.splitext(path)[1].lower()
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    etag = etag or f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    max_age = _MAX_AGE.get(ext)
+
+    plain_range = (
+        request.range is not None
+        and not request.if_range
+        and not request.if_none_match
+        and not request.if_modified_since
+        and _sendfile_capable(request.environ)
+    )
+    if plain_range:
+        byte_range = request.range.range_for_length(st.st_size)
+        if byte_range is None:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = f'bytes */{st.st_size}'
+            return resp
+        start, stop = byte_range
+        f = open(path, 'rb')
+        f.seek(start)
+        resp = Response(
+            request.environ['wsgi.file_wrapper'](f, 1024 * 1024),
+            status=206,
+            mimetype=mimetype,
+            direct_passthrough=True,
+        )
+        resp.content_length = stop - start
+        resp.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{st.st_size}'
+        resp.headers['Accept-Ranges'] = 'bytes'
+        resp.set_etag(etag)
+        resp.last_modified = st.st_mtime
+        if max_age is not None:
+            resp.cache_control.public = True
+            resp.cache_control.max_age = max_age
+        return resp
+
+    resp = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=etag,
+        last_modified=st.st_mtime,
+        max_age=max_age,
+    )
+    if max_age == 0:
+        resp.cache_control.no_cache = True
+    return resp
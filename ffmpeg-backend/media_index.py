@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from filehash import file_digest, remember_digest
+
+PROBE_WORKERS = int(os.environ.get('PROBE_WORKERS', 2))
+# Bump when the ffprobe invocation changes, so indexed probes are redone.
+PROBE_VERSION = 2
+
+
+class ProbeError(Exception):
+    def __init__(self, message, output=''):
+        super().__init__(message)
+        self.output = output
+
+
+class MediaIndex:
+    """Persistent ffprobe results and content hashes keyed by path.
+
+    Rows are valid while the file's size and mtime are unchanged; anything
+    else is re-probed on the next read. Hot entries are also kept in memory,
+    so a cached probe is a stat() plus a dict lookup.
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+            " sha256 TEXT, probe TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(media)")}
+        if 'probe_version' not in columns:
+            self._db.execute("ALTER TABLE media ADD COLUMN probe_version INTEGER")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='probe')
+
+    def _row(self, path, st):
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            row = self._memory.get(path)
+            if row and row['stat'] == key:
+                return row
+            found = self._db.execute(
+                "SELECT size, mtime_ns, sha256, probe, probe_version FROM media WHERE path = ?", (path,)).fetchone()
+            if not found or (found[0], found[1]) != key:
+                self._memory.pop(path, None)
+                return None
+            # A probe from an older ffprobe invocation is redone; the hash stays valid.
+            probe = json.loads(found[3]) if found[3] and found[4] == PROBE_VERSION else None
+            row = {'stat': key, 'sha256': found[2], 'probe': probe}
+            self._memory[path] = row
+        if row['sha256']:
+            remember_digest(path, st, row['sha256'])
+        return row
+
+    def _save(self, path, st, sha256=None, probe=None):
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            row = self._memory.get(path)
+            if not row or row['stat'] != key:
+                row = {'stat': key, 'sha256': None, 'probe': None}
+            if sha256:
+                row['sha256'] = sha256
+            if probe is not None:
+                row['probe'] = probe
+            self._memory[path] = row
+            self._db.execute(
+                "INSERT OR REPLACE INTO media (path, size, mtime_ns, sha256, probe, probe_version)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, row['sha256'],
+                 json.dumps(row['probe']) if row['probe'] is not None else None,
+                 PROBE_VERSION if row['probe'] is not None else None))
+            self._db.commit()
+
+    def cached_probe(self, path):
+        """The indexed probe for ``path`` if it is still fresh, else None."""
+        path = os.path.abspath(path)
+        try:
+            row = self._row(path, os.stat(path))
+        except OSError:
+            return None
+        return row['probe'] if row else None
+
+    def probe(self, path):
+        """Structured ffprobe output (format + streams) for ``path``."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self._row(path, st)
+        if row and row['probe'] is not None:
+            return row['probe']
+
+        cmd = ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-show_data_hash", "sha256",
+               "-of", "json", path]
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+        if proc.returncode != 0:
+            raise ProbeError("ffprobe reported errors", proc.stdout + proc.stderr)
+        probe = json.loads(proc.stdout)
+        self._save(path, st, probe=probe)
+        return probe
+
+    def digest(self, path):
+        """sha256 of ``path``, persisted so restarts don't re-hash large uploads."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self._row(path, st)
+        if row and row['sha256']:
+            return row['sha256']
+        sha256 = file_digest(path)
+        self._save(path, st, sha256=sha256)
+        return sha256
+
+    def cached_digest(self, path):
+        """The indexed sha256 for ``path`` if known and fresh; never hashes."""
+        path = os.path.abspath(path)
+        try:
+            row = self._row(path, os.stat(path))
+        except OSError:
+            return None
+        return row['sha256'] if row else None
+
+    def record_digest(self, path, sha256):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        remember_digest(path, st, sha256)
+        self._save(path, st, sha256=sha256)
+
+    def duration(self, path, cwd=None):
+        """Format duration in seconds, or None. Drop-in for probe_duration()."""
+        if cwd:
+            path = os.path.join(cwd, path)
+        try:
+            return float(self.probe(path)['format']['duration'])
+        except (OSError, ProbeError, KeyError, TypeError, ValueError):
+            return None
+
+    def index_async(self, path, sha256=None):
+        """Probe (and hash, unless given) ``path`` in the background."""
+        def work():
+            try:
+                if sha256:
+                    self.record_digest(path, sha256)
+                else:
+                    self.digest(path)
+                self.probe(path)
+            except Exception as e:
+                print(f"[INDEX] could not index {path}: {e}", file=sys.stderr)
+        return self._pool.submit(work)
@@ -1,35 +1,123 @@
 import requests
+import argparse
 import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from requests.adapters import HTTPAdapter
 
-NODE_API = "http://localhost:8300"
+from tool_search import ToolIndex
+from call_cache import CallCache, tools_version
 
-# --- 1. Get available tools and tool descriptions at startup ---
+NODE_API = "http://localhost:8300"
+# Tool descriptions are cached here; within TOOL_CACHE_TTL seconds startup does no network work.
+TOOL_CACHE_PATH = os.environ.get(
+    "OLLAMARUN_TOOL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "ffmpeg-ollamarun", "tools.json"))
+TOOL_CACHE_TTL = int(os.environ.get("OLLAMARUN_TOOL_CACHE_TTL", 300))
+# Prompt -> function_call cache; set OLLAMARUN_CALL_CACHE=0 to always ask the model.
+CALL_CACHE_PATH = os.environ.get(
+    "OLLAMARUN_CALL_CACHE_PATH", os.path.join(os.path.dirname(TOOL_CACHE_PATH), "calls.db"))
+CALL_CACHE_ENABLED = os.environ.get("OLLAMARUN_CALL_CACHE", "1") not in ("0", "false", "no")
+DISCOVERY_WORKERS = 8
+REQUEST_TIMEOUT = 10
+# Seconds a tool endpoint may take, so a hung call can't hold a --batch slot forever.
+TOOL_TIMEOUT = int(os.environ.get("OLLAMARUN_TOOL_TIMEOUT", 120))
+
+# One pooled session, so tool calls and discovery reuse connections.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# --- 1. Get available tools and tool descriptions (cached, on first use) ---
+
+def _load_tool_cache():
+    try:
+        with open(TOOL_CACHE_PATH) as f:
+            cached = json.load(f)
+        if cached.get("node_api") == NODE_API:
+            return cached
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _save_tool_cache(etag, tools, tool_meta):
+    os.makedirs(os.path.dirname(TOOL_CACHE_PATH), exist_ok=True)
+    tmp_path = f"{TOOL_CACHE_PATH}.{os.getpid()}.part"
+    with open(tmp_path, "w") as f:
+        json.dump({"node_api": NODE_API, "etag": etag, "fetched_at": time.time(),
+                   "tools": tools, "tool_meta": tool_meta}, f)
+    os.replace(tmp_path, TOOL_CACHE_PATH)
+
+def _describe_each(tools):
+    # Older Node servers only have the per-tool route; fetch those concurrently.
+    def describe(name):
+        resp = SESSION.get(f"{NODE_API}/api/describe-tool/{name}", timeout=REQUEST_TIMEOUT)
+        return name, resp.json() if resp.ok else None
+
+    with ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS) as pool:
+        return {name: desc for name, desc in pool.map(describe, tools) if desc}
 
 def fetch_tools_and_descriptions():
-    # List of tool names
-    tools_resp = requests.get(f"{NODE_API}/api/list-tools")
-    tools = tools_resp.json()["tools"]
-
-    # Descriptions (with schema)
-    tool_meta = {}
-    for name in tools:
-        desc_resp = requests.get(f"{NODE_API}/api/describe-tool/{name}")
-        if desc_resp.ok:
-            tool_meta[name] = desc_resp.json()
+    cached = _load_tool_cache()
+    if cached and time.time() - cached.get("fetched_at", 0) < TOOL_CACHE_TTL:
+        return cached["tools"], cached["tool_meta"]
+
+    headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+    try:
+        resp = SESSION.get(f"{NODE_API}/api/describe-tools", headers=headers, timeout=REQUEST_TIMEOUT)
+        if resp.status_code == 304:
+            _save_tool_cache(cached["etag"], cached["tools"], cached["tool_meta"])
+            return cached["tools"], cached["tool_meta"]
+        if resp.ok:
+            data = resp.json()
+            tools = data["tools"]
+            tool_meta = {desc["name"]: desc for desc in data["descriptions"]}
+            etag = resp.headers.get("ETag")
+        else:
+            tools = SESSION.get(f"{NODE_API}/api/list-tools", timeout=REQUEST_TIMEOUT).json()["tools"]
+            tool_meta = _describe_each(tools)
+            etag = None
+    except requests.RequestException as e:
+        if cached:
+            print(f"[WARN] Tool discovery failed ({e}); using cached descriptions.")
+            return cached["tools"], cached["tool_meta"]
+        raise
+    _save_tool_cache(etag, tools, tool_meta)
     return tools, tool_meta
 
-TOOLS, TOOL_META = fetch_tools_and_descriptions()
+_discovery_lock = threading.Lock()
+_discovered = {}
+
+def discover():
+    """``(TOOLS, TOOL_META, INSTRUCTION)``, built once on first use."""
+    with _discovery_lock:
+        if not _discovered:
+            tools, tool_meta = fetch_tools_and_descriptions()
+            lines = {name: tool_line(tool) for name, tool in tool_meta.items()}
+            calls = CallCache(CALL_CACHE_PATH, tools_version(tool_meta)) if CALL_CACHE_ENABLED else None
+            _discovered.update(TOOLS=tools, TOOL_META=tool_meta, LINES=lines, INDEX=ToolIndex(tool_meta),
+                               INSTRUCTION=build_instruction(tool_meta, lines=lines), CALLS=calls)
+    return _discovered["TOOLS"], _discovered["TOOL_META"], _discovered["INSTRUCTION"]
+
+def __getattr__(name):
+    # TOOLS, TOOL_META and INSTRUCTION used to be built at import time.
+    if name in ("TOOLS", "TOOL_META", "INSTRUCTION"):
+        discover()
+        return _discovered[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- 2. Map tool name to endpoint pattern ---
 def call_tool(tool_name, **kwargs):
-    if tool_name not in TOOL_META:
+    _, tool_meta, _ = discover()
+    if tool_name not in tool_meta:
         raise ValueError(f"Unknown tool: {tool_name}")
 
-    endpoint = TOOL_META[tool_name].get("route")
+    endpoint = tool_meta[tool_name].get("route")
     if not endpoint:
         raise ValueError(f"No route defined for tool: {tool_name}")
     url = f"{NODE_API}{endpoint}"
-    resp = requests.post(url, json=kwargs)
+    resp = SESSION.post(url, json=kwargs, timeout=TOOL_TIMEOUT)
     try:
         result = resp.json()
     except Exception as e:
@@ -56,40 +144,74 @@ def build_functions_for_llm(tool_meta):
     return out
 
 # --- 4. Generate system prompt from tool metadata ---
-def build_instruction(tool_meta):
-    tool_lines = []
-    for tool in tool_meta.values():
-        params = ""
-        # Parameters may be a list (your current format)
-        if isinstance(tool.get("parameters"), list):
-            params = ", ".join(
-                p.get("name", str(p)) if isinstance(p, dict) else str(p)
-                for p in tool["parameters"]
-            )
-        # Parameters may be a dict with OpenAI-style { properties: ... }
-        elif isinstance(tool.get("parameters"), dict) and "properties" in tool["parameters"]:
-            params = ", ".join(tool["parameters"]["properties"].keys())
-        # Parameters may be missing or empty
-        else:
-            params = ""
-        tool_lines.append(f'- {tool["name"]}({params})')
-    return (
-        "You are an API assistant. You have access to ONLY these tools. "
-        "Use EXACTLY the function names and argument names as shown. "
-        "Never invent or reword the names. "
-        "Valid tools:\n" +
-        "\n".join(tool_lines) +
-        "\nWhen the user asks for an operation, ALWAYS reply with ONLY a single line of valid JSON, exactly like this:\n"
-        "{\"function_call\": {\"name\": \"<function_name>\", \"arguments\": { ... }}}\n"
-        "Never include explanations, code blocks, markdown, or stray text. Only reply with raw JSON. "
-        "If you do not recognize the operation, reply: {\"function_call\": {\"name\": null, \"arguments\": {}}}"
+# The prompt is assembled per request from these fragments, listing only the
+# tools relevant to the request (see tool_search.py).
+INSTRUCTION_HEADER = (
+    "You are an API assistant. You have access to ONLY these tools. "
+    "Use EXACTLY the function names and argument names as shown. "
+    "Never invent or reword the names. "
+    "Valid tools:\n"
+)
+INSTRUCTION_FOOTER = (
+    "\nWhen the user asks for an operation, ALWAYS reply with ONLY a single line of valid JSON, exactly like this:\n"
+    "{\"function_call\": {\"name\": \"<function_name>\", \"arguments\": { ... }}}\n"
+    "Never include explanations, code blocks, markdown, or stray text. Only reply with raw JSON. "
+    "If you do not recognize the operation, reply: {\"function_call\": {\"name\": null, \"arguments\": {}}}"
+)
+# Extra guidance, only sent when the tool is offered.
+TOOL_NOTES = {
+    "generateFilterLabCommand": (
         "For generateFilterLabCommand, only use:  - inputFilename (string) - filters (array of string, e.g. [\"hue\"]) - parameterValues (object: { \"hue\": { \"h\": 0 } }) // adjust keys/values per filter docs. "
         "Do NOT include availableFiltersData in the function arguments."
+    ),
+}
+
+def tool_line(tool):
+    params = ""
+    # Parameters may be a list (your current format)
+    if isinstance(tool.get("parameters"), list):
+        params = ", ".join(
+            p.get("name", str(p)) if isinstance(p, dict) else str(p)
+            for p in tool["parameters"]
+        )
+    # Parameters may be a dict with OpenAI-style { properties: ... }
+    elif isinstance(tool.get("parameters"), dict) and "properties" in tool["parameters"]:
+        params = ", ".join(tool["parameters"]["properties"].keys())
+    # Parameters may be missing or empty
+    return f'- {tool["name"]}({params})'
+
+def build_instruction(tool_meta, names=None, lines=None):
+    """System prompt offering ``names`` (default: every tool). ``lines`` are
+    precomputed ``tool_line`` fragments by name."""
+    names = list(tool_meta) if names is None else names
+    lines = lines or {}
+    return (
+        INSTRUCTION_HEADER +
+        "\n".join(lines.get(name) or tool_line(tool_meta[name]) for name in names) +
+        INSTRUCTION_FOOTER +
+        "".join(TOOL_NOTES[name] for name in names if name in TOOL_NOTES)
     )
 
-INSTRUCTION = build_instruction(TOOL_META)
+_instructions = {}
+
+def instruction_for(prompt):
+    """System prompt listing the tools that match ``prompt``; the full list
+    when the match is weak."""
+    discover()
+    names = _discovered["INDEX"].select(prompt)
+    if names is None:
+        return _discovered["INSTRUCTION"]
+    key = tuple(names)
+    if key not in _instructions:
+        _instructions[key] = build_instruction(_discovered["TOOL_META"], names, _discovered["LINES"])
+    return _instructions[key]
 
 MODEL = "qwen3:latest"  # Or any model from your list
+OLLAMA_API_URL = os.environ.get("OLLAMA_API_URL", "http://localhost:11434/v1/chat/completions")
+# Seconds to wait for the next streamed token.
+LLM_TIMEOUT = int(os.environ.get("OLLAMA_TIMEOUT", 300))
+# Tasks in flight at once in --batch mode.
+AGENT_CONCURRENCY = int(os.environ.get("AGENT_CONCURRENCY", 4))
 
 def extract_function_call(msg):
     content = msg.get("content", "")
@@ -123,9 +245,170 @@ def extract_function_call(msg):
         print(f"[WARN] Could not parse JSON function call: {e}\nContent: {content}")
         return None
 
+class FunctionCallScanner:
+    """Finds the first ``{"function_call": ...}`` object in streamed text.
+
+    Tracks brace depth outside JSON strings, so the call is available the
+    moment its closing brace arrives. Other objects (e.g. in a model's
+    reasoning) are parsed and skipped.
+    """
+
+    def __init__(self):
+        self.text = []
+        self._object = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Returns the function_call dict once complete, else None."""
+        self.text.append(chunk)
+        for ch in chunk:
+            if self._depth == 0 and ch != "{":
+                continue
+            self._object.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    raw, self._object = "".join(self._object), []
+                    try:
+                        call = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if isinstance(call, dict) and "function_call" in call:
+                        return call["function_call"]
+        return None
+
+    @property
+    def content(self):
+        return "".join(self.text)
+
+def stream_function_call(prompt, session=SESSION):
+    """Ask the model about ``prompt`` with a streamed completion and return
+    ``(function_call, content)`` as soon as the call's JSON closes; the rest
+    of the generation is abandoned."""
+    payload = {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": instruction_for(prompt)},
+            {"role": "user", "content": prompt}
+        ],
+        "stream": True
+    }
+    scanner = FunctionCallScanner()
+    with session.post(OLLAMA_API_URL, json=payload, stream=True, timeout=(REQUEST_TIMEOUT, LLM_TIMEOUT)) as resp:
+        if not resp.ok:
+            raise RuntimeError(f"Ollama API error: {resp.status_code} {resp.text}")
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            fc = scanner.feed(choices[0].get("delta", {}).get("content") or "")
+            if fc is not None:
+                return fc, scanner.content
+    # The stream ended without a complete object; fall back to the lenient parser.
+    return extract_function_call({"content": scanner.content}), scanner.content
+
+def resolve_function_call(prompt, session=SESSION):
+    """``(function_call, content, cached)`` for ``prompt``; a cached call
+    for the same phrasing skips the model entirely."""
+    discover()
+    calls = _discovered["CALLS"]
+    fc = calls.get(prompt) if calls else None
+    if fc is not None:
+        return fc, "", True
+    fc, content = stream_function_call(prompt, session)
+    return fc, content, False
+
+def remember_function_call(prompt, fc):
+    # Only calls the tool accepted are cached.
+    calls = _discovered.get("CALLS")
+    if calls:
+        calls.put(prompt, fc)
+
+def run_task(prompt, session=SESSION):
+    """One natural-language task: model -> function_call -> tool. Returns a
+    result dict instead of printing, for batch mode."""
+    started = time.time()
+    task = {"prompt": prompt, "function_call": None, "result": None, "error": None, "cached": False}
+    try:
+        fc, content, task["cached"] = resolve_function_call(prompt, session)
+        task["llm_seconds"] = round(time.time() - started, 3)
+        if not fc or not fc.get("name"):
+            task["error"] = "No valid function_call found in response."
+            task["content"] = content
+        else:
+            task["function_call"] = fc
+            task["result"] = call_tool(fc["name"], **fc.get("arguments", {}))
+            if not task["cached"]:
+                remember_function_call(prompt, fc)
+    except Exception as e:
+        task["error"] = str(e)
+    task["seconds"] = round(time.time() - started, 3)
+    return task
+
+def read_tasks(stream):
+    # One prompt per line; JSON lines may carry {"prompt": ...}. Blank lines and # comments are skipped.
+    for line in stream:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            line = json.loads(line).get("prompt", "")
+        if line:
+            yield line
+
+def run_batch(prompts, concurrency=AGENT_CONCURRENCY, out=None):
+    """Run ``prompts`` with at most ``concurrency`` in flight, writing one
+    JSON line per task (in completion order) to ``out``."""
+    out = out or sys.stdout
+    discover()
+    # Enough pooled connections for every in-flight LLM request and tool call.
+    SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=max(16, concurrency * 2)))
+    started = time.time()
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {}
+        for index, prompt in enumerate(prompts):
+            # Keep the queue bounded too, so a huge task file isn't read up front.
+            if len(futures) >= concurrency * 2:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    failed += _report(futures.pop(future), future.result(), out)
+                    done += 1
+            futures[pool.submit(run_task, prompt)] = index
+        for future in as_completed(futures):
+            failed += _report(futures[future], future.result(), out)
+            done += 1
+    print(f"[BATCH] {done} task(s), {failed} failed, in {time.time() - started:.1f}s "
+          f"(concurrency {concurrency})", file=sys.stderr)
+    if _discovered["CALLS"]:
+        print(f"[BATCH] call cache: {json.dumps(_discovered['CALLS'].stats())}", file=sys.stderr)
+    return failed
+
+def _report(index, task, out):
+    out.write(json.dumps({"index": index, **task}) + "\n")
+    out.flush()
+    return 1 if task["error"] else 0
+
 def main():
+    _, tool_meta, _ = discover()
     print("Ask me to do something with your video files, e.g.:")
-    for tool in TOOL_META.values():
+    for tool in tool_meta.values():
         print(f"  - {tool.get('description', tool['name'])}")
     print("Ctrl+C to exit.\n")
 
@@ -134,50 +417,55 @@ def main():
         if not prompt.strip():
             continue
 
-        OLLAMA_API_URL = "http://localhost:11434/v1/chat/completions"
-        payload = {
-            "model": MODEL,
-            "messages": [
-                {"role": "system", "content": INSTRUCTION},
-                {"role": "user", "content": prompt}
-            ],
-            "stream": False
-        }
-
-        resp = requests.post(OLLAMA_API_URL, json=payload)
-        if not resp.ok:
-            print(f"Ollama API error: {resp.status_code} {resp.text}")
-            continue
-
-        response = resp.json()
-        print("Raw Ollama response:", json.dumps(response, indent=2))  # DEBUG
-
-        msg = response.get("message")
-        if msg is None and "choices" in response and len(response["choices"]):
-            msg = response["choices"][0].get("message")
-        if msg is None and "messages" in response and len(response["messages"]):
-            msg = response["messages"][0]
-        if msg is None:
-            print("No usable 'message' found in Ollama response.")
+        try:
+            fc, content, cached = resolve_function_call(prompt)
+        except (RuntimeError, requests.RequestException) as e:
+            print(e)
             continue
 
-        fc = extract_function_call(msg)
         if not fc:
             print("No valid function_call found in response.")
-            print(f"LLM response: {msg.get('content', '[no content in response]')}")
+            print(f"LLM response: {content or '[no content in response]'}")
             continue
 
         fn_name = fc.get("name")
         args = fc.get("arguments", {})
-        print(f"→ LLM wants to call {fn_name} with {args}")
+        print(f"→ {'Cached call' if cached else 'LLM wants to call'} {fn_name} with {args}")
         try:
             tool_result = call_tool(fn_name, **args)
             print(f"← MCP response: {json.dumps(tool_result, indent=2)}")
+            if not cached:
+                remember_function_call(prompt, fc)
         except Exception as e:
             print(f"Error calling tool {fn_name}: {e}")
 
+def cli():
+    parser = argparse.ArgumentParser(description="Natural-language media jobs via Ollama and the MCP tools.")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run every task in FILE ('-' for stdin) concurrently and print JSON lines")
+    parser.add_argument("--concurrency", type=int, default=AGENT_CONCURRENCY,
+                        help=f"tasks in flight in batch mode (default {AGENT_CONCURRENCY})")
+    parser.add_argument("--no-cache", action="store_true", help="always ask the model (skip the call cache)")
+    parser.add_argument("--cache-stats", action="store_true", help="print call cache statistics and exit")
+    options = parser.parse_args()
+    if options.no_cache:
+        global CALL_CACHE_ENABLED
+        CALL_CACHE_ENABLED = False
+    if options.cache_stats:
+        discover()
+        print(json.dumps(_discovered["CALLS"].stats() if _discovered["CALLS"] else {"enabled": False}, indent=2))
+        return
+    if not options.batch:
+        return main()
+    if options.batch == "-":
+        failed = run_batch(read_tasks(sys.stdin), max(1, options.concurrency))
+    else:
+        with open(options.batch) as f:
+            failed = run_batch(read_tasks(f), max(1, options.concurrency))
+    sys.exit(1 if failed else 0)
+
 if __name__ == "__main__":
-    main()
+    cli()
 
 
 
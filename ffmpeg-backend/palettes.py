@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+
+GIF_STATS_MODES = ('full', 'diff', 'single')
+GIF_DITHERS = ('bayer', 'heckbert', 'floyd_steinberg', 'sierra2', 'sierra2_4a', 'none')
+# Bump when the palette filter settings change, so old palettes aren't reused.
+PALETTE_VERSION = 1
+
+
+class GifOptionsError(Exception):
+    def __init__(self, message, status=400, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+def gif_options(data):
+    """Validated GIF settings from a ``gif_palette`` request body."""
+    try:
+        options = {
+            'fps': float(data.get('fps', 10)),
+            'scale_height': int(data.get('scale_height', 320)),
+            'max_colors': int(data.get('max_colors', 256)),
+            'bayer_scale': int(data.get('bayer_scale', 2)),
+        }
+    except (TypeError, ValueError):
+        raise GifOptionsError('fps, scale_height, max_colors and bayer_scale must be numbers.')
+    options['stats_mode'] = data.get('stats_mode') or 'full'
+    options['dither'] = data.get('dither') or 'sierra2_4a'
+    options['start_time'] = str(data['start_time']) if data.get('start_time') else None
+    options['duration'] = str(data['duration']) if data.get('duration') else None
+    if options['stats_mode'] not in GIF_STATS_MODES:
+        raise GifOptionsError(f"stats_mode must be one of {', '.join(GIF_STATS_MODES)}.")
+    if options['dither'] not in GIF_DITHERS:
+        raise GifOptionsError(f"dither must be one of {', '.join(GIF_DITHERS)}.")
+    if not 0 < options['fps'] <= 60 or options['scale_height'] <= 0:
+        raise GifOptionsError('fps must be in (0, 60] and scale_height positive.')
+    if not 2 <= options['max_colors'] <= 256 or not 0 <= options['bayer_scale'] <= 5:
+        raise GifOptionsError('max_colors must be 2-256 and bayer_scale 0-5.')
+    options['fps'] = f"{options['fps']:g}"
+    return options
+
+
+def _input_args(input_path, options):
+    cmd = []
+    if options['start_time']:
+        cmd += ["-ss", options['start_time']]
+    if options['duration']:
+        cmd += ["-t", options['duration']]
+    return cmd + ["-i", input_path]
+
+
+def _filters(options):
+    scale = f"fps={options['fps']},scale=-1:{options['scale_height']}:flags=lanczos"
+    palettegen = f"palettegen=stats_mode={options['stats_mode']}:max_colors={options['max_colors']}"
+    paletteuse = f"paletteuse=dither={options['dither']}"
+    if options['dither'] == 'bayer':
+        paletteuse += f":bayer_scale={options['bayer_scale']}"
+    if options['stats_mode'] == 'single':
+        paletteuse += ":new=1"  # a fresh palette per frame
+    elif options['stats_mode'] == 'diff':
+        paletteuse += ":diff_mode=rectangle"
+    return scale, palettegen, paletteuse
+
+
+def gif_args(input_path, options, output_path, palette_out=None, palette_in=None):
+    """ffmpeg argv for a GIF made in a single invocation.
+
+    With ``palette_in`` the cached palette is the second input and the source
+    is decoded once, straight into ``paletteuse``. Otherwise the scaled frames
+    are ``split`` between ``palettegen`` and ``paletteuse`` inside one
+    filtergraph; with ``palette_out`` the generated palette is also written
+    there for the next export of the same segment.
+    """
+    scale, palettegen, paletteuse = _filters(options)
+    cmd = ["ffmpeg", "-y"] + _input_args(input_path, options)
+    if palette_in:
+        return cmd + ["-i", palette_in,
+                      "-filter_complex", f"[0:v]{scale}[x];[x][1:v]{paletteuse}[out]",
+                      "-map", "[out]", output_path]
+    if palette_out is None:
+        graph = f"[0:v]{scale},split[a][b];[a]{palettegen}[p];[b][p]{paletteuse}[out]"
+        return cmd + ["-filter_complex", graph, "-map", "[out]", output_path]
+    graph = (f"[0:v]{scale},split[a][b];[a]{palettegen},split[p1][p2];"
+             f"[b][p1]{paletteuse}[out]")
+    return cmd + ["-filter_complex", graph,
+                  "-map", "[out]", output_path,
+                  "-map", "[p2]", "-frames:v", "1", "-update", "1", palette_out]
+
+
+class PaletteCache:
+    """GIF palettes keyed by (input sha256, segment, fps, scale, palettegen
+    settings), so re-exports with another dither only decode once.
+
+    ``single`` palettes are per frame and never cached.
+    """
+
+    def __init__(self, root, digest):
+        self.root = root
+        self.digest = digest
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, input_path, options):
+        if options['stats_mode'] == 'single':
+            return None
+        parts = [PALETTE_VERSION, self.digest(input_path), options['start_time'], options['duration'],
+                 options['fps'], options['scale_height'], options['stats_mode'], options['max_colors']]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.png")
+
+    def get(self, key):
+        path = self.path(key) if key else None
+        if path and os.path.exists(path):
+            os.utime(path)
+            return path
+        return None
+
+    def put(self, key, palette_path):
+        if key and os.path.exists(palette_path):
+            os.replace(palette_path, self.path(key))
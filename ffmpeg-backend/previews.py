@@ -0,0 +1,225 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_progress import run_ffmpeg, stream_ffmpeg
+
+# Height of the low-resolution proxy that previews are rendered from.
+PROXY_HEIGHT = int(os.environ.get('PROXY_HEIGHT', 360))
+# Rendered previews kept before the least recently used are removed.
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES', 1024 ** 3))
+# Bump when the preview encode settings change, so old renders aren't reused.
+PREVIEW_VERSION = 2
+
+# Filters with pixel coordinates or sizes that would land elsewhere on a proxy.
+_GEOMETRY_FILTERS = re.compile(
+    r'(^|[,;\]\s])(crop|delogo|removelogo|drawbox|drawgrid|drawtext|pad|overlay|perspective|zoompan)\b')
+
+_VIDEO_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "28", "-pix_fmt", "yuv420p", "-c:a", "aac"]
+
+
+class PreviewCache:
+    """Short filter previews, rendered from a proxy and cached by content.
+
+    Every upload gets one proxy: PROXY_HEIGHT lines, all-intra H.264, so an
+    input seek to the preview window is a single-frame decode. Previews are
+    keyed by (input sha256, source, filtergraph, window, type); a repeated
+    request is a file lookup. Until the proxy exists, previews render from
+    the original while the proxy builds in the background; those renders
+    are keyed to the original, so they aren't served once the proxy is up.
+    """
+
+    def __init__(self, root, digest, duration):
+        self.digest = digest
+        self.duration = duration
+        self.proxy_dir = os.path.join(root, 'proxies')
+        self.preview_dir = os.path.join(root, 'previews')
+        os.makedirs(self.proxy_dir, exist_ok=True)
+        os.makedirs(self.preview_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._building = {}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='proxy')
+
+    def _proxy_path(self, sha256):
+        return os.path.join(self.proxy_dir, f"{sha256}.mp4")
+
+    def proxy(self, input_path, sha256=None):
+        """The proxy for ``input_path`` if it is ready; otherwise starts building it."""
+        sha256 = sha256 or self.digest(input_path)
+        path = self._proxy_path(sha256)
+        if os.path.exists(path):
+            os.utime(path)  # storage sweeps proxies unused for the input TTL
+            return path
+        self.build_async(input_path, sha256)
+        return None
+
+    def build_async(self, input_path, sha256=None):
+        if not (mimetypes.guess_type(input_path)[0] or '').startswith('video/'):
+            return None
+        sha256 = sha256 or self.digest(input_path)
+        with self._lock:
+            if sha256 in self._building or os.path.exists(self._proxy_path(sha256)):
+                return self._building.get(sha256)
+            future = self._building[sha256] = self._pool.submit(self._build, input_path, sha256)
+        return future
+
+    def _build(self, input_path, sha256):
+        path = self._proxy_path(sha256)
+        tmp_path = f"{path}.{threading.get_ident()}.part.mp4"
+        cmd = [
+            "ffmpeg", "-y", "-i", input_path,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-vf", f"scale=-2:{PROXY_HEIGHT}",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "26", "-g", "1", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart",
+            tmp_path,
+        ]
+        try:
+            returncode, output = run_ffmpeg(cmd, timeout=3600, duration=self.duration(input_path))
+            if returncode == 0:
+                os.replace(tmp_path, path)
+                print(f"[PREVIEW] proxy ready for {os.path.basename(input_path)}", file=sys.stderr)
+            else:
+                print(f"[PREVIEW] proxy failed for {os.path.basename(input_path)}:\n{output}", file=sys.stderr)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._building.pop(sha256, None)
+
+    def _resolve(self, input_path, filter_flag, filtergraph, start, length, preview_type, use_proxy):
+        """``(source, key)``: the file to render from, and a cache key that
+        names it, so proxy and full-resolution renders never stand in for
+        each other."""
+        sha256 = self.digest(input_path)
+        source = input_path
+        if use_proxy and not (filtergraph and _GEOMETRY_FILTERS.search(filtergraph)):
+            source = self.proxy(input_path, sha256) or input_path
+        origin = f'proxy{PROXY_HEIGHT}' if source != input_path else 'original'
+        key = hashlib.sha256(json.dumps(
+            [PREVIEW_VERSION, sha256, origin, filter_flag, filtergraph, start, length, preview_type]).encode('utf-8')
+        ).hexdigest()
+        return source, key
+
+    def cached(self, name):
+        """Path of a finished preview, touched for LRU order; None if absent."""
+        path = os.path.join(self.preview_dir, name)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # LRU order is by mtime
+        return path
+
+    def render(self, input_path, filter_flag, filtergraph, start, length, preview_type, use_proxy=True):
+        """Render (or reuse) a preview; returns ``(name, output, cached)``."""
+        ext = '.jpg' if preview_type == 'image' else '.mp4'
+        source, key = self._resolve(input_path, filter_flag, filtergraph, start, length, preview_type, use_proxy)
+        name = key + ext
+        if self.cached(name):
+            return name, '', True
+
+        path = os.path.join(self.preview_dir, name)
+        tmp_path = f"{path}.{threading.get_ident()}.part{ext}"
+        if preview_type == 'image':
+            output_args = ["-frames:v", "1", "-q:v", "3", tmp_path]
+        else:
+            output_args = ["-t", f"{length:.3f}"] + _VIDEO_ARGS + ["-movflags", "+faststart", tmp_path]
+        try:
+            returncode, output = run_ffmpeg(_preview_args(source, filter_flag, filtergraph, start, output_args),
+                                            timeout=60)
+            if returncode != 0 or not os.path.exists(tmp_path):
+                return None, output, False
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict()
+        return name, output, False
+
+    def stream(self, input_path, filter_flag, filtergraph, start, length, preview_type, use_proxy=True):
+        """Stream a preview from ffmpeg's stdout as it encodes.
+
+        Returns ``(name, None, mimetype)`` when the preview is already cached,
+        else ``(None, chunks, mimetype)``. ``video`` previews are fragmented
+        MP4 (playable while downloading) and are also written through to the
+        cache once ffmpeg finishes; ``mjpeg`` is a multipart JPEG stream for
+        <img> tags; ``image`` is a single JPEG.
+        """
+        source, key = self._resolve(input_path, filter_flag, filtergraph, start, length, preview_type, use_proxy)
+        name = key + '.mp4'
+        if preview_type == 'video' and self.cached(name):
+            return name, None, 'video/mp4'
+        if preview_type == 'image':
+            mimetype = 'image/jpeg'
+            output_args = ["-frames:v", "1", "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", "3", "pipe:1"]
+        elif preview_type == 'mjpeg':
+            mimetype = 'multipart/x-mixed-replace;boundary=ffmpeg'
+            output_args = ["-t", f"{length:.3f}", "-an", "-f", "mpjpeg", "-q:v", "5", "pipe:1"]
+        else:
+            mimetype = 'video/mp4'
+            # Small fragments, so the player gets its first frames right away.
+            output_args = ["-t", f"{length:.3f}"] + _VIDEO_ARGS + [
+                "-tune", "zerolatency", "-f", "mp4",
+                "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "200000",
+                "pipe:1"]
+        result = {}
+
+        def finished(returncode, output):
+            result['returncode'] = returncode
+            if returncode != 0:
+                print(f"[PREVIEW] stream failed ({returncode}):\n{output}", file=sys.stderr)
+
+        chunks = stream_ffmpeg(_preview_args(source, filter_flag, filtergraph, start, output_args), on_exit=finished)
+        if preview_type == 'video':
+            chunks = self._write_through(chunks, name, result)
+        return None, chunks, mimetype
+
+    def _write_through(self, chunks, name, result):
+        """Pass ``chunks`` on while saving them; keep the file only if complete."""
+        path = os.path.join(self.preview_dir, name)
+        tmp_path = f"{path}.{threading.get_ident()}.part.mp4"
+        complete = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            chunks.close()
+            if complete and result.get('returncode') == 0:
+                os.replace(tmp_path, path)
+                self._evict()
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def path(self, name):
+        return os.path.join(self.preview_dir, name)
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.preview_dir):
+            if entry.is_file() and '.part' not in entry.name:
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= PREVIEW_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def _preview_args(source, filter_flag, filtergraph, start, output_args):
+    # Input seeking: on the all-intra proxy this decodes exactly one frame.
+    cmd = ["ffmpeg", "-y", "-ss", f"{start:.3f}", "-i", source]
+    if filtergraph:
+        cmd += [filter_flag, filtergraph]
+    return cmd + output_args
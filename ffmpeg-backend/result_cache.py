@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+from filehash import file_digest
+
+# Upper bound on the bytes kept in the result store before LRU eviction.
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+
+# Flags that don't change the encoded output.
+_IGNORED_FLAGS = {'-y', '-n', '-nostats', '-hide_banner', '-stats'}
+_IGNORED_WITH_VALUE = {'-progress', '-loglevel', '-v', '-stats_period'}
+# Outputs that aren't a single deterministic file.
+_UNCACHEABLE_FORMATS = {'hls', 'dash', 'segment', 'stream_segment', 'tee', 'null', 'rtmp', 'flv_live'}
+# Options without a value; anything else that starts with '-' takes the next arg.
+_BOOLEAN_FLAGS = _IGNORED_FLAGS | {
+    '-an', '-vn', '-sn', '-dn', '-shortest', '-nostdin', '-re', '-copyts', '-start_at_zero',
+    '-accurate_seek', '-noaccurate_seek', '-autorotate', '-noautorotate', '-ignore_unknown',
+    '-copy_unknown', '-benchmark', '-vstats', '-debug_ts', '-dump', '-hex', '-xerror',
+}
+_FILTER_OPTS = {'-vf', '-af', '-filter_complex', '-lavfi'}
+# Filters and options that read other files, whose contents the key can't see.
+_FILE_FILTER_RE = re.compile(r'(?:^|[,;\]\s])\s*(?:subtitles|ass|movie|amovie|lut1d|lut3d|haldclutsrc|sendcmd|'
+                             r'asendcmd)\b|\b(?:filename|file|textfile|fontfile)\s*=')
+
+
+def _is_local_file(path, cwd):
+    return '://' not in path and not path.startswith(('pipe:', '-')) and os.path.isfile(os.path.join(cwd, path))
+
+
+def cache_key(args, cwd, digest=file_digest):
+    """Key for an ffmpeg argv, or None if the command isn't safely cacheable.
+
+    Inputs are replaced by the sha256 of their contents and the output by its
+    extension, so the same encode of the same bytes hits regardless of names.
+    Commands with several outputs, or filtergraphs that read files, aren't
+    cacheable; nor is any input ``digest`` returns None for.
+    """
+    if not args or os.path.basename(args[0]) != 'ffmpeg' or len(args) < 4:
+        return None
+    output = args[-1]
+    if '://' in output or output.startswith('pipe:') or output == '-' or '%' in output:
+        return None
+
+    normalized = []
+    i = 1
+    while i < len(args) - 1:
+        arg = args[i]
+        if arg in _IGNORED_FLAGS:
+            i += 1
+            continue
+        if arg in _IGNORED_WITH_VALUE:
+            i += 2
+            continue
+        if arg == '-f' and i + 1 < len(args) and args[i + 1] in _UNCACHEABLE_FORMATS:
+            return None
+        if arg == '-i':
+            if i + 1 >= len(args) - 1 or not _is_local_file(args[i + 1], cwd):
+                return None
+            sha256 = digest(os.path.join(cwd, args[i + 1]))
+            if not sha256:
+                return None
+            normalized += ['-i', 'sha256:' + sha256]
+            i += 2
+            continue
+        if not arg.startswith('-'):
+            # A second output; a hit would only restore the last one.
+            return None
+        if arg.endswith('_script'):
+            return None
+        if (arg in _FILTER_OPTS or arg.startswith('-filter:')) and _FILE_FILTER_RE.search(args[i + 1]):
+            return None
+        if arg in _BOOLEAN_FLAGS:
+            normalized.append(arg)
+            i += 1
+            continue
+        normalized += [arg, args[i + 1]]
+        i += 2
+    if '-i' not in normalized:
+        return None
+    normalized.append('output' + os.path.splitext(output)[1].lower())
+    return hashlib.sha256(json.dumps(normalized).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """On-disk store of ffmpeg outputs keyed by cache_key(), with an LRU index.
+
+    Entries are hardlinked in and out of the store where possible. Each
+    entry records the blob's size and mtime, and a blob that no longer matches
+    (e.g. its linked output was overwritten in place) is dropped as a miss.
+    """
+
+    def __init__(self, root, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, blob TEXT, size INTEGER, mtime_ns INTEGER,"
+            " created REAL, last_used REAL, hits INTEGER DEFAULT 0)"
+        )
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def lookup(self, key, output_path):
+        """Materialize the cached output for ``key`` at ``output_path``; True on hit."""
+        with self._lock:
+            row = self._db.execute("SELECT blob, size, mtime_ns FROM entries WHERE key = ?", (key,)).fetchone()
+            blob_path = os.path.join(self.root, row[0]) if row else None
+            if row and not _blob_matches(blob_path, row[1], row[2]):
+                self._remove(key, blob_path)
+                row = None
+            if not row:
+                self.misses += 1
+                return False
+            _place(blob_path, output_path)
+            self._db.execute(
+                "UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return True
+
+    def store(self, key, output_path):
+        if not os.path.isfile(output_path):
+            return
+        blob = key + os.path.splitext(output_path)[1].lower()
+        blob_path = os.path.join(self.root, blob)
+        with self._lock:
+            _place(output_path, blob_path)
+            st = os.stat(blob_path)
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, blob, size, mtime_ns, created, last_used, hits)"
+                " VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, blob, st.st_size, st.st_mtime_ns, now, now))
+            self._db.commit()
+            self.stores += 1
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, blob, size in self._db.execute(
+                "SELECT key, blob, size FROM entries ORDER BY last_used ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._remove(key, os.path.join(self.root, blob))
+            total -= size
+            self.evictions += 1
+            print(f"[CACHE] evicted {blob} ({size} bytes)", file=sys.stderr)
+
+    def _remove(self, key, blob_path):
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._db.commit()
+        if blob_path and os.path.exists(blob_path):
+            os.remove(blob_path)
+
+
+def detach(path):
+    """Unlink ``path`` if it shares an inode with a cache blob.
+
+    ffmpeg truncates existing outputs in place, which would rewrite the blob
+    through the hardlink; removing the name first leaves the blob intact.
+    """
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _blob_matches(path, size, mtime_ns):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == size and st.st_mtime_ns == mtime_ns
+
+
+def _place(src, dst):
+    """Hardlink src to dst (replacing dst), falling back to a copy across devices."""
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from ffmpeg_progress import run_ffmpeg
+
+# Scene scores are measured on a decode reduced to this height and frame rate.
+SCENE_ANALYSIS_HEIGHT = int(os.environ.get('SCENE_ANALYSIS_HEIGHT', 180))
+SCENE_ANALYSIS_FPS = float(os.environ.get('SCENE_ANALYSIS_FPS', 10))
+# Bump when the analysis filtergraph changes, so old score curves aren't reused.
+SCENE_VERSION = 1
+
+_PTS_RE = re.compile(r'\bpts_time:(-?[\d.]+)')
+_SCORE_RE = re.compile(r'lavfi\.scene_score=([\d.]+)')
+
+
+class SceneError(Exception):
+    def __init__(self, message, status=500, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+class SceneScoreParser:
+    """Collects ``(time, score)`` pairs from ``metadata=print`` log lines."""
+
+    def __init__(self, start=0.0):
+        self.start = start
+        self.times = []
+        self.scores = []
+        self._pts = None
+
+    def feed(self, line):
+        match = _PTS_RE.search(line)
+        if match:
+            self._pts = float(match.group(1))
+            return
+        match = _SCORE_RE.search(line)
+        if match and self._pts is not None:
+            t = round(max(self._pts - self.start, 0.0), 3)
+            score = round(float(match.group(1)), 4)
+            self.times.append(t)
+            self.scores.append(score)
+            self._pts = None
+
+
+def analysis_args(input_path, fps=SCENE_ANALYSIS_FPS, height=SCENE_ANALYSIS_HEIGHT):
+    # select passes every frame; it only runs so scene_score gets computed.
+    vf = (f"fps={fps:g},scale=-2:{height}:flags=fast_bilinear,"
+          "select=gte(scene\\,0),metadata=print:key=lavfi.scene_score")
+    return ["ffmpeg", "-hide_banner", "-nostdin", "-i", input_path, "-map", "0:v:0", "-an", "-sn",
+            "-vf", vf, "-f", "null", "-"]
+
+
+def detect_scenes(curve, threshold, min_gap=0.0, duration=None):
+    """Cuts where the score exceeds ``threshold``, at least ``min_gap`` apart.
+
+    The first scene always starts at 0; each scene runs to the next cut (or
+    ``duration``).
+    """
+    cuts = []
+    last = 0.0
+    for t, score in zip(curve['times'], curve['scores']):
+        if score > threshold and t > 0 and t - last >= min_gap:
+            cuts.append((t, score))
+            last = t
+    starts = [(0.0, None)] + cuts
+    end = duration or curve.get('duration') or (curve['times'][-1] if curve['times'] else 0.0)
+    scenes = []
+    for i, (t, score) in enumerate(starts):
+        next_t = starts[i + 1][0] if i + 1 < len(starts) else end
+        scenes.append({
+            'index': i,
+            'start': t,
+            'end': next_t,
+            'duration': round(max(next_t - t, 0.0), 3),
+            'score': score,
+        })
+    return scenes
+
+
+class SceneIndex:
+    """Per-file scene score curves, stored as JSON under ``root``.
+
+    The curve holds the score of every analysed frame, independent of any
+    threshold, so a new sensitivity is a pass over a list instead of a
+    second decode. Curves are keyed by input sha256 and analysis settings.
+    ``cached_digest`` returns a known hash without reading the file (or
+    None), for lookups that must not hash in a request thread.
+    """
+
+    def __init__(self, root, digest, cached_digest=None):
+        self.root = root
+        self.digest = digest
+        self.cached_digest = cached_digest
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def key(self, input_path, fps=SCENE_ANALYSIS_FPS, height=SCENE_ANALYSIS_HEIGHT, sha256=None):
+        raw = json.dumps([SCENE_VERSION, sha256 or self.digest(input_path), fps, height])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def cached(self, input_path, fps=SCENE_ANALYSIS_FPS, height=SCENE_ANALYSIS_HEIGHT, cached_only=False):
+        """The stored curve, or None. With ``cached_only`` an input whose
+        hash isn't known yet is a miss instead of being hashed."""
+        sha256 = None
+        if cached_only:
+            sha256 = self.cached_digest(input_path) if self.cached_digest else None
+            if not sha256:
+                return None
+        path = self._path(self.key(input_path, fps, height, sha256))
+        try:
+            with open(path) as f:
+                curve = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return curve
+
+    def analyze(self, input_path, duration=None, start=0.0, job=None,
+                fps=SCENE_ANALYSIS_FPS, height=SCENE_ANALYSIS_HEIGHT):
+        """The score curve for ``input_path``, decoding only on a cache miss."""
+        key = self.key(input_path, fps, height)
+        # Concurrent requests for the same file share one decode.
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait()
+        try:
+            curve = self.cached(input_path, fps, height)
+            if curve is not None:
+                return curve
+            if not owner:
+                raise SceneError('Scene analysis failed.')
+            return self._analyze(input_path, key, duration, start, job, fps, height)
+        finally:
+            if owner:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def _analyze(self, input_path, key, duration, start, job, fps, height):
+        started = time.time()
+        parser = SceneScoreParser(start)
+        returncode, output = run_ffmpeg(analysis_args(input_path, fps, height), timeout=3600, job=job,
+                                        duration=duration, step='scenes', on_stderr=parser.feed)
+        if returncode != 0:
+            raise SceneError('Scene analysis failed.', output=output)
+        curve = {
+            'fps': fps,
+            'height': height,
+            'duration': duration,
+            'times': parser.times,
+            'scores': parser.scores,
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, 'w') as f:
+            json.dump(curve, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        print(f"[SCENES] scored {len(parser.times)} frames of {os.path.basename(input_path)} "
+              f"in {time.time() - started:.1f}s", file=sys.stderr)
+        return curve
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+
+# Run vidstabdetect on a decode scaled to this height (0 = full resolution).
+STABILIZE_DETECT_HEIGHT = int(os.environ.get('STABILIZE_DETECT_HEIGHT', 0))
+# Bump when the detect command or .trf rescaling changes, so old analyses aren't reused.
+TRF_VERSION = 1
+
+_DETECT_RE = re.compile(r'vidstabdetect=?([^"\'\s,;]*)')
+# Local motion entries in vidstab's ASCII format: (LM v.x v.y f.x f.y f.size contrast match)
+_LM_RE = re.compile(r'\(LM (-?\d+) (-?\d+) (-?\d+) (-?\d+) (-?\d+) ([^ )]+) ([^ )]+)\)')
+
+
+class StabilizeError(Exception):
+    def __init__(self, message, status=500, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+def detect_command(analyze_cmd, input_file, input_path, trf_name, detect_height=None):
+    """The analyze command with its input made absolute and its result set
+    to ``trf_name``; with ``detect_height``, vidstabdetect sees a scaled
+    decode. Returns ``(command, scaled)``.
+    """
+    if not _DETECT_RE.search(analyze_cmd):
+        raise StabilizeError('The analyze command has no vidstabdetect filter.', status=400)
+
+    # Only when vidstabdetect is the first filter do its frames have the
+    # input's dimensions, which the vectors are scaled back to.
+    scaled = bool(detect_height) and re.search(r'-vf\s+["\']?vidstabdetect', analyze_cmd) is not None
+
+    def patch(match):
+        params = [p for p in match.group(1).split(':') if p and not p.startswith('result=')]
+        if scaled:
+            # Only the ASCII format can be rescaled; some builds write binary by default.
+            params = [p for p in params if not p.startswith('fileformat=')] + ['fileformat=ascii']
+        return 'vidstabdetect=' + ':'.join(params + [f'result={trf_name}'])
+
+    cmd = _DETECT_RE.sub(patch, analyze_cmd, count=1)
+    cmd = cmd.replace(input_file, input_path)
+    if scaled:
+        cmd = cmd.replace('vidstabdetect=', f'scale=-2:{int(detect_height)}:flags=fast_bilinear,vidstabdetect=', 1)
+    return cmd, scaled
+
+
+def analysis_key(digest, analyze_cmd, input_file, detect_height):
+    """Cache key of a .trf: input content, detect settings and scale."""
+    normalized = _DETECT_RE.sub(
+        lambda m: 'vidstabdetect=' + ':'.join(sorted(p for p in m.group(1).split(':')
+                                                      if p and not p.startswith('result='))),
+        analyze_cmd)
+    normalized = ' '.join(normalized.replace(input_file, '{input}').split())
+    raw = json.dumps([TRF_VERSION, digest, normalized, detect_height or 0])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def rescale_trf(src, dst, fx, fy):
+    """Write ``src`` (vidstab ASCII format) to ``dst`` with motion vectors and
+    measurement fields scaled by ``fx``/``fy`` to the full-resolution frame."""
+    with open(src, 'rb') as f:
+        data = f.read()
+    if not data.startswith(b'VID.STAB'):
+        raise StabilizeError('vidstabdetect wrote a binary .trf; cannot rescale it.')
+
+    def scale(match):
+        vx, vy, cx, cy, size = (int(v) for v in match.groups()[:5])
+        return (f"(LM {round(vx * fx)} {round(vy * fy)} {round(cx * fx)} {round(cy * fy)} "
+                f"{round(size * max(fx, fy))} {match.group(6)} {match.group(7)})")
+
+    text = _LM_RE.sub(scale, data.decode('ascii'))
+    with open(dst, 'w') as f:
+        f.write(text)
+
+
+def link_or_copy(src, dst):
+    """Hardlink ``src`` to ``dst``; copy only across filesystems."""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        os.remove(dst)
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class TrfCache:
+    """vidstabdetect results keyed by :func:`analysis_key`, so re-running
+    stabilization with other vidstabtransform settings skips detection."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.trf")
+
+    def get(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        return None
+
+    def put(self, key, trf_path, scale=None):
+        """Store ``trf_path`` (rescaled by ``scale=(fx, fy)`` if given)."""
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        try:
+            if scale:
+                rescale_trf(trf_path, tmp_path, *scale)
+            else:
+                shutil.copyfile(trf_path, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
@@ -0,0 +1,308 @@
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Bytes of uploads and outputs kept before the least recently used are removed.
+STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES', 50 * 1024 ** 3))
+# The sweeper also evicts while the volume has less free space than this.
+STORAGE_MIN_FREE_BYTES = int(os.environ.get('STORAGE_MIN_FREE_BYTES', 2 * 1024 ** 3))
+# Unused uploads / job outputs older than these are removed regardless of quota.
+STORAGE_INPUT_TTL = int(os.environ.get('STORAGE_INPUT_TTL', 7 * 24 * 3600))
+STORAGE_OUTPUT_TTL = int(os.environ.get('STORAGE_OUTPUT_TTL', 2 * 24 * 3600))
+# Per-job scratch directories older than this are leftovers of crashed jobs.
+SCRATCH_TTL = int(os.environ.get('SCRATCH_TTL', 6 * 3600))
+STORAGE_SWEEP_INTERVAL = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 600))
+# Leases of processes that died without releasing them expire after this.
+LEASE_MAX_AGE = 24 * 3600
+# Serving a file refreshes its LRU position at most this often.
+TOUCH_INTERVAL = 60
+
+AREAS = ('input', 'output')
+
+
+class Storage:
+    """Managed uploads and job outputs in the upload folder.
+
+    Only files registered here (uploads, job outputs) are ever removed, so
+    the backend sources that share the folder are safe. Each file belongs
+    to an area with its own TTL; past that, or when the area totals exceed
+    the quota or the disk runs low, the least recently used unleased files
+    go first. Queued and running jobs hold leases on the files they name.
+    Scratch roots hold per-job directories that are removed once stale;
+    cache roots hold derived files (proxies, palettes) that expire with
+    the inputs they were made from.
+    """
+
+    def __init__(self, root, db_path, scratch_roots=(), cache_roots=(), quota=STORAGE_QUOTA_BYTES,
+                 min_free=STORAGE_MIN_FREE_BYTES, ttls=None, interval=STORAGE_SWEEP_INTERVAL):
+        self.root = root
+        self.scratch_roots = list(scratch_roots)
+        self.cache_roots = list(cache_roots)
+        self.quota = quota
+        self.min_free = min_free
+        self.ttls = ttls or {'input': STORAGE_INPUT_TTL, 'output': STORAGE_OUTPUT_TTL}
+        self.interval = interval
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, area TEXT, size INTEGER,"
+            " created_at REAL, last_used REAL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases (owner TEXT, name TEXT, pid INTEGER, acquired_at REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS leases_owner ON leases (owner)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._touched = {}
+        self._thread = None
+        self.last_sweep = None
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def register(self, name, area):
+        """Start managing ``name`` (relative to the root) as an ``area`` file.
+
+        A file already managed as an input stays one; using an upload in a
+        job never shortens its retention.
+        """
+        path = self._path(name)
+        if area not in AREAS or not os.path.exists(path):
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET"
+                " area = CASE WHEN files.area = 'input' THEN 'input' ELSE excluded.area END,"
+                " size = excluded.size, last_used = excluded.last_used",
+                (name, area, _size(path), now, now))
+            self._db.commit()
+        self._ensure_started()
+
+    def adopt(self, pattern, area, accept=None):
+        """Register unmanaged root entries whose names match ``pattern``
+        (artifacts left by older versions), aged by their mtime.
+
+        ``accept(name, names)``, given every root entry name, can narrow the
+        match further.
+        """
+        with self._lock:
+            known = {name for (name,) in self._db.execute("SELECT name FROM files")}
+        entries = list(os.scandir(self.root))
+        names = {entry.name for entry in entries}
+        rows = []
+        for entry in entries:
+            if entry.name not in known and pattern.match(entry.name) \
+                    and (accept is None or accept(entry.name, names)):
+                mtime = _newest_mtime(entry.path)
+                rows.append((entry.name, area, _size(entry.path), mtime, mtime))
+        if rows:
+            with self._lock:
+                self._db.executemany("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+                self._db.commit()
+            print(f"[STORAGE] adopted {len(rows)} existing {area} file(s)", file=sys.stderr)
+
+    def touch(self, name):
+        """Mark ``name`` as used now (throttled; called on every serve)."""
+        now = time.time()
+        if now - self._touched.get(name, 0) < TOUCH_INTERVAL:
+            return
+        self._touched[name] = now
+        with self._lock:
+            self._db.execute("UPDATE files SET last_used = ? WHERE name = ?", (now, name))
+            self._db.commit()
+
+    def acquire(self, names, owner=None):
+        """Protect ``names`` from eviction until ``release(owner)``."""
+        owner = owner or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT INTO leases VALUES (?, ?, ?, ?)",
+                                 [(owner, name, os.getpid(), now) for name in set(names)])
+            self._db.executemany("UPDATE files SET last_used = ? WHERE name = ?",
+                                 [(now, name) for name in set(names)])
+            self._db.commit()
+        self._ensure_started()
+        return owner
+
+    def release(self, owner):
+        with self._lock:
+            self._db.execute("DELETE FROM leases WHERE owner = ?", (owner,))
+            self._db.commit()
+
+    @contextmanager
+    def lease(self, names):
+        owner = self.acquire(names)
+        try:
+            yield owner
+        finally:
+            self.release(owner)
+
+    def _leased(self):
+        """Names under a live lease; leases of dead processes are dropped."""
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT pid FROM leases").fetchall()
+            dead = [pid for (pid,) in rows if not _alive(pid)]
+            self._db.executemany("DELETE FROM leases WHERE pid = ?", [(pid,) for pid in dead])
+            self._db.execute("DELETE FROM leases WHERE acquired_at < ?", (time.time() - LEASE_MAX_AGE,))
+            self._db.commit()
+            return {name for (name,) in self._db.execute("SELECT DISTINCT name FROM leases")}
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def sweep_if_low(self):
+        """Sweep right away when the disk is below the free-space floor."""
+        if self.free_bytes() < self.min_free:
+            return self.sweep()
+        return None
+
+    def sweep(self):
+        """One collection pass; returns what was removed."""
+        if not self._sweep_lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def _sweep(self):
+        now = time.time()
+        leased = self._leased()
+        with self._lock:
+            rows = self._db.execute("SELECT name, area, size, last_used FROM files ORDER BY last_used").fetchall()
+        gone = [name for name, _, _, _ in rows if not os.path.exists(self._path(name))]
+        rows = [row for row in rows if row[0] not in gone]
+        removed = []
+        total = sum(size for _, _, size, _ in rows)
+        free = self.free_bytes()
+        for name, area, size, last_used in rows:
+            if name in leased:
+                continue
+            expired = last_used < now - self.ttls.get(area, STORAGE_OUTPUT_TTL)
+            if not (expired or total > self.quota or free < self.min_free):
+                continue
+            if _remove(self._path(name)):
+                removed.append(name)
+                total -= size
+                free += size
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE name = ?", [(name,) for name in gone + removed])
+            self._db.commit()
+
+        freed = sum(size for name, _, size, _ in rows if name in removed)
+        scratch = self._sweep_dirs(self.scratch_roots, now - SCRATCH_TTL)
+        caches = self._sweep_dirs(self.cache_roots, now - self.ttls.get('input', STORAGE_INPUT_TTL))
+        self.last_sweep = {'at': now, 'removed': removed, 'freed_bytes': freed,
+                           'scratch_removed': scratch, 'cache_removed': caches}
+        if removed or scratch or caches:
+            print(f"[STORAGE] removed {len(removed)} file(s) ({freed} bytes), {scratch} scratch "
+                  f"dir(s), {caches} cache file(s)", file=sys.stderr)
+        return self.last_sweep
+
+    def _sweep_dirs(self, roots, cutoff):
+        # A scratch directory counts as stale only when nothing inside it has
+        # changed for the whole TTL, so a long-running job keeps its own.
+        count = 0
+        for root in roots:
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                if '.part' in entry.name or _newest_mtime(entry.path) >= cutoff:
+                    continue
+                if _remove(entry.path):
+                    count += 1
+        return count
+
+    def _ensure_started(self):
+        # Started on first use so forking servers don't inherit the thread.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[STORAGE] sweep failed: {e}", file=sys.stderr)
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            areas = {area: {'files': count, 'bytes': size} for area, count, size in self._db.execute(
+                "SELECT area, COUNT(*), COALESCE(SUM(size), 0) FROM files GROUP BY area")}
+            leases = self._db.execute("SELECT COUNT(DISTINCT name) FROM leases").fetchone()[0]
+        return {
+            'areas': areas,
+            'quota_bytes': self.quota,
+            'min_free_bytes': self.min_free,
+            'free_bytes': self.free_bytes(),
+            'ttl_seconds': self.ttls,
+            'leased_files': leases,
+            'last_sweep': self.last_sweep,
+        }
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _newest_mtime(path):
+    try:
+        newest = os.lstat(path).st_mtime
+    except OSError:
+        return time.time()
+    if os.path.isdir(path) and not os.path.islink(path):
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    newest = max(newest, os.lstat(os.path.join(dirpath, filename)).st_mtime)
+                except OSError:
+                    pass
+    return newest
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        print(f"[STORAGE] could not remove {path}: {e}", file=sys.stderr)
+        return False
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
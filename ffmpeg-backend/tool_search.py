@@ -0,0 +1,97 @@
+import math
+import os
+import re
+from collections import Counter
+
+# How many tools the agent prompt lists for a request.
+TOOL_TOP_K = int(os.environ.get('TOOL_TOP_K', 5))
+# Below this best BM25 score the match is a guess; the prompt lists every tool.
+TOOL_MIN_SCORE = float(os.environ.get('TOOL_MIN_SCORE', 1.5))
+
+_WORD_RE = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])')
+# Filenames and URLs in a prompt say nothing about the operation.
+_FILENAME_RE = re.compile(r'\S+\.[A-Za-z0-9]{2,4}\b|\w+://\S+')
+# Words every description shares, and filler from prompts.
+_STOPWORDS = frozenset('''
+    a an and the to of for in on or with from by at as is be it this that into using use e g etc
+    generate command commands ffmpeg file files input filename name please me my can you i want
+'''.split())
+
+
+def _stem(word):
+    # Just enough to match "trimming"/"trim", "resized"/"resize", "files"/"file".
+    for suffix in ('ing', 'ed'):
+        if word.endswith(suffix) and len(word) > len(suffix) + 2:
+            word = word[:-len(suffix)]
+            if len(word) > 2 and word[-1] == word[-2] and word[-1] not in 'ls':
+                word = word[:-1]
+            break
+    else:
+        if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+            word = word[:-1]
+    if word.endswith('e') and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Lowercased, stemmed words of ``text``; camelCase names are split and
+    numbers dropped."""
+    return [_stem(w.lower()) for w in _WORD_RE.findall(text or '')
+            if len(w) > 1 and w.lower() not in _STOPWORDS]
+
+
+def _compounds(name):
+    # "FrameRate" should also match a prompt saying "framerate".
+    words = _WORD_RE.findall(name)
+    return ' '.join((a + b).lower() for a, b in zip(words, words[1:]))
+
+
+def tool_text(tool):
+    """Searchable text of a tool: name (twice, as it is the strongest signal),
+    description and parameter names and enum values."""
+    name = tool.get('name', '')
+    parts = [name, name, _compounds(name), tool.get('description', '')]
+    params = tool.get('parameters')
+    if isinstance(params, dict):
+        params = [dict(spec, name=name) for name, spec in params.get('properties', {}).items()]
+    for param in params or []:
+        if isinstance(param, dict):
+            parts.append(param.get('name', ''))
+            parts.extend(str(v) for v in param.get('enum', []))
+        else:
+            parts.append(str(param))
+    return ' '.join(parts)
+
+
+class ToolIndex:
+    """BM25 over tool descriptions, to pick the tools relevant to a prompt."""
+
+    def __init__(self, tool_meta, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {name: Counter(tokenize(tool_text(tool))) for name, tool in tool_meta.items()}
+        lengths = {name: sum(tf.values()) for name, tf in self.docs.items()}
+        self.avg_length = sum(lengths.values()) / max(len(lengths), 1)
+        self.lengths = lengths
+        df = Counter(term for tf in self.docs.values() for term in tf)
+        n = len(self.docs)
+        self.idf = {term: math.log((n - count + 0.5) / (count + 0.5) + 1) for term, count in df.items()}
+
+    def scores(self, query):
+        terms = [t for t in set(tokenize(_FILENAME_RE.sub(' ', query))) if t in self.idf]
+        result = {}
+        for name, tf in self.docs.items():
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[name] / self.avg_length)
+            score = sum(self.idf[t] * tf[t] * (self.k1 + 1) / (tf[t] + norm) for t in terms if t in tf)
+            if score > 0:
+                result[name] = score
+        return result
+
+    def select(self, query, k=TOOL_TOP_K, min_score=TOOL_MIN_SCORE):
+        """Names of the ``k`` best tools for ``query``, or None when the best
+        match scores below ``min_score`` (the caller should offer them all)."""
+        ranked = sorted(self.scores(query).items(), key=lambda item: -item[1])
+        if not ranked or ranked[0][1] < min_score:
+            return None
+        return [name for name, _ in ranked[:k]]
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 1024 * 1024
+# Abandoned partial uploads are discarded after this many seconds.
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def copy_stream(stream, dst, hasher=None, limit=None):
+    """Copy ``stream`` into the open file ``dst`` in CHUNK_SIZE pieces.
+
+    Returns the number of bytes written. Memory use is one chunk regardless
+    of the body size.
+    """
+    written = 0
+    while limit is None or written < limit:
+        size = CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit - written)
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        dst.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+        written += len(chunk)
+    return written
+
+
+def save_stream(stream, path):
+    """Write ``stream`` to ``path`` via a temp file; returns the sha256."""
+    hasher = hashlib.sha256()
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        with open(tmp_path, 'wb') as f:
+            copy_stream(stream, f, hasher)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return hasher.hexdigest()
+
+
+class ChunkedUploads:
+    """Resumable uploads written with offset-addressed PUTs.
+
+    Each session is a ``<id>.part`` file plus a ``<id>.json`` sidecar under
+    ``root``. The running sha256 is kept in memory together with the offset
+    it covers; if that doesn't match the bytes on disk (a restart, or another
+    worker process took the previous chunk) it is rebuilt from the file.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hashers = {}
+        self._busy = set()
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def create(self, filename, size, sha256=None):
+        self._expire()
+        upload_id = uuid.uuid4().hex
+        meta = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': int(size),
+            'sha256': sha256.lower() if sha256 else None,
+            'created': time.time(),
+        }
+        open(self._part_path(upload_id), 'wb').close()
+        with open(self._meta_path(upload_id), 'w') as f:
+            json.dump(meta, f)
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        meta = self._load(upload_id)
+        meta['offset'] = os.path.getsize(self._part_path(upload_id))
+        return meta
+
+    def write(self, upload_id, offset, stream, length=None):
+        """Append the request body at ``offset``; returns the updated status.
+
+        ``offset`` must equal the bytes already received, otherwise an
+        UploadError with status 409 carries the offset to resume from.
+        """
+        with self._lock:
+            if upload_id in self._busy:
+                raise UploadError('Upload is already receiving data.', status=409)
+            self._busy.add(upload_id)
+        try:
+            meta = self.status(upload_id)
+            if offset != meta['offset']:
+                raise UploadError('Offset does not match received bytes.', status=409, offset=meta['offset'])
+            remaining = meta['size'] - offset
+            if length is not None and length > remaining:
+                raise UploadError('Chunk runs past the declared upload size.', status=413, offset=offset)
+
+            hasher = self._hasher(upload_id, offset)
+            self._hashers.pop(upload_id, None)
+            with open(self._part_path(upload_id), 'r+b') as f:
+                f.seek(offset)
+                written = copy_stream(stream, f, hasher, limit=remaining)
+            self._hashers[upload_id] = (offset + written, hasher)
+            return self.status(upload_id)
+        finally:
+            with self._lock:
+                self._busy.discard(upload_id)
+
+    def finish(self, upload_id, dest_path):
+        """Move a complete upload to ``dest_path``; returns its sha256."""
+        meta = self.status(upload_id)
+        if meta['offset'] != meta['size']:
+            raise UploadError('Upload is incomplete.', status=409, offset=meta['offset'])
+        digest = self._hasher(upload_id, meta['offset']).hexdigest()
+        if meta['sha256'] and meta['sha256'] != digest:
+            self.discard(upload_id)
+            raise UploadError('Checksum mismatch; upload discarded.', status=422)
+        shutil.move(self._part_path(upload_id), dest_path)
+        self.discard(upload_id)
+        return digest
+
+    def discard(self, upload_id):
+        self._hashers.pop(upload_id, None)
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError('Unknown upload.', status=404)
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Unknown upload.', status=404)
+
+    def _hasher(self, upload_id, offset):
+        covered, hasher = self._hashers.get(upload_id, (None, None))
+        if covered == offset:
+            return hasher
+        hasher = hashlib.sha256()
+        with open(self._part_path(upload_id), 'rb') as f:
+            copy_stream(f, _NullWriter(), hasher, limit=offset)
+        return hasher
+
+    def _expire(self):
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                upload_id = name[:-5]
+                try:
+                    if self._load(upload_id)['created'] < cutoff:
+                        self.discard(upload_id)
+                except (UploadError, ValueError, KeyError):
+                    continue
+
+
+class _NullWriter:
+    def write(self, data):
+        pass
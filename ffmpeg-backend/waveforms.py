@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from ffmpeg_progress import stream_ffmpeg
+
+# Audio is decoded to mono s16le at this rate for peak analysis.
+WAVEFORM_SAMPLE_RATE = int(os.environ.get('WAVEFORM_SAMPLE_RATE', 8000))
+# Samples per peak at the finest level; each further level merges 2 peaks.
+WAVEFORM_BASE_BUCKET = int(os.environ.get('WAVEFORM_BASE_BUCKET', 64))
+# Levels stop once a level has no more than this many peaks.
+WAVEFORM_MIN_PEAKS = 256
+WAVEFORM_MAX_WIDTH = 20000
+# Bump when the decode or peak layout changes, so old pyramids aren't reused.
+WAVEFORM_VERSION = 1
+
+_MAGIC = b'FFPEAKS1'
+# magic, sample rate, samples per base peak, merge factor, level count
+_HEADER = struct.Struct('<8sIIII')
+_FACTOR = 2
+
+
+class WaveformError(Exception):
+    def __init__(self, message, status=500, output=''):
+        super().__init__(message)
+        self.status = status
+        self.output = output
+
+
+def decode_args(input_path, sample_rate=WAVEFORM_SAMPLE_RATE):
+    return ["ffmpeg", "-hide_banner", "-nostdin", "-v", "error", "-i", input_path,
+            "-map", "0:a:0", "-vn", "-sn", "-ac", "1", "-ar", str(sample_rate),
+            "-f", "s16le", "-acodec", "pcm_s16le", "-"]
+
+
+def _bucket_peaks(samples, bucket):
+    """``(n, 3)`` float32 min/max/mean-square of each ``bucket`` samples.
+
+    A short final bucket is measured on its own samples.
+    """
+    full = len(samples) // bucket * bucket
+    parts = []
+    if full:
+        frames = samples[:full].reshape(-1, bucket).astype(np.float32)
+        parts.append(np.stack([frames.min(axis=1), frames.max(axis=1),
+                               np.einsum('ij,ij->i', frames, frames) / bucket], axis=1))
+    if full < len(samples):
+        tail = samples[full:].astype(np.float32)
+        parts.append(np.array([[tail.min(), tail.max(), np.dot(tail, tail) / len(tail)]], dtype=np.float32))
+    return np.concatenate(parts) if parts else np.zeros((0, 3), dtype=np.float32)
+
+
+def _merge(level):
+    # Pairs of peaks become one; an odd last peak is paired with itself.
+    if len(level) % _FACTOR:
+        level = np.concatenate([level, level[-1:]])
+    pairs = level.reshape(-1, _FACTOR, 3)
+    return np.stack([pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1),
+                     pairs[:, :, 2].mean(axis=1)], axis=1)
+
+
+def _quantize(level):
+    # Stored as int16 min/max/rms, the same scale as the decoded samples.
+    out = np.empty(level.shape, dtype='<i2')
+    out[:, 0] = level[:, 0]
+    out[:, 1] = level[:, 1]
+    out[:, 2] = np.minimum(np.sqrt(level[:, 2]), 32767)
+    return out
+
+
+def build_pyramid(chunks, bucket=WAVEFORM_BASE_BUCKET):
+    """Peak levels, finest first, from an iterable of s16le byte chunks.
+
+    Chunks are reduced as they arrive, so only the peaks (not the decoded
+    audio) are held in memory.
+    """
+    pending = b''
+    step = bucket * 2
+    base = []
+    for chunk in chunks:
+        pending += chunk
+        usable = len(pending) // step * step
+        if usable:
+            base.append(_bucket_peaks(np.frombuffer(pending[:usable], dtype='<i2'), bucket))
+            pending = pending[usable:]
+    if len(pending) >= 2:
+        base.append(_bucket_peaks(np.frombuffer(pending[:len(pending) // 2 * 2], dtype='<i2'), bucket))
+    level = np.concatenate(base) if base else np.zeros((0, 3), dtype=np.float32)
+    levels = [level]
+    while len(level) > WAVEFORM_MIN_PEAKS:
+        level = _merge(level)
+        levels.append(level)
+    return [_quantize(level) for level in levels]
+
+
+def write_pyramid(path, levels, sample_rate, bucket):
+    tmp_path = f"{path}.{threading.get_ident()}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, sample_rate, bucket, _FACTOR, len(levels)))
+        f.write(struct.pack(f'<{len(levels)}Q', *(len(level) for level in levels)))
+        for level in levels:
+            f.write(level.tobytes())
+    os.replace(tmp_path, path)
+
+
+class PeakPyramid:
+    """A stored peak mipmap; levels are memory-mapped, so a window is a slice."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, self.sample_rate, self.bucket, self.factor, count = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise WaveformError(f'{path} is not a peak file.')
+            counts = struct.unpack(f'<{count}Q', f.read(8 * count))
+        offset = _HEADER.size + 8 * count
+        self.levels = []
+        for n in counts:
+            self.levels.append(np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(n, 3))
+                               if n else np.zeros((0, 3), dtype='<i2'))
+            offset += n * 6
+
+    @property
+    def duration(self):
+        return len(self.levels[0]) * self.bucket / self.sample_rate
+
+    def samples_per_peak(self, level):
+        return self.bucket * self.factor ** level
+
+    def pick_level(self, start, end, width):
+        """The coarsest level that still has a peak for every pixel."""
+        span = max(end - start, 0.0) * self.sample_rate
+        for level in range(len(self.levels) - 1, 0, -1):
+            if span / self.samples_per_peak(level) >= width:
+                return level
+        return 0
+
+    def window(self, start, end, level):
+        per_peak = self.samples_per_peak(level) / self.sample_rate
+        data = self.levels[level]
+        first = max(int(start / per_peak), 0)
+        last = min(int(np.ceil(end / per_peak)), len(data))
+        peaks = np.asarray(data[first:max(first, last)])
+        return {
+            'level': level,
+            'levels': len(self.levels),
+            'sample_rate': self.sample_rate,
+            'samples_per_peak': self.samples_per_peak(level),
+            'seconds_per_peak': per_peak,
+            'start': round(first * per_peak, 6),
+            'end': round(max(first, last) * per_peak, 6),
+            'duration': round(self.duration, 6),
+            'scale': 32768,
+            'min': peaks[:, 0].tolist(),
+            'max': peaks[:, 1].tolist(),
+            'rms': peaks[:, 2].tolist(),
+        }
+
+
+class WaveformIndex:
+    """Peak pyramids per input, stored under ``root`` and keyed by input
+    sha256 and decode settings. Built from one PCM decode over a pipe.
+    ``cached_digest`` returns a known hash without reading the file (or
+    None), for lookups that must not hash in a request thread."""
+
+    def __init__(self, root, digest, cached_digest=None, sample_rate=WAVEFORM_SAMPLE_RATE,
+                 bucket=WAVEFORM_BASE_BUCKET):
+        self.root = root
+        self.digest = digest
+        self.cached_digest = cached_digest
+        self.sample_rate = sample_rate
+        self.bucket = bucket
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def key(self, input_path, sha256=None):
+        raw = json.dumps([WAVEFORM_VERSION, sha256 or self.digest(input_path), self.sample_rate, self.bucket])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.peaks")
+
+    def cached(self, input_path, cached_only=False):
+        """The stored pyramid, or None. With ``cached_only`` an input whose
+        hash isn't known yet is a miss instead of being hashed."""
+        sha256 = None
+        if cached_only:
+            sha256 = self.cached_digest(input_path) if self.cached_digest else None
+            if not sha256:
+                return None
+        path = self._path(self.key(input_path, sha256))
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return PeakPyramid(path)
+
+    def get(self, input_path, timeout=600):
+        """The pyramid for ``input_path``, decoding only on a cache miss."""
+        key = self.key(input_path)
+        # Concurrent requests for the same file share one decode.
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait()
+        try:
+            pyramid = self.cached(input_path)
+            if pyramid is not None:
+                return pyramid
+            if not owner:
+                raise WaveformError('Waveform analysis failed.')
+            return self._build(input_path, key, timeout)
+        finally:
+            if owner:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                event.set()
+
+    def _build(self, input_path, key, timeout):
+        started = time.time()
+        result = {}
+        chunks = stream_ffmpeg(decode_args(input_path, self.sample_rate), timeout=timeout,
+                               chunk_size=1024 * 1024,
+                               on_exit=lambda code, output: result.update(code=code, output=output))
+        levels = build_pyramid(chunks, self.bucket)
+        if result.get('code') != 0:
+            raise WaveformError('Audio decode failed.', output=result.get('output', ''))
+        path = self._path(key)
+        write_pyramid(path, levels, self.sample_rate, self.bucket)
+        print(f"[WAVEFORM] {len(levels[0])} peaks in {len(levels)} levels for "
+              f"{os.path.basename(input_path)} in {time.time() - started:.1f}s", file=sys.stderr)
+        return PeakPyramid(path)
@@ -4,6 +4,7 @@ import express from "express";
 import cors from "cors";
 import multer from "multer";
 import path from "path";
+import crypto from "crypto";
 
 // Import your MCP generator functions and data here.
 // import availableFiltersData from "./src/data/ffmpegFilters.json" assert { type: "json" };
@@ -43,6 +44,8 @@ import { generateWatermarkRemoverCommand } from "./src/mcp/watermarkRemover.js";
 const app = express();
 const PORT = process.env.PORT || 8300;
 const PY_BACKEND = "http://127.0.0.1:8200/run";
+const PY_JOBS = "http://127.0.0.1:8200/jobs";
+const JOB_POLL_MS = 500;
 
 app.use(cors());
 app.use(express.json({ limit: "50mb" }));
@@ -58,6 +61,18 @@ app.post("/upload", upload.single("file"), (req, res) => {
   res.json({ filename: req.file.filename, originalname: req.file.originalname });
 });
 
+// The Python backend queues every /run request; follow the job until it finishes.
+async function waitForJob(data) {
+  if (!data || !data.job_id) return data;
+  while (true) {
+    const jobResp = await fetch(`${PY_JOBS}/${data.job_id}`);
+    const job = await jobResp.json();
+    if (!jobResp.ok) throw new Error(job.message || "Job lookup failed");
+    if (job.status === "done" || job.status === "failed") return job.result;
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+  }
+}
+
 // Proxy utility
 async function proxyToPython({ command, inputFile = undefined, operation = undefined, ...extra }, res) {
   const payload = {};
@@ -72,10 +87,11 @@ async function proxyToPython({ command, inputFile = undefined, operation = undef
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify(payload)
     });
-    const data = await pyResp.json();
+    const queued = await pyResp.json();
     if (!pyResp.ok) {
-      return res.status(500).json({ error: data.error || "Python backend error" });
+      return res.status(500).json({ error: queued.error || queued.message || "Python backend error" });
     }
+    const data = await waitForJob(queued);
     res.json(data);
   } catch (err) {
     res.status(500).json({ error: err.message || "Python backend unreachable" });
@@ -113,6 +129,13 @@ const TOOL_REGISTRY = [
   "generateJoinCommandExample"
 ];
 
+// Descriptions of every registered tool, served in one response. The version
+// (also the ETag) changes whenever a description does, so clients can cache.
+const TOOL_DESCRIPTIONS = TOOL_REGISTRY
+  .map(name => toolDescriptions.find(t => t.name === name))
+  .filter(Boolean);
+const TOOLS_VERSION = crypto.createHash("sha256").update(JSON.stringify(TOOL_DESCRIPTIONS)).digest("hex").slice(0, 16);
+
 
 // === ROUTES ===
 
@@ -136,6 +159,17 @@ app.get("/api/describe-tool/:toolName", (req, res) => {
   res.json(desc);
 });
 
+// --- 2b. Describe all tools at once (conditional on ETag) ---
+app.get("/api/describe-tools", (req, res) => {
+  const etag = `"${TOOLS_VERSION}"`;
+  res.set("ETag", etag);
+  res.set("Cache-Control", "no-cache");
+  if (req.headers["if-none-match"] === etag) {
+    return res.status(304).end();
+  }
+  res.json({ version: TOOLS_VERSION, tools: TOOL_REGISTRY, descriptions: TOOL_DESCRIPTIONS });
+});
+
 
 // --- 3. List filters for a tool (paged) ---
 app.get("/api/list-filters/:toolName", (req, res) => {
@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Rnd } from "react-rnd";
 import { Plus, Trash2 } from "lucide-react";
 import { DragDropContext, Droppable, Draggable } from "react-beautiful-dnd";
@@ -6,6 +6,65 @@ import FileUploader from "@/components/shared/FileUploader";
 import { Button } from "@/components/ui/button";
 import { useFFmpegProcessor } from "@/hooks/useFFmpegProcessor";
 
+type WaveformPeaks = { min: number[]; max: number[]; rms: number[]; scale: number };
+
+// Draws min/max and RMS peaks fetched for the clip's width; zooming asks the
+// backend for another slice of its cached peak pyramid.
+function ClipWaveform({ url, duration, width, height }) {
+  const canvasRef = useRef<HTMLCanvasElement>(null);
+  const [peaks, setPeaks] = useState<WaveformPeaks | null>(null);
+  const pixels = Math.max(1, Math.round(width));
+
+  useEffect(() => {
+    const controller = new AbortController();
+    let retry: ReturnType<typeof setTimeout>;
+    // A first request for a file queues the peak build (202); ask again until it's ready.
+    const load = () =>
+      fetch(`${url}&start=0&end=${duration}&width=${pixels}`, { signal: controller.signal })
+        .then(async (resp) => {
+          const data = await resp.json();
+          if (resp.status === 202) {
+            retry = setTimeout(load, Number(resp.headers.get("Retry-After") || 2) * 1000);
+            return;
+          }
+          setPeaks(data.success ? data : null);
+        })
+        .catch(() => {});
+    load();
+    return () => {
+      clearTimeout(retry);
+      controller.abort();
+    };
+  }, [url, duration, pixels]);
+
+  useEffect(() => {
+    const canvas = canvasRef.current;
+    if (!canvas || !peaks || peaks.min.length === 0) return;
+    canvas.width = pixels;
+    canvas.height = height;
+    const ctx = canvas.getContext("2d");
+    const mid = height / 2;
+    const perPixel = peaks.min.length / pixels;
+    ctx.clearRect(0, 0, pixels, height);
+    for (let x = 0; x < pixels; x++) {
+      const from = Math.floor(x * perPixel);
+      const to = Math.max(from + 1, Math.floor((x + 1) * perPixel));
+      let lo = 0, hi = 0, rms = 0;
+      for (let i = from; i < to && i < peaks.min.length; i++) {
+        lo = Math.min(lo, peaks.min[i]);
+        hi = Math.max(hi, peaks.max[i]);
+        rms = Math.max(rms, peaks.rms[i]);
+      }
+      ctx.fillStyle = "#0080ff55";
+      ctx.fillRect(x, mid - (hi / peaks.scale) * mid, 1, ((hi - lo) / peaks.scale) * mid || 1);
+      ctx.fillStyle = "#0080ffaa";
+      ctx.fillRect(x, mid - (rms / peaks.scale) * mid, 1, (2 * rms / peaks.scale) * mid || 1);
+    }
+  }, [peaks, pixels, height]);
+
+  return <canvas ref={canvasRef} className="absolute inset-0 w-full h-full pointer-events-none rounded" />;
+}
+
 
 export default function TimelineVisualEditor({ timeline, setTimeline }) {
   const [selectedClip, setSelectedClip] = useState(null);
@@ -55,19 +114,10 @@ const handleFileSelected = async (fileOrFiles: File | File[]) => {
     }
   }
 
-  // Generate thumbnail
-  const ext = uploadedFile.split('.').pop();
-  const thumbName = uploadedFile.replace(`.${ext}`, `_thumb.jpg`);
-  await runCommand({
-    command: `ffmpeg -y -i "${uploadedFile}" -frames:v 1 -q:v 2 "${thumbName}"`,
-    inputFile: uploadedFile,
-  });
-  
-  const waveformName = uploadedFile.replace(`.${ext}`, `_waveform.png`);
-await runCommand({
-  command: `ffmpeg -y -i "${uploadedFile}" -filter_complex "aformat=channel_layouts=mono,showwavespic=s=600x80:colors=0080FF" -frames:v 1 "${waveformName}"`,
-  inputFile: uploadedFile,
-});
+  // Thumbnail and waveform come from cached backend endpoints, so adding a
+  // clip no longer runs an ffmpeg render for each.
+  const thumbUrl = `http://localhost:8200/api/frame?file=${encodeURIComponent(uploadedFile)}&width=160`;
+  const waveformUrl = `http://localhost:8200/api/waveform?file=${encodeURIComponent(uploadedFile)}`;
 
   // Add new clip to timeline
 const newClip = {
@@ -77,7 +127,7 @@ const newClip = {
   source: uploadedFile,
   start: 0,
   duration,
-  thumbnail: `http://localhost:8200/files/${thumbName}`,
+  thumbnail: thumbUrl,
 };
 
  setTimeline((oldTimeline: any) => {
@@ -92,8 +142,8 @@ const newClip = {
       source: uploadedFile,
       start: newStart,
       duration,
-      thumbnail: `http://localhost:8200/files/${thumbName}`,
-      waveform: `http://localhost:8200/files/${waveformName}`,
+      thumbnail: thumbUrl,
+      waveform: waveformUrl,
     };
 
     const tracks = oldTimeline.tracks.map((track: any, idx: number) =>
@@ -335,11 +385,19 @@ const step = getRulerStep(maxEnd, zoom);
   }}
 >
   <div className="flex items-center h-full w-full relative px-2">
+    {clip.waveform && (
+      <ClipWaveform
+        url={clip.waveform}
+        duration={clip.duration}
+        width={clip.duration * PIXELS_PER_SECOND}
+        height={TRACK_HEIGHT - 8}
+      />
+    )}
     {/* Thumbnail on the left */}
     {clip.thumbnail ? (
       <img
         src={clip.thumbnail}
-        className="w-14 h-10 object-cover rounded mr-3"
+        className="relative w-14 h-10 object-cover rounded mr-3"
         alt={clip.name}
         style={{ boxShadow: "0 2px 8px #0002" }}
       />
@@ -349,7 +407,7 @@ const step = getRulerStep(maxEnd, zoom);
       </div>
     )}
     {/* Text to the right */}
-    <div className="flex flex-col justify-center flex-1 min-w-0">
+    <div className="relative flex flex-col justify-center flex-1 min-w-0">
       <div className="font-bold text-base truncate">{clip.name}</div>
       <div className="text-[10px] text-gray-600 truncate">
         {clip.start}s / {clip.duration.toFixed(2)}s
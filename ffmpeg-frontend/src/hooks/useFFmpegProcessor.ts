@@ -1,6 +1,8 @@
 import { useState } from "react";
 import axios from "axios";
 import { toast } from "sonner";
+import { waitForJob } from "@/utils/jobs";
+import { uploadFileChunked, CHUNKED_UPLOAD_THRESHOLD } from "@/utils/uploads";
 
 const BACKEND_URL = "http://localhost:8200";
 
@@ -25,6 +27,10 @@ export type GifPalettePayload = { // Exported
     fps: number;
     start_time?: string; // Optional
     duration?: number; // Optional
+    stats_mode?: "full" | "diff" | "single"; // palettegen statistics (default full)
+    dither?: "bayer" | "heckbert" | "floyd_steinberg" | "sierra2" | "sierra2_4a" | "none";
+    bayer_scale?: number; // 0-5, only used with bayer dithering
+    max_colors?: number; // 2-256
 };
 
 // ---- New payload for the 'analyze' operation ----
@@ -63,6 +69,8 @@ export function useFFmpegProcessor() {
 
   // New state for capture functionality
   const [isCapturing, setIsCapturing] = useState<boolean>(false);
+  // Backend session id of the recording this tab started
+  const [captureSessionId, setCaptureSessionId] = useState<string | null>(null);
   // New state for supported capture modes
   const [supportedModes, setSupportedModes] = useState<SupportedCaptureMode[]>([]);
   // New state for FFmpeg error output
@@ -89,6 +97,16 @@ const [commandOutput, setCommandOutput] = useState<string>("");
       setIsUploading(true);
       setFFmpegErrorOutput(null); // Clear previous errors before upload
       try {
+          if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+              const filename = await uploadFileChunked(file);
+              setIsUploading(false);
+              if (filename) {
+                  setUploadedFilename(filename);
+                  toast.success(`File uploaded: ${filename}`);
+              }
+              return filename;
+          }
+
           const formData = new FormData();
           formData.append('file', file);
 
@@ -303,7 +321,8 @@ const runCommand = async (payload: RunCommandPayload) => {
   const endpoint = "/run";
 
   try {
-    const response = await axios.post(`${BACKEND_URL}${endpoint}`, payload);
+    const queued = await axios.post(`${BACKEND_URL}${endpoint}`, payload);
+    const response = { data: await waitForJob(queued.data) };
     setIsProcessing(false);
 
     if (isAnalyze) {
@@ -376,6 +395,7 @@ const runCommand = async (payload: RunCommandPayload) => {
           setIsProcessing(false); // Processing state might end once capture is confirmed started
             if (response.data && response.data.status === "recording_started") {
               console.log("[useFFmpegProcessor] Capture started successfully.");
+              setCaptureSessionId(response.data.session_id ?? null);
               toast.success("Recording started!");
               // The backend should ideally provide a way to get the final output file name later
               // For now, we'll assume the output file name sent in the request is the final one
@@ -415,7 +435,10 @@ const runCommand = async (payload: RunCommandPayload) => {
 
       try {
           // Send a request to the backend to stop the capture process
-          const response = await axios.post(`${BACKEND_URL}/api/capture/stop`);
+          const response = await axios.post(`${BACKEND_URL}/api/capture/stop`, {
+            session_id: captureSessionId,
+          });
+          setCaptureSessionId(null);
 
           setIsProcessing(false);
           setIsCapturing(false); // Always set capturing to false after attempting to stop
@@ -4,11 +4,20 @@ import FileUploader from "@/components/shared/FileUploader";
 import FFmpegCommandDisplay from "@/components/shared/FFmpegCommandDisplay";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Label } from "@/components/ui/label";
+import { Button } from "@/components/ui/button";
+import { Loader2 } from "lucide-react";
+import { toast } from "sonner";
+import { useFFmpegProcessor } from "@/hooks/useFFmpegProcessor";
+import { runBatch, type BatchStatus } from "@/utils/batch";
 
 const BatchProcessor = () => {
   const [selectedFiles, setSelectedFiles] = useState<File[]>([]);
   const [batchOp, setBatchOp] = useState("");
   const [commands, setCommands] = useState<string[]>([]);
+  const [maxConcurrency, setMaxConcurrency] = useState<number>(4);
+  const [isRunning, setIsRunning] = useState(false);
+  const [batch, setBatch] = useState<BatchStatus | null>(null);
+  const { uploadSingleFile } = useFFmpegProcessor();
 
   const ops = [
     { label: "Convert to MP4 (libx264)", value: "convert_mp4" },
@@ -16,13 +25,8 @@ const BatchProcessor = () => {
     { label: "Resize to 720p (1280x720)", value: "resize_720p" },
   ];
 
-  const generate = (files: File[], op: string) => {
-    if (!op) {
-      setCommands([]);
-      return;
-    }
-    const cmds = files.map((f) => {
-      const name = f.name;
+  const buildCommands = (names: string[], op: string) =>
+    names.map((name) => {
       const base = name.replace(/\.[^/.]+$/, "");
       let cmd = `ffmpeg -i "${name}"`;
       let out = "";
@@ -40,7 +44,35 @@ const BatchProcessor = () => {
       }
       return `${cmd} "${out}"`;
     });
-    setCommands(cmds);
+
+  const generate = (files: File[], op: string) => {
+    if (!op) {
+      setCommands([]);
+      return;
+    }
+    setCommands(buildCommands(files.map((f) => f.name), op));
+  };
+
+  const runAll = async () => {
+    setIsRunning(true);
+    setBatch(null);
+    try {
+      // Upload first, then send the whole list to the server in one request
+      const names: string[] = [];
+      for (const file of selectedFiles) {
+        const name = await uploadSingleFile(file);
+        if (!name) throw new Error(`Upload failed for ${file.name}`);
+        names.push(name);
+      }
+      const final = await runBatch(buildCommands(names, batchOp), { maxConcurrency }, setBatch);
+      const failed = final.counts.failed || 0;
+      if (failed) toast.error(`${failed} of ${final.total} item(s) failed.`);
+      else toast.success(`Batch finished: ${final.total} item(s).`);
+    } catch (e: any) {
+      toast.error(e.message || "Batch failed.");
+    } finally {
+      setIsRunning(false);
+    }
   };
 
   const onFiles = (files: File[]) => {
@@ -60,7 +92,7 @@ const BatchProcessor = () => {
       <div className="p-8 space-y-6">
         <h2 className="text-3xl font-bold">Batch Processor</h2>
         <p className="text-muted-foreground">
-          Generate FFmpeg commands for multiple files.
+          Generate FFmpeg commands for multiple files and run them on the server in one batch.
         </p>
 
         <FileUploader onFileSelect={onFiles} />
@@ -108,9 +140,42 @@ const BatchProcessor = () => {
             <CardContent>
               <div className="space-y-2">
                 {commands.map((cmd, i) => (
-                  <FFmpegCommandDisplay key={i} command={cmd} />
+                  <div key={i}>
+                    <FFmpegCommandDisplay command={cmd} />
+                    {batch?.items[i] && (
+                      <p className="text-xs text-muted-foreground">
+                        {batch.items[i].status}
+                        {batch.items[i].status === "running" && ` ${Math.round(batch.items[i].percent)}%`}
+                        {batch.items[i].result?.cached && " (cached)"}
+                        {batch.items[i].result?.output_file && ` \u2192 ${batch.items[i].result?.output_file}`}
+                      </p>
+                    )}
+                  </div>
                 ))}
               </div>
+              <div className="flex items-end gap-4 mt-4">
+                <div className="space-y-1">
+                  <Label htmlFor="max-concurrency">Max concurrent jobs</Label>
+                  <input
+                    id="max-concurrency"
+                    type="number"
+                    min={1}
+                    max={64}
+                    value={maxConcurrency}
+                    onChange={(e) => setMaxConcurrency(Math.max(1, Number(e.target.value) || 1))}
+                    className="block w-24 h-10 px-3 py-2 border rounded-md bg-background text-sm"
+                  />
+                </div>
+                <Button onClick={runAll} disabled={isRunning}>
+                  {isRunning && <Loader2 className="mr-2 h-4 w-4 animate-spin" />}
+                  Run batch
+                </Button>
+              </div>
+              {batch && (
+                <p className="text-sm mt-2">
+                  {batch.percent}% &middot; {Object.entries(batch.counts).map(([k, v]) => `${v} ${k}`).join(", ")}
+                </p>
+              )}
             </CardContent>
           </Card>
         )}
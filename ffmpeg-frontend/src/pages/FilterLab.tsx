@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { MainLayout } from "@/components/layout/MainLayout";
 import FileUploader from "@/components/shared/FileUploader";
 import FFmpegCommandDisplay from "@/components/shared/FFmpegCommandDisplay";
@@ -72,6 +72,9 @@ const FilterLab = () => {
 
     const [previewUrl, setPreviewUrl] = useState<string | null>(null);
     const [isPreviewing, setIsPreviewing] = useState(false);
+    // Server-side name of the file last uploaded for previews, so tweaking a
+    // parameter doesn't upload the same file again
+    const previewUpload = useRef<{ file: File; name: string } | null>(null);
 
   // Use the imported filter data
   const availableFilters: FilterCategory[] = availableFiltersData;
@@ -90,31 +93,22 @@ const FilterLab = () => {
   setIsPreviewing(true);
   setPreviewUrl(null);
 
-  const uploadedFile = await uploadSingleFile(selectedFiles[0]);
-  if (!uploadedFile) { setIsPreviewing(false); return; }
+  let uploadedFile = previewUpload.current?.file === selectedFiles[0] ? previewUpload.current.name : null;
+  if (!uploadedFile) {
+    uploadedFile = await uploadSingleFile(selectedFiles[0]);
+    if (!uploadedFile) { setIsPreviewing(false); return; }
+    previewUpload.current = { file: selectedFiles[0], name: uploadedFile };
+  }
 
   const previewCommand = generateDisplayCommandString(
     uploadedFile, selectedFilters, filterParameterValues, /* add preview mode flag if needed */
     true // << pass a 'preview' boolean, if your generator supports it
   );
   
-  const resp = await fetch("http://localhost:8200/preview", {  // Your new backend endpoint
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
-      command: previewCommand,
-      inputFile: uploadedFile,
-      preview: true
-    }),
-  });
-  const result = await resp.json();
+  // Stream the preview: the <video> starts playing while ffmpeg is still encoding
+  const params = new URLSearchParams({ command: previewCommand, inputFile: uploadedFile });
+  setPreviewUrl(`http://localhost:8200/preview/stream?${params.toString()}`);
   setIsPreviewing(false);
-
-  if (result.success && result.preview_url) {
-    setPreviewUrl(`http://localhost:8200/files/${result.preview_url}`);
-  } else {
-    toast.error("Preview failed.");
-  }
 };
 
   // Effect to initialize parameter state when selected filters change
@@ -765,7 +759,8 @@ const FilterLab = () => {
 
                        {previewUrl && (
                         <div className="mt-4">
-                            <video controls src={previewUrl} className="w-full max-w-lg rounded-lg shadow" />
+                            <video controls autoPlay muted src={previewUrl} className="w-full max-w-lg rounded-lg shadow"
+                              onError={() => toast.error("Preview failed.")} />
                             {/* or for images:
                             <img src={previewUrl} className="w-full max-w-lg rounded-lg shadow" />
                             */}
@@ -37,7 +37,12 @@ const GifWebpCreator = () => {
   const [scaleHeight, setScaleHeight] = useState<string>("320"); // Default scale height
   const [outputFps, setOutputFps] = useState<string>("10"); // Default output FPS for GIF/WebP
 
+  const [statsMode, setStatsMode] = useState<NonNullable<GifPalettePayload["stats_mode"]>>("full");
+  const [dither, setDither] = useState<NonNullable<GifPalettePayload["dither"]>>("sierra2_4a");
+
   const formatOptions = ["gif", "webp"];
+  const statsModeOptions = ["full", "diff", "single"] as const;
+  const ditherOptions = ["sierra2_4a", "sierra2", "floyd_steinberg", "heckbert", "bayer", "none"] as const;
 
   // State and Ref for duration detection
   const [fileUrl, setFileUrl] = useState<string | null>(null);
@@ -124,7 +129,7 @@ const GifWebpCreator = () => {
       } else {
           setCommand(""); // Clear command if requirements aren't met
       }
-  }, [selectedFiles, startTime, duration, outputFormat, scaleHeight, outputFps, setCommand]); // Add setCommand to dependencies
+  }, [selectedFiles, startTime, duration, outputFormat, scaleHeight, outputFps, statsMode, dither, setCommand]); // Add setCommand to dependencies
 
 
   const handleTimeChange = (start: string, dur: string) => {
@@ -173,18 +178,10 @@ const GifWebpCreator = () => {
     const videoFilter = `fps=${fps},scale=-1:${height}:flags=lanczos`; // scale=-1:height maintains aspect ratio
 
     if (format === "gif") {
-        // Two-step palette workflow for GIF
-        const paletteFileName = `${baseName}_palette.png`;
+        // Single pass: the scaled frames are split between palettegen and paletteuse
         outputFileName = `${baseName}_clip.gif`;
-
-        // Step 1: Generate palette
-        const command1 = `ffmpeg${commonOptions} -i "${inputFilename}" -vf "${videoFilter},palettegen" -y "${paletteFileName}"`;
-
-        // Step 2: Create GIF using palette
-        const command2 = `ffmpeg${commonOptions} -i "${inputFilename}" -i "${paletteFileName}" -filter_complex "${videoFilter}[x];[x][1:v]paletteuse" -y "${outputFileName}"`;
-
-        // Combine commands for display
-        command = `## Step 1: Generate Palette\n${command1}\n\n## Step 2: Create GIF using Palette\n${command2}`;
+        const graph = `[0:v]${videoFilter},split[a][b];[a]palettegen=stats_mode=${statsMode}[p];[b][p]paletteuse=dither=${dither}${statsMode === "single" ? ":new=1" : ""}`;
+        command = `ffmpeg${commonOptions} -i "${inputFilename}" -filter_complex "${graph}" -y "${outputFileName}"`;
 
     } else if (format === "webp") {
         // Single command for WebP (basic example)
@@ -252,6 +249,8 @@ const GifWebpCreator = () => {
                   fps: parseInt(outputFps), // Ensure number type
                   ...(startTime && { start_time: startTime }), // Add if not empty
                   ...(durationNumber !== undefined && { duration: durationNumber }), // Add if valid number
+                  stats_mode: statsMode,
+                  dither,
               };
               runCommand(payload); // Run the command via the hook
           } else if (outputFormat === "webp") {
@@ -381,6 +380,37 @@ const GifWebpCreator = () => {
                        </div>
 
 
+                       {outputFormat === "gif" && (
+                           <div className="flex space-x-4 w-full max-w-md">
+                               <div className="grid gap-1.5 w-1/2">
+                                   <Label htmlFor="stats-mode">Palette Statistics</Label>
+                                   <Select onValueChange={(value) => setStatsMode(value as typeof statsMode)} value={statsMode} disabled={isProcessing || isUploading}>
+                                       <SelectTrigger id="stats-mode">
+                                           <SelectValue />
+                                       </SelectTrigger>
+                                       <SelectContent>
+                                           {statsModeOptions.map(mode => (
+                                               <SelectItem key={mode} value={mode}>{mode}</SelectItem>
+                                           ))}
+                                       </SelectContent>
+                                   </Select>
+                               </div>
+                               <div className="grid gap-1.5 w-1/2">
+                                   <Label htmlFor="dither">Dither</Label>
+                                   <Select onValueChange={(value) => setDither(value as typeof dither)} value={dither} disabled={isProcessing || isUploading}>
+                                       <SelectTrigger id="dither">
+                                           <SelectValue />
+                                       </SelectTrigger>
+                                       <SelectContent>
+                                           {ditherOptions.map(option => (
+                                               <SelectItem key={option} value={option}>{option}</SelectItem>
+                                           ))}
+                                       </SelectContent>
+                                   </Select>
+                               </div>
+                           </div>
+                       )}
+
                        {/* Run Button - uses the new handleRunClick */}
                        <Button
                            onClick={handleRunClick} // Use the new handler
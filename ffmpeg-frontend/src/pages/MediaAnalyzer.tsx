@@ -7,6 +7,7 @@ import { Button } from "@/components/ui/button";
 import { Loader2 } from "lucide-react";
 import { useFFmpegProcessor } from "@/hooks/useFFmpegProcessor";
 import { toast } from "sonner";
+import { waitForJob } from "@/utils/jobs";
 
 // --- ffprobe output parser ---
 function parseFFprobeOutput(output: string) {
@@ -106,7 +107,7 @@ const MediaAnalyzer = () => {
         inputFile: uploadedFile,
       }),
     });
-    const result = await resp.json();
+    const result = await waitForJob(await resp.json());
     if (result.success) {
       setAnalysisResult(result.output);
     } else {
@@ -119,9 +120,15 @@ const MediaAnalyzer = () => {
   let parsed;
   if (analysisResult) {
     try {
-      parsed = parseFFprobeOutput(analysisResult);
+      // The backend returns ffprobe's JSON; fall back to the key=value text format.
+      const probe = JSON.parse(analysisResult);
+      parsed = { FORMAT: [probe.format], STREAM: probe.streams || [] };
     } catch {
-      parsed = null;
+      try {
+        parsed = parseFFprobeOutput(analysisResult);
+      } catch {
+        parsed = null;
+      }
     }
   }
   const format = parsed?.FORMAT?.[0];
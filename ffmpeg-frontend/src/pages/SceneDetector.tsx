@@ -11,9 +11,28 @@ import { Loader2, Copy } from "lucide-react";
 import { useFFmpegProcessor } from "@/hooks/useFFmpegProcessor"; // Import the new hook
 import OutputMediaPlayer from "@/components/shared/OutputMediaPlayer"; // Keep for consistency, though no media output
 import { toast } from "sonner"; // Import toast
-import type { SingleFileCommandPayload } from "@/hooks/useFFmpegProcessor"; // Import payload type
+import { waitForJob } from "@/utils/jobs";
 
 
+type Scene = {
+  index: number;
+  start: number;
+  end: number;
+  duration: number;
+  score: number | null;
+  thumbnail: string;
+};
+
+type SceneResult = {
+  success: boolean;
+  message?: string;
+  threshold: number;
+  scenes: Scene[];
+  analysis: { fps: number; height: number; frames: number };
+};
+
+const BACKEND_URL = "http://localhost:8200";
+
 const SceneDetector = () => {
   // Use the new hook
   const {
@@ -33,6 +52,9 @@ const SceneDetector = () => {
   } = useFFmpegProcessor();
 
   const [sensitivity, setSensitivity] = useState<number[]>([60]); // Default sensitivity 0.6 (FFmpeg uses 0-1)
+  const [sceneFile, setSceneFile] = useState<string | null>(null); // Uploaded name of the analysed file
+  const [sceneResult, setSceneResult] = useState<SceneResult | null>(null);
+  const [isDetecting, setIsDetecting] = useState(false);
 
   // Effect to generate command string for display whenever selectedFiles or sensitivity changes
   // This command string uses the *local* file name for display purposes.
@@ -57,15 +79,43 @@ const SceneDetector = () => {
       return ""; // Return empty string if command cannot be generated
     }
 
-    // Use the select filter with 'scene' expression
-    // The 'showinfo' filter is often used to output frame details including scene score
-    // The output of this command goes to stderr/stdout, not a file directly showing scenes.
+    // The backend scores every frame once on a small decode and applies the
+    // threshold itself; this is the equivalent one-off command.
     const command = `ffmpeg -i "${inputFilename}" -vf "select='gt(scene,${sensitivityValue.toFixed(2)})',showinfo" -f null -`;
 
     setCommand(command); // Set the command using the hook's function
     return command; // Return the generated command string
   };
 
+  // Scores are cached per file on the backend, so a new threshold is answered
+  // without decoding the video again.
+  const detectScenes = async (uploadedFile: string, threshold: number) => {
+      setIsDetecting(true);
+      try {
+          const resp = await fetch(`${BACKEND_URL}/run`, {
+              method: "POST",
+              headers: { "Content-Type": "application/json" },
+              body: JSON.stringify({
+                  operation: "scene_detect",
+                  inputFile: uploadedFile,
+                  threshold,
+              }),
+          });
+          const result = await waitForJob(await resp.json());
+          if (result.success) {
+              setSceneResult(result);
+          } else {
+              setSceneResult(null);
+              toast.error(result.message || "Scene detection failed");
+          }
+      } catch (err) {
+          console.error("Scene detection failed: ", err);
+          toast.error("Scene detection failed");
+      } finally {
+          setIsDetecting(false);
+      }
+  };
+
   // New handler for the Run button
   const handleRunClick = async () => {
       if (selectedFiles.length === 0) {
@@ -81,20 +131,24 @@ const SceneDetector = () => {
       const uploadedFile = await uploadSingleFile(selectedFiles[0]);
 
       if (uploadedFile) {
-          // Construct the actual command payload using the *uploaded* filename
-          const actualCommand = generateDisplayCommandString(uploadedFile, sensitivity[0] / 100); // Reuse logic, but pass uploadedFile
-
-          const payload: SingleFileCommandPayload = {
-              command: actualCommand,
-              inputFile: uploadedFile, // Use the uploaded filename
-          };
-          // Note: ffprobe output goes to stdout/stderr, not a file.
-          // The backend should capture and potentially return this output.
-          // For now, the backend just runs the command.
-          runCommand(payload); // Run the command via the hook
+          setSceneFile(uploadedFile);
+          await detectScenes(uploadedFile, sensitivity[0] / 100);
       }
   };
 
+  // Moving the slider after a run re-thresholds the cached scores.
+  const handleSensitivityCommit = (value: number[]) => {
+      if (sceneFile && !isDetecting) {
+          detectScenes(sceneFile, value[0] / 100);
+      }
+  };
+
+  // A newly selected file needs a new run.
+  useEffect(() => {
+      setSceneFile(null);
+      setSceneResult(null);
+  }, [selectedFiles]);
+
 
 //   function parseSceneOutput(ffmpegOutput: string | undefined): string {
 //   if (!ffmpegOutput) return "No scene changes detected.";
@@ -188,58 +242,29 @@ const SceneDetector = () => {
 // const finalScenes = enrichScenesColor(parsedScenes);
 
 
-// Copy handler for the raw FFmpeg output
-
-function yuvToRgb(y: number, u: number, v: number): [number, number, number] {
-  const r = Math.round(y + 1.402 * (v - 128));
-  const g = Math.round(y - 0.344136 * (u - 128) - 0.714136 * (v - 128));
-  const b = Math.round(y + 1.772 * (u - 128));
-  return [
-    Math.max(0, Math.min(255, r)),
-    Math.max(0, Math.min(255, g)),
-    Math.max(0, Math.min(255, b))
-  ];
-}
-
-function parseFfmpegScenes(ffmpegOutput: string | undefined) {
-  if (!ffmpegOutput) return [];
-  // Updated regex: robust for showinfo output, single line per scene.
-  const sceneLineRegex = /^\[Parsed_showinfo[^\]]*]\s+n:\s*(\d+)[^\n]*pts_time:([0-9.]+)[^\n]*duration_time:([0-9.]+)[^\n]*i:([A-Z])[^\n]*mean:\[([0-9 ]+)\][^\n]*stdev:\[([0-9. ]+)\]/gm;
-  let match: RegExpExecArray | null;
-  const scenes = [];
-  while ((match = sceneLineRegex.exec(ffmpegOutput)) !== null) {
-    const frame = parseInt(match[1], 10);
-    const time = parseFloat(match[2]);
-    const duration = parseFloat(match[3]);
-    const type = match[4];
-    const meanYuv = match[5].trim().split(" ").map(Number);
-    const stdev = match[6].trim().split(" ").map(Number);
-    const meanRgb = meanYuv.length === 3 ? yuvToRgb(meanYuv[0], meanYuv[1], meanYuv[2]) : [0, 0, 0];
-
-    scenes.push({ frame, time, duration, type, meanYuv, meanRgb, stdev });
-  }
-  return scenes;
-}
+const formatTime = (seconds: number) => {
+  const m = Math.floor(seconds / 60);
+  const sec = (seconds % 60).toFixed(2).padStart(5, "0");
+  return `${m}:${sec}`;
+};
 
+// Copy the scene list as tab-separated start/end/duration.
 const handleCopy = () => {
-  if (
-    typeof commandOutput === "string" &&
-    commandOutput &&
-    !commandOutput.startsWith("Error:")
-  ) {
-    navigator.clipboard.writeText(commandOutput)
-      .then(() => toast.success("FFmpeg output copied to clipboard!"))
-      .catch((err) => {
-        console.error("Failed to copy output: ", err);
-        toast.error("Failed to copy output.");
-      });
-  } else {
-    toast("No valid output to copy.");
+  if (!sceneResult || sceneResult.scenes.length === 0) {
+    toast("No scenes to copy.");
+    return;
   }
+  const text = sceneResult.scenes
+    .map((scene) => `${scene.index + 1}\t${scene.start.toFixed(3)}\t${scene.end.toFixed(3)}\t${scene.duration.toFixed(3)}`)
+    .join("\n");
+  navigator.clipboard.writeText(text)
+    .then(() => toast.success("Scene list copied to clipboard!"))
+    .catch((err) => {
+      console.error("Failed to copy scenes: ", err);
+      toast.error("Failed to copy scenes.");
+    });
 };
 
-const parsedScenes = parseFfmpegScenes(commandOutput);
-
   return (
     <MainLayout>
       <div className="flex-1 space-y-4 p-8 pt-6">
@@ -249,7 +274,7 @@ const parsedScenes = parseFfmpegScenes(commandOutput);
         {/* Use the hook's file select handler */}
         <FileUploader onFileSelect={handleFileSelect} />
 
-        {commandOutput && (
+        {sceneResult && (
           <Card className="mt-4">
             <CardHeader className="flex flex-row items-center justify-between">
               <CardTitle>Scene Changes</CardTitle>
@@ -257,60 +282,38 @@ const parsedScenes = parseFfmpegScenes(commandOutput);
                 size="sm"
                 variant="ghost"
                 onClick={handleCopy}
-                disabled={!commandOutput || commandOutput.startsWith("Error:")}
-                aria-label="Copy raw FFmpeg output"
+                disabled={sceneResult.scenes.length === 0}
+                aria-label="Copy scene list"
               >
                 <Copy className="h-4 w-4" />
               </Button>
             </CardHeader>
             <CardContent>
-              <h4 className="font-semibold mb-2">Detected Scenes</h4>
-              <pre className="text-xs whitespace-pre-wrap max-h-96 overflow-auto">
-                {parsedScenes.length === 0
-                  ? <div>No scene changes detected.</div>
-                  : parsedScenes.map((scene, idx) => (
-                      <div key={idx} style={{ marginBottom: 18 }}>
-                        {/* Scene Header: bold and larger */}
-                        {/* <div style={{ fontWeight: 700, fontSize: 18, marginBottom: 2 }}>
-                          Scene {idx + 1}: Frame {scene.frame}, Time {scene.time.toFixed(2)}s
-                        </div> */}
-                        <div style={{ fontSize: 17, marginBottom: 2 }}>
-                          <span style={{ fontWeight: 700 }}>Scene</span> {idx + 1}:&nbsp;
-                          <span style={{ fontWeight: 700 }}>Frame</span> {scene.frame},&nbsp;
-                          <span style={{ fontWeight: 700 }}>Time</span> {scene.time.toFixed(2)}s
-                        </div>
-                        {/* Details: regular font, not bold, smaller size */}
-                        <div style={{ display: 'flex', alignItems: 'center', fontSize: 15, fontWeight: 400 }}>
-                          Duration: {scene.duration.toFixed(3)}s&nbsp;|&nbsp;
-                          Type: {scene.type}&nbsp;|&nbsp;
-                          Mean YUV: {scene.meanYuv.join(', ')}
-                          {/* Color box after Mean YUV */}
-                          <span
-                            style={{
-                              display: 'inline-block',
-                              width: 20,
-                              height: 20,
-                              marginLeft: 8,
-                              marginRight: 8,
-                              background: `rgb(${scene.meanRgb.join(',')})`,
-                              border: '1px solid #333',
-                              verticalAlign: 'middle',
-                              borderRadius: 3
-                            }}
-                            title={`RGB: ${scene.meanRgb.join(',')}`}
-                          />
-                          |&nbsp;Stdev YUV: {scene.stdev.join(', ')}
-                        </div>
-                      </div>
-                    ))
-                }
-              </pre>
-              <details className="mt-4">
-                <summary className="cursor-pointer text-blue-600">Show Raw FFmpeg Output</summary>
-                <pre className="text-xs whitespace-pre-wrap max-h-96 overflow-auto mt-2">
-                  {commandOutput}
-                </pre>
-              </details>
+              <h4 className="font-semibold mb-2">
+                {sceneResult.scenes.length} scene(s) at threshold {sceneResult.threshold.toFixed(2)}
+              </h4>
+              <p className="text-xs text-muted-foreground mb-4">
+                Scored {sceneResult.analysis.frames} frames at {sceneResult.analysis.fps} fps, {sceneResult.analysis.height}p.
+              </p>
+              <div className="grid grid-cols-2 md:grid-cols-3 gap-4 max-h-[32rem] overflow-auto">
+                {sceneResult.scenes.map((scene) => (
+                  <div key={scene.index} className="border rounded p-2 text-sm">
+                    <img
+                      src={`${BACKEND_URL}${scene.thumbnail}`}
+                      alt={`Scene ${scene.index + 1}`}
+                      loading="lazy"
+                      className="w-full rounded mb-2 bg-muted"
+                    />
+                    <div className="font-semibold">Scene {scene.index + 1}</div>
+                    <div>
+                      {formatTime(scene.start)} &ndash; {formatTime(scene.end)} ({scene.duration.toFixed(2)}s)
+                    </div>
+                    {scene.score !== null && (
+                      <div className="text-muted-foreground">Score: {scene.score.toFixed(3)}</div>
+                    )}
+                  </div>
+                ))}
+              </div>
             </CardContent>
           </Card>
         )}
@@ -353,8 +356,9 @@ const parsedScenes = parseFfmpegScenes(commandOutput);
                            step={1}
                            value={sensitivity}
                            onValueChange={handleSensitivityChange}
+                           onValueCommit={handleSensitivityCommit}
                            className="w-full max-w-sm"
-                           disabled={isProcessing || isUploading}
+                           disabled={isDetecting || isUploading}
                          />
                          <p className="text-sm text-muted-foreground">Use 0 for every frame, or 1 for the fewest scenes</p>
                        </div>
@@ -362,9 +366,9 @@ const parsedScenes = parseFfmpegScenes(commandOutput);
                        {/* Run Button - uses the new handleRunClick */}
                        <Button
                            onClick={handleRunClick} // Use the new handler
-                           disabled={selectedFiles.length === 0 || isProcessing || isUploading} // Disable if no file, processing, or uploading
+                           disabled={selectedFiles.length === 0 || isDetecting || isUploading} // Disable if no file, processing, or uploading
                        >
-                           {isProcessing ? (
+                           {isDetecting ? (
                                <>
                                    <Loader2 className="mr-2 h-4 w-4 animate-spin" />
                                    Processing...
@@ -380,7 +384,7 @@ const parsedScenes = parseFfmpegScenes(commandOutput);
                        </Button>
                        <p className="text-sm text-yellow-600">
                            Note: Clicking "Run" will first upload the selected file and then send the command to your local backend server running on http://localhost:8200.
-                           Ensure your backend is running and has access to the selected file and FFmpeg. The output (timestamps of scene changes) will be printed to the console/terminal where you execute the command.
+                           Ensure your backend is running and has access to the selected file and FFmpeg. The video is decoded once; changing the sensitivity afterwards updates the scenes without another decode.
                        </p>
                    </>
                )}
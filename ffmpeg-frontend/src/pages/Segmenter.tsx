@@ -5,11 +5,13 @@ import FFmpegCommandDisplay from "@/components/shared/FFmpegCommandDisplay"; //
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Label } from "@/components/ui/label";
 import { Input } from "@/components/ui/input";
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select";
 import { Button } from "@/components/ui/button"; // Import Button
 import { Loader2 } from "lucide-react"; // Import Loader2 icon
 import { useFFmpegProcessor } from "@/hooks/useFFmpegProcessor"; // Import the new hook
 import OutputMediaPlayer from "@/components/shared/OutputMediaPlayer"; // Keep for consistency, though output is segments
 import { toast } from "sonner"; // Import toast
+import { waitForJob } from "@/utils/jobs";
 import type { SingleFileCommandPayload } from "@/hooks/useFFmpegProcessor"; // Import payload type
 
 
@@ -32,6 +34,8 @@ const Segmenter = () => {
   const [segmentResult, setSegmentResult] = useState<any>(null);
 
   const [segmentDuration, setSegmentDuration] = useState<string>("10"); // Default to 10 seconds
+  const [segmentMode, setSegmentMode] = useState<"copy" | "abr">("copy");
+  const [renditionHeights, setRenditionHeights] = useState<string>("1080,720,480,360"); // ABR ladder
 
   // Effect to generate command string for display whenever selectedFiles or segmentDuration changes
   // This command string uses the *local* file name for display purposes.
@@ -119,9 +123,14 @@ const runSegmentation = async (filename: string, segmentDuration: number) => {
       operation: "segment_hls",
       inputFile: filename,
       segmentDuration,
+      mode: segmentMode,
+      // Heights only; the backend picks bitrates and drops renditions above the source
+      ...(segmentMode === "abr" && {
+        ladder: renditionHeights.split(",").map((h) => parseInt(h.trim())).filter((h) => h > 0).map((height) => ({ height })),
+      }),
     }),
   });
-  const result = await resp.json();
+  const result = await waitForJob(await resp.json());
   setSegmentResult(result);
   if (!result.success) {
     toast.error("Segmentation failed.");
@@ -199,6 +208,33 @@ const runSegmentation = async (filename: string, segmentDuration: number) => {
                          />
                        </div>
 
+                       <div className="grid w-full max-w-sm items-center gap-1.5">
+                         <Label htmlFor="segment-mode">Packaging</Label>
+                         <Select onValueChange={(value) => setSegmentMode(value as "copy" | "abr")} value={segmentMode} disabled={isProcessing || isUploading}>
+                           <SelectTrigger id="segment-mode">
+                             <SelectValue />
+                           </SelectTrigger>
+                           <SelectContent>
+                             <SelectItem value="copy">Single bitrate (stream copy)</SelectItem>
+                             <SelectItem value="abr">Adaptive bitrate ladder (re-encode)</SelectItem>
+                           </SelectContent>
+                         </Select>
+                       </div>
+
+                       {segmentMode === "abr" && (
+                         <div className="grid w-full max-w-sm items-center gap-1.5">
+                           <Label htmlFor="rendition-heights">Rendition Heights (px, comma separated)</Label>
+                           <Input
+                             id="rendition-heights"
+                             type="text"
+                             placeholder="e.g., 1080,720,480,360"
+                             value={renditionHeights}
+                             onChange={(e) => setRenditionHeights(e.target.value)}
+                             disabled={isProcessing || isUploading}
+                           />
+                         </div>
+                       )}
+
                        {/* Run Button - uses the new handleRunClick */}
                        <Button
                            onClick={handleRunClick} // Use the new handler
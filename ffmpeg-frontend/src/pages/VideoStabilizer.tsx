@@ -31,6 +31,7 @@ const VideoStabilizer = () => {
   } = useFFmpegProcessor();
 
   const [stabilizationStrength, setStabilizationStrength] = useState<string>("medium"); // Placeholder for strength
+  const [detectHeight, setDetectHeight] = useState<string>("0"); // 0 = analyze at full resolution
 
   // Placeholder strength options - map to potential filter parameters later
   const strengthOptions = [
@@ -40,6 +41,13 @@ const VideoStabilizer = () => {
     { label: "High", value: "high" },
   ];
 
+  // Motion analysis on a downscaled decode is much faster; vectors are rescaled on the backend
+  const detectHeightOptions = [
+    { label: "Full resolution", value: "0" },
+    { label: "720p (faster)", value: "720" },
+    { label: "540p (fastest)", value: "540" },
+  ];
+
   // Effect to generate command string for display whenever selectedFiles or stabilizationStrength changes
   // This command string uses the *local* file name for display purposes.
   useEffect(() => {
@@ -166,6 +174,7 @@ const VideoStabilizer = () => {
             operation: "stabilize", // 
             command: actualCommand, // Send the combined command string
             inputFile: uploadedFile, // Use the uploaded filename
+            detect_height: parseInt(detectHeight), // Backend caches the analysis per input and resolution
           };
           // Note: The backend needs to be able to execute multi-line commands or scripts for this to work correctly.
           runCommand(payload); // Run the command via the hook
@@ -223,6 +232,19 @@ const VideoStabilizer = () => {
                            </SelectContent>
                          </Select>
                        </div>
+                       <div className="grid w-full max-w-sm items-center gap-1.5">
+                         <Label htmlFor="detect-height-select">Analysis Resolution</Label>
+                         <Select onValueChange={setDetectHeight} value={detectHeight} disabled={isProcessing || isUploading}>
+                           <SelectTrigger id="detect-height-select">
+                             <SelectValue />
+                           </SelectTrigger>
+                           <SelectContent>
+                             {detectHeightOptions.map(option => (
+                               <SelectItem key={option.value} value={option.value}>{option.label}</SelectItem>
+                             ))}
+                           </SelectContent>
+                         </Select>
+                       </div>
                        <p className="text-sm text-yellow-600">
                            Note: Video stabilization with FFmpeg is a two-pass process. You must run the first command to generate a log file (`vidstab.log`) before running the second command. The generated commands are basic examples; advanced tuning of `vidstabdetect` and `vidstabtransform` filters may be required for optimal results.
                        </p>
@@ -0,0 +1,79 @@
+const BACKEND_URL = "http://localhost:8200";
+
+const POLL_INTERVAL_MS = 1000;
+
+export type BatchItemStatus = {
+  index: number;
+  command: string;
+  job_id: string | null;
+  status: "pending" | "queued" | "running" | "done" | "failed";
+  percent: number;
+  result?: { success: boolean; message?: string; output_file?: string; cached?: boolean; error?: string };
+};
+
+export type BatchStatus = {
+  batch_id: string;
+  status: "running" | "done";
+  total: number;
+  counts: Record<string, number>;
+  percent: number;
+  items: BatchItemStatus[];
+};
+
+export type BatchOptions = {
+  maxConcurrency?: number;
+  threads?: number;
+};
+
+const pollBatch = async (batchId: string, onUpdate: (batch: BatchStatus) => void): Promise<BatchStatus> => {
+  while (true) {
+    const resp = await fetch(`${BACKEND_URL}/batch/${batchId}`);
+    const batch = await resp.json();
+    if (!resp.ok) throw new Error(batch.message || "Batch lookup failed");
+    onUpdate(batch);
+    if (batch.status === "done") return batch;
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+};
+
+// Submit every command to /batch in one request; the backend validates them all
+// first, then runs them across its worker pool. onUpdate gets the aggregate and
+// per-item status as it changes; resolves with the final batch status.
+export const runBatch = async (
+  commands: string[],
+  options: BatchOptions,
+  onUpdate: (batch: BatchStatus) => void
+): Promise<BatchStatus> => {
+  const resp = await fetch(`${BACKEND_URL}/batch`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      commands,
+      max_concurrency: options.maxConcurrency,
+      threads: options.threads,
+    }),
+  });
+  const data = await resp.json();
+  if (!resp.ok || !data.batch_id) {
+    const details = (data.errors || []).map((e: any) => `#${e.index + 1}: ${e.message}`).join("\n");
+    throw new Error([data.message || "Batch rejected", details].filter(Boolean).join("\n"));
+  }
+  if (typeof EventSource === "undefined") return pollBatch(data.batch_id, onUpdate);
+
+  return new Promise((resolve) => {
+    const source = new EventSource(`${BACKEND_URL}/batch/${data.batch_id}/events`);
+    source.addEventListener("progress", (event) => {
+      onUpdate(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener("done", (event) => {
+      source.close();
+      const batch = JSON.parse((event as MessageEvent).data);
+      onUpdate(batch);
+      resolve(batch);
+    });
+    source.onerror = () => {
+      source.close();
+      resolve(pollBatch(data.batch_id, onUpdate));
+    };
+  });
+};
@@ -0,0 +1,53 @@
+const BACKEND_URL = "http://localhost:8200";
+
+const POLL_INTERVAL_MS = 500;
+
+export type JobProgress = {
+  frame: number | null;
+  fps: number | null;
+  out_time: number | null;
+  speed: number | null;
+  duration: number | null;
+  percent: number | null;
+  eta: number | null;
+  state: "running" | "end";
+  step?: string;
+};
+
+const pollJob = async (jobId: string) => {
+  while (true) {
+    const resp = await fetch(`${BACKEND_URL}/jobs/${jobId}`);
+    const job = await resp.json();
+    if (!resp.ok) {
+      return { success: false, message: job.message || "Job lookup failed" };
+    }
+    if (job.status === "done" || job.status === "failed") {
+      return job.result || { success: false, message: `Job ${job.status}` };
+    }
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+};
+
+// /run queues work on the backend and answers with a job id.
+// Follow the job's /events stream (falling back to polling) and hand back the handler's result.
+export const waitForJob = (data: any, onProgress?: (progress: JobProgress) => void): Promise<any> => {
+  if (!data || !data.job_id) return Promise.resolve(data);
+  if (typeof EventSource === "undefined") return pollJob(data.job_id);
+
+  return new Promise((resolve) => {
+    const source = new EventSource(`${BACKEND_URL}/jobs/${data.job_id}/events`);
+    source.addEventListener("progress", (event) => {
+      const job = JSON.parse((event as MessageEvent).data);
+      if (job.progress && onProgress) onProgress(job.progress);
+    });
+    source.addEventListener("done", (event) => {
+      source.close();
+      const job = JSON.parse((event as MessageEvent).data);
+      resolve(job.result || { success: false, message: `Job ${job.status}` });
+    });
+    source.onerror = () => {
+      source.close();
+      resolve(pollJob(data.job_id));
+    };
+  });
+};
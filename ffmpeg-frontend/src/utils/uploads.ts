@@ -0,0 +1,41 @@
+import axios from "axios";
+
+const BACKEND_URL = "http://localhost:8200";
+
+// Files above this size go through the resumable /uploads API.
+export const CHUNKED_UPLOAD_THRESHOLD = 64 * 1024 * 1024;
+const CHUNK_SIZE = 16 * 1024 * 1024;
+const MAX_RETRIES = 5;
+
+// Upload a large file in offset-addressed chunks. A failed chunk is retried
+// from whatever offset the backend reports it actually received.
+export const uploadFileChunked = async (file: File): Promise<string | null> => {
+  const created = await axios.post(`${BACKEND_URL}/uploads`, {
+    filename: file.name,
+    size: file.size,
+  });
+  const uploadId = created.data.upload_id;
+  let offset = created.data.offset || 0;
+  let retries = 0;
+
+  while (true) {
+    const end = Math.min(offset + CHUNK_SIZE, file.size);
+    try {
+      const resp = await axios.put(`${BACKEND_URL}/uploads/${uploadId}`, file.slice(offset, end), {
+        headers: {
+          "Content-Type": "application/octet-stream",
+          "Upload-Offset": String(offset),
+        },
+      });
+      retries = 0;
+      if (resp.data.complete) {
+        return resp.data.filenames?.[0] ?? null;
+      }
+      offset = resp.data.offset;
+    } catch (error: any) {
+      if (++retries > MAX_RETRIES) throw error;
+      const status = await axios.get(`${BACKEND_URL}/uploads/${uploadId}`);
+      offset = status.data.offset;
+    }
+  }
+};